@@ -2,6 +2,7 @@ from django.shortcuts import render
 
 # Create your views here.
 from rest_framework import generics
+from tracker.pagination import KeysetPagination
 from .models import CustomUser
 from .serializers import RegisterSerializer
 
@@ -15,6 +16,8 @@ class RegisterView(generics.CreateAPIView):
     
 class AccountListView(generics.ListCreateAPIView):
     serializer_class = RegisterSerializer
+    pagination_class = KeysetPagination
+    ordering = ['id']
     
     def get_queryset(self):
         return CustomUser.objects.filter(is_staff=False)
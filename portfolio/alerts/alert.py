@@ -1,45 +1,54 @@
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework import permissions, status
 from rest_framework.response import Response
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+from tracker.prices import current_prices
 from .models import Alert
-import requests
-from decimal import Decimal
-
-COINGECKO_BASE = "https://api.coingecko.com/api/v3"
 
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def check_alerts(request):
-    alerts = Alert.objects.filter(user=request.user, triggered=False)
-    triggered_alerts = []
-
-    for alert in alerts:
-        cg_id = alert.coin.coingecko_id
-        price_url = f"{COINGECKO_BASE}/simple/price?ids={cg_id}&vs_currencies=usd"
-        resp = requests.get(price_url)
-
-        if resp.status_code != 200:
-            continue
-
-        data = resp.json()
-        current_price = data.get(cg_id, {}).get("usd")
-        if not current_price:
-            continue
-
-        current_price = Decimal(str(current_price))
-        target_price = Decimal(str(alert.target_price))
-        tolerance = target_price * Decimal("0.001")  # 0.1% tolerance range
-
-        # Check if within tolerance range (≈ target)
-        if abs(current_price - target_price) <= tolerance:
-            alert.trigger()  # use your model’s trigger() method
-            triggered_alerts.append({
-                "coin": alert.coin.name,
-                "target": float(target_price),
-                "current": float(current_price),
-                "message": alert.message or f"{alert.coin.name} reached approximately ${target_price:.2f}!",
-            })
+    """
+    Return the caller's alerts triggered by the engine (alerts.engine runs
+    after every price refresh) since the last poll, i.e. not yet delivered,
+    or every one triggered since `?since=<iso datetime>`. Returned alerts
+    are marked delivered.
+    """
+    alerts = (
+        Alert.objects.filter(user=request.user, triggered=True)
+        .select_related("coin")
+        .order_by("-triggered_at")
+    )
+
+    since = request.GET.get("since")
+    if since:
+        try:
+            since_dt = parse_datetime(since)
+        except ValueError:  # well-formed but not a real date, e.g. month 13
+            since_dt = None
+        if since_dt is None:
+            return Response({"error": "since must be an ISO 8601 datetime"}, status=status.HTTP_400_BAD_REQUEST)
+        alerts = alerts.filter(triggered_at__gte=since_dt)
+    else:
+        alerts = alerts.filter(delivered_at__isnull=True)
+
+    alerts = list(alerts)
+    undelivered = [alert.id for alert in alerts if alert.delivered_at is None]
+    if undelivered:
+        Alert.objects.filter(id__in=undelivered).update(delivered_at=now())
+    prices = current_prices([alert.coin_id for alert in alerts])
+    triggered_alerts = [
+        {
+            "coin": alert.coin.name,
+            "target": float(alert.target_price),
+            "current": float(prices.price(alert.coin_id)),
+            "triggered_at": alert.triggered_at,
+            "message": alert.message or f"{alert.coin.name} reached approximately ${alert.target_price:.2f}!",
+        }
+        for alert in alerts
+    ]
 
     if not triggered_alerts:
         return Response({"message": "No alerts triggered yet."}, status=status.HTTP_200_OK)
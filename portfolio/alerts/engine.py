@@ -0,0 +1,56 @@
+from decimal import Decimal
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Alert
+
+
+# A target within 0.1% of the new price fires even if it was not crossed,
+# matching the tolerance check_alerts has always used.
+TOLERANCE = Decimal("0.001")
+PRICE_QUANT = Decimal("0.00000001")
+
+# Coins per query; keeps the OR'ed range conditions well below SQLite's expression depth limit.
+EVAL_CHUNK_SIZE = 200
+
+
+def crossed_range(old_price, new_price):
+    """Inclusive (low, high) range of target prices hit by a move from old to new."""
+    if old_price is None:
+        old_price = new_price
+    low = min(old_price, new_price, new_price / (1 + TOLERANCE))
+    high = max(old_price, new_price, new_price / (1 - TOLERANCE))
+    return low.quantize(PRICE_QUANT), high.quantize(PRICE_QUANT)
+
+
+def trigger_alerts(alerts, at=None):
+    """Mark `alerts` as triggered with a single bulk update."""
+    at = at or timezone.now()
+    for alert in alerts:
+        alert.triggered = True
+        alert.triggered_at = at
+        alert.message = f"{alert.coin.name} has reached ${alert.target_price}!"
+    Alert.objects.bulk_update(alerts, ["triggered", "triggered_at", "message"])
+    return alerts
+
+
+def evaluate_price_changes(changes):
+    """
+    Trigger every untriggered alert whose target_price lies between the old
+    and new price of a PriceChange. Each coin is an indexed range lookup on
+    (coin, target_price) over untriggered alerts, so the cost follows the
+    number of alerts crossed rather than the number of alerts stored.
+    Returns the alerts that were triggered.
+    """
+    triggered = []
+    for start in range(0, len(changes), EVAL_CHUNK_SIZE):
+        condition = Q()
+        for change in changes[start:start + EVAL_CHUNK_SIZE]:
+            condition |= Q(coin_id=change.coin_id, target_price__range=crossed_range(change.old_price, change.new_price))
+
+        alerts = list(Alert.objects.filter(condition, triggered=False).select_related("coin"))
+        if alerts:
+            triggered.extend(trigger_alerts(alerts))
+
+    return triggered
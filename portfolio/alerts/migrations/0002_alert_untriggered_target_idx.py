@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0001_initial'),
+        ('tracker', '0004_pricetick_pricecandle'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(condition=models.Q(('triggered', False)), fields=['coin', 'target_price'], name='alert_untriggered_target_idx'),
+        ),
+    ]
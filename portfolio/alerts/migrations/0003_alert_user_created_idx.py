@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0002_alert_untriggered_target_idx'),
+        ('tracker', '0006_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(fields=['user', '-created_at'], name='alert_user_created_idx'),
+        ),
+    ]
@@ -15,9 +15,22 @@ class Alert(models.Model):
     target_price = models.DecimalField(max_digits=20, decimal_places=8)
     triggered = models.BooleanField(default=False)
     triggered_at = models.DateTimeField(null=True, blank=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)  # first returned by check_alerts
     created_at = models.DateTimeField(auto_now_add=True)
     message = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # range lookups by alerts.engine after each price refresh
+            models.Index(
+                fields=["coin", "target_price"],
+                condition=models.Q(triggered=False),
+                name="alert_untriggered_target_idx",
+            ),
+            # keyset pagination of a user's alert list
+            models.Index(fields=["user", "-created_at"], name="alert_user_created_idx"),
+        ]
+
     def trigger(self):
         """Mark this alert as triggered and set a message."""
         self.triggered = True
@@ -1,9 +1,12 @@
 from rest_framework import serializers
+from tracker.prices import current_prices
 from .models import Alert
 
+PRICE_FIELD = serializers.DecimalField(max_digits=20, decimal_places=8)  # renders prices like Coin.price
+
 class AlertSerializer(serializers.ModelSerializer):
     coin_name = serializers.CharField(source='coin.name', read_only=True)
-    current_price = serializers.DecimalField(source='coin.price', read_only=True, max_digits=20, decimal_places=8)
+    current_price = serializers.SerializerMethodField()
 
     class Meta:
         model = Alert
@@ -13,3 +16,9 @@ class AlertSerializer(serializers.ModelSerializer):
             'triggered', 'triggered_at', 'created_at', 'message'
         ]
         read_only_fields = ['triggered', 'triggered_at', 'created_at', 'message']
+
+    def get_current_price(self, obj):
+        # from the request's price snapshot (tracker.prices), not the joined coin row
+        price = current_prices([obj.coin_id]).price(obj.coin_id)
+        return PRICE_FIELD.to_representation(price) if price is not None else None
+
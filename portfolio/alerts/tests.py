@@ -1,3 +1,106 @@
+import json
+from decimal import Decimal
+
 from django.test import TestCase
+from rest_framework.test import APITestCase
+
+from accounts.models import CustomUser
+from tracker.models import Coin
+from tracker.utils import PriceChange
+from .engine import evaluate_price_changes
+from .models import Alert
+
+
+class AlertEngineTestCase(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="a@example.com", password="pw")
+        self.coin = Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price="100")
+        self.other = Coin.objects.create(coingecko_id="ethereum", name="Ethereum", symbol="ETH", price="100")
+
+    def alert(self, target, coin=None):
+        return Alert.objects.create(user=self.user, coin=coin or self.coin, target_price=target)
+
+    def test_triggers_only_crossed_targets(self):
+        up = self.alert("105")
+        down = self.alert("95")
+        beyond = self.alert("120")
+        other_coin = self.alert("105", coin=self.other)
+
+        triggered = evaluate_price_changes([PriceChange(self.coin.id, Decimal("100"), Decimal("110"))])
+
+        self.assertEqual({a.id for a in triggered}, {up.id})
+        for alert, fired in ((up, True), (down, False), (beyond, False), (other_coin, False)):
+            alert.refresh_from_db()
+            self.assertEqual(alert.triggered, fired)
+        self.assertIsNotNone(up.triggered_at)
+
+    def test_triggers_falling_price_and_tolerance(self):
+        down = self.alert("95")
+        near = self.alert("89.95")
+
+        evaluate_price_changes([PriceChange(self.coin.id, Decimal("100"), Decimal("90"))])
+
+        self.assertTrue(Alert.objects.get(id=down.id).triggered)
+        self.assertTrue(Alert.objects.get(id=near.id).triggered)
+
+    def test_bulk_trigger_is_one_update(self):
+        for target in ("101", "102", "103"):
+            self.alert(target)
+
+        with self.assertNumQueries(2):
+            triggered = evaluate_price_changes([PriceChange(self.coin.id, Decimal("100"), Decimal("110"))])
+        self.assertEqual(len(triggered), 3)
+
+    def test_already_triggered_alerts_are_skipped(self):
+        alert = self.alert("105")
+        Alert.objects.filter(id=alert.id).update(triggered=True)
+
+        self.assertEqual(evaluate_price_changes([PriceChange(self.coin.id, Decimal("100"), Decimal("110"))]), [])
+
+
+class CheckAlertsTestCase(APITestCase):
+
+    def test_returns_triggered_alerts_without_upstream_calls(self):
+        user = CustomUser.objects.create_user(email="b@example.com", password="pw")
+        coin = Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price="110")
+        Alert.objects.create(user=user, coin=coin, target_price="105")
+        evaluate_price_changes([PriceChange(coin.id, Decimal("100"), Decimal("110"))])
+
+        self.client.force_authenticate(user)
+        response = self.client.get("/api/alerts/check/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["triggered"]), 1)
+
+        # delivered: the next poll only reports newly triggered alerts, ?since= still finds it
+        self.assertNotIn("triggered", self.client.get("/api/alerts/check/").data)
+        since = self.client.get("/api/alerts/check/", {"since": "2000-01-01T00:00:00Z"})
+        self.assertEqual(len(since.data["triggered"]), 1)
+
+    def test_invalid_since_answers_400(self):
+        user = CustomUser.objects.create_user(email="b@example.com", password="pw")
+        self.client.force_authenticate(user)
+
+        for since in ("yesterday", "2025-13-45T00:00:00"):
+            with self.subTest(since=since):
+                self.assertEqual(self.client.get("/api/alerts/check/", {"since": since}).status_code, 400)
+
+
+class ExportAlertsTestCase(APITestCase):
+
+    def test_streams_own_alerts_as_ndjson(self):
+        user = CustomUser.objects.create_user(email="c@example.com", password="pw")
+        other = CustomUser.objects.create_user(email="d@example.com", password="pw")
+        coin = Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price="100")
+        Alert.objects.create(user=user, coin=coin, target_price="105")
+        Alert.objects.create(user=other, coin=coin, target_price="90")
+
+        self.client.force_authenticate(user)
+        response = self.client.get("/api/alerts/export/", {"output": "ndjson"})
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]["symbol"], Decimal(rows[0]["target_price"])), ("BTC", Decimal("105")))
 
-# Create your tests here.
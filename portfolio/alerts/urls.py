@@ -1,8 +1,9 @@
 from django.urls import path
-from .views import AlertListCreateView
+from .views import AlertListCreateView, export_alerts
 from .alert import check_alerts
 
 urlpatterns = [
     path('', AlertListCreateView.as_view(), name='alert_list_create'),
     path('check/', check_alerts, name='check_alerts'),
+    path('export/', export_alerts, name='export_alerts'),
 ]
@@ -1,13 +1,40 @@
 from rest_framework import generics, permissions
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
+from tracker.exports import stream_export, EXPORT_CHUNK_SIZE, FORMATS as EXPORT_FORMATS
+from tracker.pagination import KeysetPagination
 from .models import Alert
 from .serializers import AlertSerializer
 
 class AlertListCreateView(generics.ListCreateAPIView):
     serializer_class = AlertSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+    ordering = ['-created_at']
 
     def get_queryset(self):
-        return Alert.objects.filter(user=self.request.user).order_by('-created_at')
+        return Alert.objects.filter(user=self.request.user).select_related("coin")
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
+
+
+EXPORT_FIELDS = ["id", "coin__symbol", "alert_type", "target_price", "triggered", "triggered_at", "created_at", "message"]
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAuthenticated])
+def export_alerts(request):
+    """Stream the requester's alerts as ?output=csv (default) or ndjson."""
+    output = request.query_params.get("output", "csv").lower()
+    if output not in EXPORT_FORMATS:
+        raise ValidationError({"output": f"Must be one of {', '.join(EXPORT_FORMATS)}."})
+
+    rows = (
+        Alert.objects.filter(user=request.user)
+        .order_by("id")
+        .values_list(*EXPORT_FIELDS)
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    header = [field.replace("coin__", "") for field in EXPORT_FIELDS]
+    return stream_export("alerts", header, rows, output)
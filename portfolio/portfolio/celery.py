@@ -9,13 +9,7 @@ app = Celery('portfolio')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
-
-app.conf.beat_schedule = {
-    "update-coin-prices-every-10-minutes": {
-        "task": "tracker.utils.update_coin_prices",  # path to your task
-        "schedule": 600.0,  # 600 seconds = 10 minutes
-    },
-}
+# The beat schedule lives in settings.CELERY_BEAT_SCHEDULE.
 
 
 @app.task(bind=True)
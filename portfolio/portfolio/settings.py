@@ -48,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tracker.metrics.MetricsMiddleware',  # first, so it times the whole stack
+    'tracker.prices.PriceSnapshotMiddleware',  # one price snapshot per request
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -91,6 +93,24 @@ DATABASES = {
 }
 
 
+# Cache
+# Shared by web, ASGI and Celery processes: the price version (and with it ETags and the
+# price table), the live feed, the outbound budget and task metrics only work across
+# processes through it (tracker.cache.shared_cache refuses a per-process backend).
+# Same Redis as the Celery broker, another database.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+    }
+}
+
+# A per-process cache (LocMemCache) is only correct when everything runs in one process,
+# as the test suite does (portfolio.test_settings)
+ALLOW_LOCAL_CACHE = False
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -154,6 +174,30 @@ REST_FRAMEWORK = {
 
 
 
+# Market data backend, see tracker/providers.py
+PRICE_PROVIDER = {
+    "BACKEND": "tracker.providers.CoinGeckoProvider",
+    "OPTIONS": {"base_url": "https://api.coingecko.com/api/v3", "timeout": 10},
+    # cache provider answers; TTL overrides tracker.providers.DEFAULT_CACHE_TTL
+    "CACHE": {"ALIAS": "default", "NEGATIVE_TTL": 300},
+    # outbound budget shared by web and Celery workers through the shared cache: the public
+    # API allows ~30 calls/min; see tracker/ratelimit.py for the priority classes
+    "RATE_LIMIT": {"BACKEND": "tracker.ratelimit.CacheBucket", "RATE": 0.5, "BURST": 10},
+}
+
+
+
+# Locks such as the single price refresh at a time (tracker/leases.py);
+# tracker.leases.LocalLeases is an in-memory stand-in for tests.
+LEASE_BACKEND = "tracker.leases.DatabaseLeases"
+
+
+# /metrics (Prometheus text format) needs a token, sent by scrapers as
+# "Authorization: Bearer <token>"; without one it is only served with DEBUG on.
+METRICS_TOKEN = None
+
+
+
 #Celery setup
 
 CELERY_BROKER_URL = "redis://localhost:6379/0"
@@ -166,11 +210,37 @@ CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = "Africa/Lagos"
 
 
+# Prices refresh per demand tier (tracker/tiers.py): hot coins every minute,
+# warm ones every 10 minutes, the long tail hourly.
 CELERY_BEAT_SCHEDULE = {
-    "update-coin-prices-every-5-minutes": {
+    "refresh-hot-coin-prices-every-minute": {
+        "task": "tracker.utils.update_coin_prices",
+        "schedule": crontab(minute="*"),
+        "kwargs": {"tier": "hot"},
+    },
+    "refresh-warm-coin-prices-every-10-minutes": {
+        "task": "tracker.utils.update_coin_prices",
+        "schedule": crontab(minute="*/10"),
+        "kwargs": {"tier": "warm"},
+    },
+    "refresh-cold-coin-prices-hourly": {
         "task": "tracker.utils.update_coin_prices",
-        "schedule": crontab(minute="*/5"),
-    },    
+        "schedule": crontab(minute=30),
+        "kwargs": {"tier": "cold"},
+    },
+    "recompute-refresh-tiers-every-10-minutes": {
+        "task": "tracker.utils.recompute_refresh_tiers",
+        "schedule": crontab(minute="5-59/10"),
+    },
+    "rollup-price-ticks-every-minute": {
+        "task": "tracker.utils.rollup_price_ticks",
+        "schedule": crontab(minute="*"),
+    },
 }
 
 
+# Price tick history retention per resolution (None keeps forever),
+# overrides tracker.ticks.DEFAULT_RETENTION
+# PRICE_HISTORY_RETENTION = {"tick": timedelta(days=2), "1m": timedelta(days=7)}
+
+
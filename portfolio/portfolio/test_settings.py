@@ -0,0 +1,17 @@
+"""
+Settings for the test suite, which runs in a single process and so may
+keep the shared cache in a per-process LocMemCache.
+
+`manage.py test` picks this module by default; other runners need
+DJANGO_SETTINGS_MODULE=portfolio.test_settings.
+"""
+from .settings import *  # noqa: F401,F403
+
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+ALLOW_LOCAL_CACHE = True
@@ -18,6 +18,8 @@ from django.urls import path, include
 
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
+from tracker.views import metrics
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -29,6 +31,8 @@ urlpatterns = [
     
     path("api/token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),  # login
     path("api/token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),  # refresh token
+
+    path("metrics", metrics, name="metrics"),  # Prometheus scrape target
     
 ]
 
@@ -0,0 +1,266 @@
+"""
+Incremental maintenance of PortfolioAggregate.
+
+Holding writes apply their own value/count delta (see tracker.signals) and
+price changes apply Δprice × Σamount held to every group holding the coin,
+so reading a dashboard total is a single indexed lookup. rebuild_aggregates()
+recomputes everything from scratch for the consistency check.
+
+Both kinds of write run in the transaction that changes the row (a holding,
+a coin's price), and a holding is valued at its coin's price read under a
+row lock. A concurrent price write therefore either commits first, its
+Σamount counting the holding's previous state at the new price, or waits
+for the holding's transaction and counts its new state: never both.
+"""
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils.timezone import now
+
+from .models import Coin, Portfolio, PortfolioAggregate
+
+
+ALL_HOLDINGS = ""  # PortfolioAggregate.name of the row covering every holding of a user
+ZERO = Decimal("0")
+USER_CHUNK_SIZE = 500
+AGGREGATE_FIELDS = ["total_value", "asset_count", "top_holding", "top_value", "updated_at"]
+
+Holding = namedtuple("Holding", ["id", "user_id", "name", "coin_id", "amount"])
+
+
+def holding_state(portfolio):
+    """Holding snapshot of a Portfolio; apply_holding_change() values it."""
+    # unsaved/unrefreshed instances may still carry the raw str/int they were built with
+    amount = Decimal(str(portfolio.amount))
+    return Holding(portfolio.id, portfolio.user_id, portfolio.name, portfolio.coin_id, amount)
+
+
+def group_keys(user_id, name):
+    return [(user_id, ALL_HOLDINGS), (user_id, name)]
+
+
+def _locked_aggregates(keys):
+    """Create missing rows for `keys`, then return them locked for update."""
+    PortfolioAggregate.objects.bulk_create(
+        [PortfolioAggregate(user_id=user_id, name=name) for user_id, name in keys],
+        ignore_conflicts=True,
+    )
+    rows = PortfolioAggregate.objects.select_for_update().filter(user_id__in={user_id for user_id, _ in keys})
+    return {(a.user_id, a.name): a for a in rows if (a.user_id, a.name) in keys}
+
+
+def _top_holdings(keys):
+    """{(user_id, name): (holding id, value)} of the most valuable live holding per group."""
+    best = {}
+    rows = (
+        Portfolio.objects.filter(user_id__in={user_id for user_id, _ in keys})
+        .order_by("id")
+        .values_list("id", "user_id", "name", "amount", "coin__price")
+    )
+    for holding_id, user_id, name, amount, price in rows.iterator():
+        value = amount * (price or ZERO)
+        for key in group_keys(user_id, name):
+            if key in keys and (key not in best or value > best[key][1]):
+                best[key] = (holding_id, value)
+    return best
+
+
+def _set_top(aggregate, top):
+    aggregate.top_holding_id, aggregate.top_value = top if top else (None, ZERO)
+
+
+def _rerank_tops(aggregates, coin_ids):
+    """
+    Re-rank the top holding of `aggregates` ({key: PortfolioAggregate})
+    after the prices of `coin_ids` moved, reading only the holdings of
+    those coins: the others kept their value, so the top is the old one or
+    one of these. Only groups whose top holding lost value (an unchanged
+    holding may now lead) are re-read in full.
+    """
+    best, values = {}, {}
+    rows = (
+        Portfolio.objects.filter(user_id__in={user_id for user_id, _ in aggregates}, coin_id__in=coin_ids)
+        .order_by("id")
+        .values_list("id", "user_id", "name", "amount", "coin__price")
+    )
+    for holding_id, user_id, name, amount, price in rows.iterator():
+        value = values[holding_id] = amount * (price or ZERO)
+        for key in group_keys(user_id, name):
+            if key in aggregates and (key not in best or value > best[key][1]):
+                best[key] = (holding_id, value)
+
+    full = set()
+    for key, aggregate in aggregates.items():
+        top_id, top_value = aggregate.top_holding_id, aggregate.top_value
+        if top_id is None or values.get(top_id, top_value) < top_value:
+            full.add(key)
+            continue
+        top_value = values.get(top_id, top_value)
+        candidate = best.get(key)
+        _set_top(aggregate, candidate if candidate and candidate[1] > top_value else (top_id, top_value))
+
+    if full:
+        tops = _top_holdings(full)
+        for key in full:
+            _set_top(aggregates[key], tops.get(key))
+
+
+def apply_holding_change(old, new):
+    """
+    Apply the move of one holding from state `old` to `new` (Holding tuples,
+    None when the holding did not exist before / no longer exists). Call it
+    in the transaction that wrote the holding: both states are valued at
+    the coin prices locked here, which a price write can't move until commit.
+    """
+    states = [(state, sign) for state, sign in ((old, -1), (new, 1)) if state is not None]
+    holding_id = (new or old).id
+    new_keys = group_keys(new.user_id, new.name) if new is not None else []
+
+    with transaction.atomic():
+        prices = dict(
+            Coin.objects.select_for_update()
+            .filter(id__in={state.coin_id for state, _ in states})
+            .order_by("id")
+            .values_list("id", "price")
+        )
+        deltas = defaultdict(lambda: [ZERO, 0])
+        for state, sign in states:
+            for key in group_keys(state.user_id, state.name):
+                deltas[key][0] += sign * state.amount * (prices.get(state.coin_id) or ZERO)
+                deltas[key][1] += sign
+        new_value = new.amount * (prices.get(new.coin_id) or ZERO) if new is not None else ZERO
+
+        aggregates = _locked_aggregates(set(deltas))
+        stale = set()
+        for key, aggregate in aggregates.items():
+            value_delta, count_delta = deltas[key]
+            aggregate.total_value += value_delta
+            aggregate.asset_count += count_delta
+            aggregate.updated_at = now()
+            if key in new_keys and (aggregate.top_holding_id is None or new_value > aggregate.top_value):
+                _set_top(aggregate, (new.id, new_value))
+            elif aggregate.top_holding_id in (holding_id, None) and aggregate.asset_count > 0:
+                # the top holding shrank, left the group or was deleted
+                stale.add(key)
+            elif aggregate.asset_count <= 0:
+                _set_top(aggregate, None)
+
+        if stale:
+            tops = _top_holdings(stale)
+            for key in stale:
+                _set_top(aggregates[key], tops.get(key))
+
+        PortfolioAggregate.objects.bulk_update(aggregates.values(), AGGREGATE_FIELDS)
+
+
+def apply_price_changes(changes):
+    """
+    Apply a changed-set of PriceChange(coin_id, old_price, new_price):
+    every group holding a changed coin moves by Δprice × Σamount held, and
+    the top holding of those groups is re-ranked. Returns groups updated.
+    Call it in the transaction that wrote the prices, after the write.
+    """
+    price_deltas = {
+        c.coin_id: c.new_price - (c.old_price or ZERO)
+        for c in changes
+        if c.new_price != c.old_price
+    }
+    if not price_deltas:
+        return 0
+
+    held = (
+        Portfolio.objects.filter(coin_id__in=price_deltas)
+        .order_by()
+        .values("user_id", "name", "coin_id")
+        .annotate(held=Sum("amount"))
+    )
+    deltas_by_user = defaultdict(lambda: defaultdict(lambda: ZERO))
+    for row in held:
+        delta = price_deltas[row["coin_id"]] * row["held"]
+        for key in group_keys(row["user_id"], row["name"]):
+            deltas_by_user[row["user_id"]][key] += delta
+
+    updated = 0
+    users = sorted(deltas_by_user)
+    for start in range(0, len(users), USER_CHUNK_SIZE):
+        deltas = {
+            key: delta
+            for user_id in users[start:start + USER_CHUNK_SIZE]
+            for key, delta in deltas_by_user[user_id].items()
+        }
+        with transaction.atomic():
+            aggregates = _locked_aggregates(set(deltas))
+            for key, aggregate in aggregates.items():
+                aggregate.total_value += deltas[key]
+                aggregate.updated_at = now()
+            _rerank_tops(aggregates, list(price_deltas))
+            PortfolioAggregate.objects.bulk_update(aggregates.values(), AGGREGATE_FIELDS)
+        updated += len(aggregates)
+
+    return updated
+
+
+def rebuild_aggregates(portfolio_model=Portfolio):
+    """
+    Recompute every aggregate from the holdings table (of `portfolio_model`,
+    e.g. a migration's historical model).
+    Returns {(user_id, name): (total_value, asset_count, top_holding_id, top_value)}.
+    """
+    expected = {}
+    rows = portfolio_model.objects.order_by("id").values_list("id", "user_id", "name", "amount", "coin__price")
+    for holding_id, user_id, name, amount, price in rows.iterator(chunk_size=2000):
+        value = amount * (price or ZERO)
+        for key in group_keys(user_id, name):
+            total, count, top_id, top_value = expected.get(key, (ZERO, 0, None, ZERO))
+            if top_id is None or value > top_value:
+                top_id, top_value = holding_id, value
+            expected[key] = (total + value, count + 1, top_id, top_value)
+    return expected
+
+
+def diff_aggregates(tolerance=Decimal("0.000001")):
+    """
+    Compare stored aggregates with rebuild_aggregates().
+    Returns (expected, [(key, stored or None, expected or None), ...]).
+    """
+    expected = rebuild_aggregates()
+    stored = {
+        (a.user_id, a.name): (a.total_value, a.asset_count, a.top_holding_id, a.top_value)
+        for a in PortfolioAggregate.objects.all()
+    }
+
+    diffs = []
+    for key in sorted(set(expected) | set(stored), key=lambda k: (k[0], k[1])):
+        have, want = stored.get(key), expected.get(key)
+        if have is not None and want is None and have[1] == 0:
+            continue  # emptied group, equivalent to no row
+        if (
+            have is None or want is None
+            or abs(have[0] - want[0]) > tolerance
+            or have[1] != want[1]
+            or abs(have[3] - want[3]) > tolerance
+        ):
+            diffs.append((key, have, want))
+    return expected, diffs
+
+
+def replace_aggregates(expected, aggregate_model=PortfolioAggregate):
+    """Overwrite the aggregate table (of `aggregate_model`) with `expected` from rebuild_aggregates()."""
+    with transaction.atomic():
+        aggregate_model.objects.all().delete()
+        aggregate_model.objects.bulk_create(
+            [
+                aggregate_model(
+                    user_id=user_id,
+                    name=name,
+                    total_value=total,
+                    asset_count=count,
+                    top_holding_id=top_id,
+                    top_value=top_value,
+                )
+                for (user_id, name), (total, count, top_id, top_value) in expected.items()
+            ],
+            batch_size=1000,
+        )
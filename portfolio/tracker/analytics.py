@@ -0,0 +1,131 @@
+"""
+Vectorized performance analytics over PortfolioHistory.
+
+A history is loaded once into NumPy arrays (dates, values) and every metric
+is computed on whole arrays, never row by row.
+"""
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from django.db.models import Sum
+
+from .models import PortfolioHistory
+
+
+PERIODS_PER_YEAR = 365  # crypto trades every day
+
+
+def _to_arrays(rows):
+    rows = list(rows)
+    if not rows:
+        return np.array([], dtype="datetime64[D]"), np.array([], dtype=np.float64)
+    dates, values = zip(*rows)
+    return np.array(dates, dtype="datetime64[D]"), np.array(values, dtype=np.float64)
+
+
+def load_holding_series(portfolio_id):
+    """(dates, values) of one holding's snapshots, oldest first, in one query."""
+    return _to_arrays(
+        PortfolioHistory.objects.filter(portfolio_id=portfolio_id)
+        .order_by("date")
+        .values_list("date", "value_usd")
+    )
+
+
+def load_user_series(user):
+    """(dates, values) of a user's combined daily value across holdings, in one query."""
+    return _to_arrays(
+        PortfolioHistory.objects.filter(portfolio__user=user)
+        .values("date")
+        .annotate(total=Sum("value_usd"))
+        .order_by("date")
+        .values_list("date", "total")
+    )
+
+
+def daily_returns(values):
+    """Simple period-over-period returns; periods starting from 0 yield 0."""
+    previous = values[:-1]
+    return np.divide(values[1:] - previous, previous, out=np.zeros(len(previous)), where=previous != 0)
+
+
+def cumulative_return(values):
+    if len(values) < 2 or values[0] == 0:
+        return 0.0
+    return values[-1] / values[0] - 1
+
+
+def annualized_volatility(returns, periods=PERIODS_PER_YEAR):
+    if len(returns) < 2:
+        return 0.0
+    return returns.std(ddof=1) * math.sqrt(periods)
+
+
+def max_drawdown(values):
+    """Largest peak-to-trough fall as a (negative) fraction of the peak."""
+    if len(values) == 0:
+        return 0.0
+    peaks = np.maximum.accumulate(values)
+    drawdowns = np.divide(values - peaks, peaks, out=np.zeros(len(values)), where=peaks != 0)
+    return drawdowns.min()
+
+
+def sharpe_ratio(returns, risk_free=0.0, periods=PERIODS_PER_YEAR):
+    if len(returns) < 2:
+        return None
+    excess = returns - risk_free / periods
+    std = excess.std(ddof=1)
+    return excess.mean() / std * math.sqrt(periods) if std > 0 else None
+
+
+def sortino_ratio(returns, risk_free=0.0, periods=PERIODS_PER_YEAR):
+    if len(returns) < 2:
+        return None
+    excess = returns - risk_free / periods
+    downside = math.sqrt(np.mean(np.minimum(excess, 0) ** 2))
+    return excess.mean() / downside * math.sqrt(periods) if downside > 0 else None
+
+
+def rolling_metrics(dates, returns, window, periods=PERIODS_PER_YEAR):
+    """Compounded return and annualized volatility of every `window`-period span."""
+    if window < 2 or len(returns) < window:
+        return {"dates": dates[:0], "returns": np.array([]), "volatility": np.array([])}
+    windows = sliding_window_view(returns, window)
+    return {
+        # returns[i] ends on dates[i + 1]
+        "dates": dates[window:],
+        "returns": np.prod(1 + windows, axis=1) - 1,
+        "volatility": windows.std(axis=1, ddof=1) * math.sqrt(periods),
+    }
+
+
+def _number(value):
+    """Plain float for JSON; NaN/inf become None."""
+    if value is None:
+        return None
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def performance_metrics(dates, values, window=None, risk_free=0.0, periods=PERIODS_PER_YEAR):
+    """Summary statistics (and optional rolling windows) of a value series."""
+    returns = daily_returns(values)
+    metrics = {
+        "observations": int(len(values)),
+        "cumulative_return": _number(cumulative_return(values)),
+        "annualized_volatility": _number(annualized_volatility(returns, periods)),
+        "max_drawdown": _number(max_drawdown(values)),
+        "sharpe_ratio": _number(sharpe_ratio(returns, risk_free, periods)),
+        "sortino_ratio": _number(sortino_ratio(returns, risk_free, periods)),
+    }
+    if window:
+        rolling = rolling_metrics(dates, returns, window, periods)
+        metrics["rolling"] = {
+            "window": window,
+            "points": [
+                {"date": str(d), "return": _number(r), "volatility": _number(v)}
+                for d, r, v in zip(rolling["dates"], rolling["returns"], rolling["volatility"])
+            ],
+        }
+    return metrics
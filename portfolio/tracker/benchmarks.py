@@ -0,0 +1,284 @@
+"""
+Endpoint and task benchmarks with committed budgets.
+
+seed() builds a dataset of a given scale; run_endpoints() requests every
+route of tracker, alerts and accounts against it, recording latency
+percentiles and the SQL queries of each request, and run_tasks() measures
+update_coin_prices and record_portfolio_snapshots in rows/sec.
+check_budgets() lists every result over its entry in BUDGETS.
+
+`manage.py benchmark` runs the suite on a throwaway test database; the test
+suite enforces the query budgets at small scales.
+"""
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+import numpy as np
+from celery import Task
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.models import CustomUser
+from alerts.models import Alert
+from .models import Coin, Portfolio, PortfolioHistory, PriceTick, Watchlist
+from .prices import price_table
+from .search import coin_index
+from .utils import update_coin_prices, record_portfolio_snapshots
+
+
+DEFAULT_SCALES = (10, 100, 1000)
+DEFAULT_REPEAT = 20
+HISTORY_DAYS = 30
+OTHER_USER_HOLDINGS = 5
+
+# price refreshes talk to this instead of CoinGecko
+BENCHMARK_PROVIDER = {"BACKEND": "tracker.providers.FakeProvider", "OPTIONS": {"universe": 100000}}
+
+Route = namedtuple("Route", ["name", "method", "path", "user", "data"])
+Budget = namedtuple("Budget", ["queries", "p95_ms"])
+TaskBudget = namedtuple("TaskBudget", ["min_rows_per_sec"])
+Result = namedtuple("Result", ["name", "scale", "status", "queries", "p50_ms", "p95_ms", "p99_ms"])
+TaskResult = namedtuple("TaskResult", ["name", "scale", "rows", "elapsed", "rows_per_sec"])
+
+
+def _get(name, path, user="owner", data=None):
+    return Route(name, "get", path, user, data)
+
+
+def _post(name, path, user="owner", data=None):
+    return Route(name, "post", path, user, data)
+
+
+# one entry per named route of tracker.urls, alerts.urls and accounts.urls;
+# paths and data are callables of (seeded context, iteration)
+ROUTES = [
+    _get("coin-list-create", lambda c, i: "/api/coins/", user=None),
+    _get("coin-detail", lambda c, i: f"/api/coins/{c['coin']}/", user=None),
+    _post("refresh-prices", lambda c, i: "/api/coins/update-prices/", user="admin"),
+    _get("refresh-job", lambda c, i: "/api/coins/update-prices/benchmark-job/", user="admin"),
+    _get("get-coin", lambda c, i: "/api/coins/search/fake-0/", user=None),
+    _get("coin-price-history", lambda c, i: f"/api/coins/{c['coin']}/history/", user=None),
+    _get("search-coin", lambda c, i: "/api/search-coin/?query=fake", user=None),
+    _get("portfolio-list-create", lambda c, i: "/api/portfolio/?include_history=true"),
+    _get("portfolio-detail", lambda c, i: f"/api/portfolio/{c['holding']}/"),
+    _get("portfolio-summary", lambda c, i: "/api/portfolio/summary/"),
+    _get("portfolio-dashboard", lambda c, i: "/api/portfolio/dashboard/"),
+    _get("portfolio-performance", lambda c, i: f"/api/portfolio/{c['holding']}/performance/?metrics=true"),
+    _get("combined-performance", lambda c, i: "/api/portfolio/performance/"),
+    _post("portfolio-snapshot", lambda c, i: "/api/snapshot/", user="admin"),
+    _get("insight", lambda c, i: "/api/insight/"),
+    _get("watchlist-list", lambda c, i: "/api/watchlist/"),
+    _get("watchlist-detail", lambda c, i: f"/api/watchlist/{c['watch']}/"),
+    _get("export-holdings", lambda c, i: "/api/export/holdings/"),
+    _get("export-history", lambda c, i: "/api/export/history/"),
+    _get("stream-prices", lambda c, i: f"/api/stream/prices/?token={c['token']}", user=None),
+    _get("alert_list_create", lambda c, i: "/api/alerts/"),
+    _get("check_alerts", lambda c, i: "/api/alerts/check/"),
+    _get("export_alerts", lambda c, i: "/api/alerts/export/"),
+    _post(
+        "register", lambda c, i: "/api/accounts/register/", user=None,
+        data=lambda c, i: {"email": f"bench-{c['scale']}-{i}@example.com", "name": "Bench", "password": "bench-Pass-123"},
+    ),
+    _get("list_accouns", lambda c, i: "/api/accounts/list/", user=None),
+]
+
+# queries per request must hold at every scale; latency is for the
+# largest default scale on a developer machine
+BUDGETS = {
+    "coin-list-create": Budget(queries=1, p95_ms=50),
+    "coin-detail": Budget(queries=1, p95_ms=20),
+    "refresh-prices": Budget(queries=None, p95_ms=3000),  # grows with coins / PRICE_CHUNK_SIZE
+    "refresh-job": Budget(queries=2, p95_ms=20),
+    "get-coin": Budget(queries=1, p95_ms=20),
+    "coin-price-history": Budget(queries=2, p95_ms=50),
+    "search-coin": Budget(queries=2, p95_ms=50),
+    "portfolio-list-create": Budget(queries=3, p95_ms=200),
+    "portfolio-detail": Budget(queries=1, p95_ms=30),
+    "portfolio-summary": Budget(queries=3, p95_ms=100),
+    "portfolio-dashboard": Budget(queries=1, p95_ms=20),
+    "portfolio-performance": Budget(queries=2, p95_ms=50),
+    "combined-performance": Budget(queries=1, p95_ms=100),
+    "portfolio-snapshot": Budget(queries=None, p95_ms=500),  # one upsert per chunk
+    "insight": Budget(queries=1, p95_ms=100),
+    "watchlist-list": Budget(queries=1, p95_ms=50),
+    "watchlist-detail": Budget(queries=1, p95_ms=30),
+    "export-holdings": Budget(queries=1, p95_ms=200),
+    "export-history": Budget(queries=1, p95_ms=1000),
+    "stream-prices": Budget(queries=2, p95_ms=50),
+    "alert_list_create": Budget(queries=1, p95_ms=200),
+    "check_alerts": Budget(queries=2, p95_ms=150),  # read + mark delivered
+    "export_alerts": Budget(queries=1, p95_ms=200),
+    "register": Budget(queries=2, p95_ms=1000),  # dominated by password hashing
+    "list_accouns": Budget(queries=1, p95_ms=100),
+    "update_coin_prices": TaskBudget(min_rows_per_sec=300),
+    "record_portfolio_snapshots": TaskBudget(min_rows_per_sec=5000),
+}
+
+
+def seed(scale):
+    """
+    Dataset of `scale`: as many coins, an owner holding each of them with
+    HISTORY_DAYS of snapshots, an alert and a watchlist entry per coin, and
+    scale // 10 other users with a few holdings each. Returns ids and
+    credentials the routes need.
+    """
+    refreshed_at = now()
+    coins = Coin.objects.bulk_create([
+        Coin(coingecko_id=f"fake-{i}", name=f"Fake Coin {i}", symbol=f"FK{i}", price=Decimal(100 + i), refreshed_at=refreshed_at)
+        for i in range(scale)
+    ])
+    owner = CustomUser.objects.create_user(email=f"owner-{scale}@example.com", name="Owner", password="pw")
+    admin = CustomUser.objects.create_superuser(email=f"admin-{scale}@example.com", name="Admin", password="pw")
+    others = [
+        CustomUser(email=f"user-{scale}-{i}@example.com", name=f"User {i}", password="!")
+        for i in range(scale // 10)
+    ]
+    CustomUser.objects.bulk_create(others)
+    others = list(CustomUser.objects.filter(email__startswith=f"user-{scale}-"))
+
+    # created one by one so the aggregates and signals see them, as in production
+    holdings = [Portfolio.objects.create(user=owner, name="main", coin=coin, amount=Decimal("1.5")) for coin in coins]
+    Portfolio.objects.bulk_create([
+        Portfolio(user=user, name="main", coin=coins[j % scale], amount=Decimal("2"))
+        for user in others for j in range(OTHER_USER_HOLDINGS)
+    ])
+    start = date.today() - timedelta(days=HISTORY_DAYS)
+    PortfolioHistory.objects.bulk_create([
+        PortfolioHistory(portfolio=holding, date=start + timedelta(days=d), value_usd=Decimal(100 + d))
+        for holding in holdings for d in range(HISTORY_DAYS)
+    ], batch_size=5000)
+    PriceTick.objects.bulk_create([
+        PriceTick(coin=coins[0], timestamp=now() - timedelta(minutes=m), price=coins[0].price)
+        for m in range(24 * 60)
+    ], batch_size=5000)
+    Alert.objects.bulk_create([
+        Alert(user=owner, coin=coin, target_price=coin.price * 2) for coin in coins
+    ])
+    watches = Watchlist.objects.bulk_create([Watchlist(user=owner, coin=coin) for coin in coins])
+
+    return {
+        "scale": scale,
+        "coin": coins[0].id,
+        "holding": holdings[0].id,
+        "watch": watches[0].id,
+        "users": {"owner": owner, "admin": admin, None: None},
+        "token": str(AccessToken.for_user(owner)),
+    }
+
+
+def _query_count(ctx):
+    return sum(1 for q in ctx.captured_queries if "SAVEPOINT" not in q["sql"])
+
+
+def measure(route, context, repeat):
+    client = APIClient()
+    user = context["users"][route.user]
+    if user is not None:
+        client.force_authenticate(user)
+
+    # the price table loads once per price version per process, not per request
+    price_table.current()
+    latencies, queries, status = [], 0, None
+    # one untimed warm-up request, so caches and lazy imports don't skew p95
+    for i in range(-1, repeat):
+        path = route.path(context, i)
+        data = route.data(context, i) if route.data else None
+        # a full query log (seeding can fill it) would capture nothing
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            response = getattr(client, route.method)(path, data, format="json" if data else None)
+            if response.streaming and route.name != "stream-prices":  # the SSE stream never ends
+                b"".join(response.streaming_content)
+            elapsed = (time.perf_counter() - started) * 1000
+        queries = max(queries, _query_count(ctx))
+        status = response.status_code
+        if i >= 0:
+            latencies.append(elapsed)
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return Result(route.name, context["scale"], status, queries, round(p50, 2), round(p95, 2), round(p99, 2))
+
+
+def _apply_in_process(task, args=None, kwargs=None, **options):
+    return task.apply(args, kwargs, **options)
+
+
+@contextmanager
+def eager_tasks():
+    """
+    Run tasks enqueued with apply_async() in-process, so e.g. the refresh
+    endpoint's work is measured. Task.apply() needs no broker, unlike
+    task_always_eager, which still opens a producer connection.
+    """
+    with patch.object(Task, "apply_async", _apply_in_process):
+        yield
+
+
+def run_endpoints(scale, repeat=DEFAULT_REPEAT, routes=None):
+    """Seed `scale` inside a rolled-back transaction and measure every route."""
+    results = []
+    with override_settings(PRICE_PROVIDER=BENCHMARK_PROVIDER), eager_tasks(), transaction.atomic():
+        cache.clear()
+        coin_index.clear()
+        context = seed(scale)
+        for route in routes or ROUTES:
+            results.append(measure(route, context, repeat))
+        transaction.set_rollback(True)
+    return results
+
+
+def _timed_task(name, scale, task, rows):
+    started = time.perf_counter()
+    task()
+    elapsed = time.perf_counter() - started
+    return TaskResult(name, scale, rows, round(elapsed, 3), round(rows / elapsed, 1) if elapsed else None)
+
+
+def run_tasks(scale):
+    """rows/sec of a price refresh over every coin and of a snapshot of every holding."""
+    with override_settings(PRICE_PROVIDER=BENCHMARK_PROVIDER), transaction.atomic():
+        cache.clear()
+        coin_index.clear()
+        seed(scale)
+        results = [
+            _timed_task("update_coin_prices", scale, update_coin_prices, Coin.objects.count()),
+            _timed_task("record_portfolio_snapshots", scale, record_portfolio_snapshots, Portfolio.objects.count()),
+        ]
+        transaction.set_rollback(True)
+    return results
+
+
+def check_budgets(results, latency=True):
+    """
+    Human-readable violations of BUDGETS. Timing budgets (latency and
+    throughput) can be skipped, e.g. in CI or at scales where fixed
+    overhead dominates.
+    """
+    violations = []
+    for result in results:
+        budget = BUDGETS.get(result.name)
+        if budget is None:
+            violations.append(f"{result.name}: no budget committed")
+        elif isinstance(result, TaskResult):
+            if latency and result.rows_per_sec is not None and result.rows_per_sec < budget.min_rows_per_sec:
+                violations.append(
+                    f"{result.name} @ {result.scale}: {result.rows_per_sec} rows/s < {budget.min_rows_per_sec}"
+                )
+        else:
+            if result.status >= 400:
+                violations.append(f"{result.name} @ {result.scale}: HTTP {result.status}")
+            if budget.queries is not None and result.queries > budget.queries:
+                violations.append(f"{result.name} @ {result.scale}: {result.queries} queries > {budget.queries}")
+            if latency and result.p95_ms > budget.p95_ms:
+                violations.append(f"{result.name} @ {result.scale}: p95 {result.p95_ms}ms > {budget.p95_ms}ms")
+    return violations
@@ -0,0 +1,174 @@
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+
+# Backends whose entries only the current process sees
+PROCESS_LOCAL_BACKENDS = (LocMemCache, DummyCache)
+
+
+def shared_cache(alias="default"):
+    """
+    Cache `alias`, for state that web, ASGI and Celery processes must see
+    alike (price version, stream feed, outbound budget, task metrics).
+    Raises ImproperlyConfigured for a per-process backend unless
+    settings.ALLOW_LOCAL_CACHE says everything runs in one process.
+    """
+    cache = caches[alias]
+    if isinstance(cache, PROCESS_LOCAL_BACKENDS) and not getattr(settings, "ALLOW_LOCAL_CACHE", False):
+        raise ImproperlyConfigured(
+            f"The {alias!r} cache ({type(cache).__name__}) is per process, so other processes would never "
+            "see this state. Configure a shared cache such as Redis, or set ALLOW_LOCAL_CACHE = True "
+            "for single-process setups."
+        )
+    return cache
+
+
+# Concurrent misses inside one process share one in-flight computation per
+# key; striped locks only guard registering it, so a slow compute never
+# holds up unrelated keys. cache.add() collapses misses across processes
+# sharing the cache backend.
+_LOCK_STRIPES = 64
+_thread_locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+_flights = {}
+
+_MISSING = object()
+
+
+class _Flight:
+    """One in-process computation of a key; `value` stays _MISSING if it failed."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = _MISSING
+
+
+def _thread_lock(key):
+    return _thread_locks[zlib.crc32(key.encode()) % _LOCK_STRIPES]
+
+
+def _lookup(cache, key):
+    hit = cache.get(key, _MISSING)
+    # values are stored wrapped in a 1-tuple so a cached None is distinguishable from a miss
+    return hit[0] if hit is not _MISSING else _MISSING
+
+
+def single_flight(key, compute, ttl, negative_ttl=None, alias="default", wait=10.0, poll=0.05):
+    """
+    Return the cached value for `key`, computing it with `compute()` on a
+    miss. Only one caller per key computes at a time, across threads and
+    across processes; the others wait up to `wait` seconds for its result.
+    A None result is cached for `negative_ttl` seconds (not at all when
+    falsy), anything else for `ttl`. Exceptions are never cached.
+    """
+    cache = caches[alias]
+    value = _lookup(cache, key)
+    if value is not _MISSING:
+        return value
+
+    with _thread_lock(key):
+        flight = _flights.get(key)
+        leading = flight is None
+        if leading:
+            flight = _flights[key] = _Flight()
+
+    if not leading:
+        # another thread of this process is on it
+        flight.done.wait(wait)
+        if flight.value is not _MISSING:
+            return flight.value
+        # it failed or timed out; answer this caller directly
+        return compute()
+
+    try:
+        flight.value = _fly(cache, key, compute, ttl, negative_ttl, wait, poll)
+        return flight.value
+    finally:
+        with _thread_lock(key):
+            del _flights[key]
+        flight.done.set()
+
+
+def _fly(cache, key, compute, ttl, negative_ttl, wait, poll):
+    """The computation of single_flight() by the one thread of this process leading `key`."""
+    value = _lookup(cache, key)
+    if value is not _MISSING:
+        return value
+
+    lock_key = f"{key}:lock"
+    if cache.add(lock_key, 1, timeout=wait):
+        try:
+            value = compute()
+            timeout = negative_ttl if value is None else ttl
+            if timeout:
+                cache.set(key, (value,), timeout=timeout)
+            return value
+        finally:
+            cache.delete(lock_key)
+
+    # another process holds the flight: wait for it to publish
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(poll)
+        value = _lookup(cache, key)
+        if value is not _MISSING:
+            return value
+        if cache.get(lock_key) is None:
+            break
+
+    # the other flight failed or timed out; answer this caller directly
+    return compute()
+
+
+PRICE_VERSION_KEY = "prices:version"
+PRICE_MODIFIED_KEY = "prices:modified"
+
+
+def price_version(alias="default"):
+    """
+    (version, modified) of the coin table: an integer bumped by every price
+    refresh or coin write, and the unix time of that bump. Anything derived
+    from coin rows can be cached under the version it was built from. It
+    lives in the shared cache, so every process (and every ETag built from
+    it) agrees on it.
+    """
+    cache = shared_cache(alias)
+    found = cache.get_many([PRICE_VERSION_KEY, PRICE_MODIFIED_KEY])
+    if PRICE_VERSION_KEY not in found:
+        # seed from the clock so a lost counter never reuses an old version
+        cache.add(PRICE_VERSION_KEY, time.time_ns() // 1000, timeout=None)
+        found[PRICE_VERSION_KEY] = cache.get(PRICE_VERSION_KEY)
+    if PRICE_MODIFIED_KEY not in found:
+        found[PRICE_MODIFIED_KEY] = int(time.time())
+        cache.add(PRICE_MODIFIED_KEY, found[PRICE_MODIFIED_KEY], timeout=None)
+    return found[PRICE_VERSION_KEY], found[PRICE_MODIFIED_KEY]
+
+
+def bump_price_version(alias="default"):
+    cache = shared_cache(alias)
+    price_version(alias)
+    try:
+        version = cache.incr(PRICE_VERSION_KEY)
+    except ValueError:  # evicted between the two calls
+        version = time.time_ns() // 1000
+        cache.set(PRICE_VERSION_KEY, version, timeout=None)
+    cache.set(PRICE_MODIFIED_KEY, int(time.time()), timeout=None)
+    return version
+
+
+def invalidate_prices():
+    """
+    Bump the price version now, so this process stops serving bodies built
+    from the old rows, and again once the surrounding transaction commits,
+    so a body built from not-yet-committed rows in between is discarded too.
+    """
+    bump_price_version()
+    transaction.on_commit(bump_price_version)
+
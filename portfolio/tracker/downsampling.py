@@ -0,0 +1,114 @@
+"""
+Server-side downsampling of (dates, values) series for charts.
+
+bucket_series() keeps the closing value of each day/week/month and lttb()
+(Largest-Triangle-Three-Buckets) keeps at most N points while preserving
+the visual shape. downsampled_history() caches the result per holding,
+keyed by its newest snapshot so a new snapshot invalidates it.
+"""
+import numpy as np
+from django.core.cache import cache
+
+from .analytics import load_holding_series
+from .models import PortfolioHistory
+
+
+RESOLUTIONS = ("day", "week", "month")
+MIN_POINTS = 3
+MAX_POINTS = 5000
+CACHE_TTL = 60 * 60 * 24
+
+
+def bucket_keys(dates, resolution):
+    """Bucket start of every date; weeks start on Monday."""
+    if resolution == "day":
+        return dates.astype("datetime64[D]")
+    if resolution == "week":
+        days = dates.astype("datetime64[D]")
+        # 1970-01-01 was a Thursday, so (days + 3) % 7 is the weekday with Monday = 0
+        return days - (days.astype(np.int64) + 3) % 7
+    if resolution == "month":
+        return dates.astype("datetime64[M]").astype("datetime64[D]")
+    raise ValueError(f"Unknown resolution {resolution!r}")
+
+
+def bucket_series(dates, values, resolution):
+    """Collapse a sorted series to the last (closing) point of each bucket."""
+    if len(dates) == 0:
+        return dates, values
+    keys = bucket_keys(dates, resolution)
+    last = np.append(np.flatnonzero(keys[1:] != keys[:-1]), len(keys) - 1)
+    return dates[last], values[last]
+
+
+def lttb(dates, values, threshold):
+    """
+    Largest-Triangle-Three-Buckets: keep the first and last point and, from
+    each of `threshold - 2` equal buckets in between, the point forming the
+    largest triangle with the previously kept point and the next bucket's
+    mean. Each bucket is evaluated with array operations.
+    """
+    n = len(values)
+    if threshold >= n or threshold < MIN_POINTS:
+        return dates, values
+
+    x = dates.astype(np.int64).astype(np.float64)
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64)
+    # mean point of every bucket, plus the last point as the final "next bucket"
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(values[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    avg_x = np.append(sums_x / counts, x[-1])
+    avg_y = np.append(sums_y / counts, values[-1])
+
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        bx, by = x[start:end], values[start:end]
+        areas = np.abs((x[a] - avg_x[i + 1]) * (by - values[a]) - (x[a] - bx) * (avg_y[i + 1] - values[a]))
+        a = start + int(areas.argmax())
+        keep[i + 1] = a
+    return dates[keep], values[keep]
+
+
+def downsample(dates, values, resolution=None, max_points=None):
+    if resolution:
+        dates, values = bucket_series(dates, values, resolution)
+    if max_points:
+        dates, values = lttb(dates, values, max_points)
+    return dates, values
+
+
+def as_points(dates, values):
+    return [{"date": d, "value_usd": v} for d, v in zip(dates.tolist(), values.tolist())]
+
+
+def downsampled_history(portfolio_id, resolution=None, max_points=None, series=None, scope="all"):
+    """
+    History points of a holding after downsample(), cached per
+    (holding, scope, resolution, max_points, newest snapshot). Pass `series`
+    when the (dates, values) arrays are already loaded; `scope` tells apart
+    differently bounded series of the same holding.
+    """
+    if series is not None:
+        dates, values = series
+        newest = (dates[-1], values[-1]) if len(dates) else None
+    else:
+        newest = (
+            PortfolioHistory.objects.filter(portfolio_id=portfolio_id)
+            .order_by("-date")
+            .values_list("date", "value_usd")
+            .first()
+        )
+    if newest is None:
+        return []
+
+    key = f"history:{portfolio_id}:{scope}:{resolution}:{max_points}:{newest[0]}:{float(newest[1])}"
+    points = cache.get(key)
+    if points is None:
+        dates, values = series if series is not None else load_holding_series(portfolio_id)
+        points = as_points(*downsample(dates, values, resolution, max_points))
+        cache.set(key, points, CACHE_TTL)
+    return points
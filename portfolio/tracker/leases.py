@@ -0,0 +1,108 @@
+"""
+Lease-based locks.
+
+A lease is a named lock held by one job id until the job releases it or
+the lease expires, so a crashed holder never blocks others for longer than
+the TTL. Long jobs renew their lease by acquiring it again. acquire()
+always returns the lease as it stands afterwards, so a caller that lost
+can tell who holds it.
+
+DatabaseLeases keeps leases in the Lease table, shared by web and Celery
+workers. LocalLeases is an in-memory stand-in for tests. The backend is
+chosen with settings.LEASE_BACKEND.
+"""
+import threading
+from collections import namedtuple
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import IntegrityError, transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+
+from .models import Lease
+
+
+LeaseInfo = namedtuple("LeaseInfo", ["name", "holder", "acquired_at", "expires_at"])
+
+
+class DatabaseLeases:
+
+    def acquire(self, name, holder, ttl):
+        """Take lease `name` for `holder` (or renew it) for `ttl` seconds; returns the current LeaseInfo."""
+        at = now()
+        expires_at = at + timedelta(seconds=ttl)
+        with transaction.atomic():
+            taken = (
+                Lease.objects.filter(name=name, holder=holder).update(expires_at=expires_at)
+                or Lease.objects.filter(name=name, expires_at__lte=at).update(
+                    holder=holder, acquired_at=at, expires_at=expires_at,
+                )
+            )
+            if not taken:
+                try:
+                    with transaction.atomic():
+                        Lease.objects.create(name=name, holder=holder, acquired_at=at, expires_at=expires_at)
+                except IntegrityError:
+                    pass  # someone else holds it
+        return self.current(name)
+
+    def release(self, name, holder):
+        Lease.objects.filter(name=name, holder=holder).delete()
+
+    def current(self, name):
+        """LeaseInfo of the live lease `name`, or None."""
+        lease = Lease.objects.filter(name=name, expires_at__gt=now()).first()
+        if lease is None:
+            return None
+        return LeaseInfo(lease.name, lease.holder, lease.acquired_at, lease.expires_at)
+
+    def held(self, names):
+        """LeaseInfo of every live lease among `names`, in one query."""
+        leases = Lease.objects.filter(name__in=list(names), expires_at__gt=now()).order_by("acquired_at")
+        return [LeaseInfo(lease.name, lease.holder, lease.acquired_at, lease.expires_at) for lease in leases]
+
+
+class LocalLeases:
+    """In-process stand-in for DatabaseLeases."""
+
+    def __init__(self):
+        self.leases = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, name, holder, ttl):
+        at = now()
+        with self._lock:
+            lease = self.leases.get(name)
+            if lease is None or lease.expires_at <= at:
+                lease = LeaseInfo(name, holder, at, at)
+            if lease.holder == holder:
+                self.leases[name] = lease._replace(expires_at=at + timedelta(seconds=ttl))
+            return self.leases[name]
+
+    def release(self, name, holder):
+        with self._lock:
+            if name in self.leases and self.leases[name].holder == holder:
+                del self.leases[name]
+
+    def current(self, name):
+        lease = self.leases.get(name)
+        return lease if lease is not None and lease.expires_at > now() else None
+
+    def held(self, names):
+        return sorted(filter(None, map(self.current, names)), key=lambda lease: lease.acquired_at)
+
+
+@lru_cache(maxsize=None)
+def get_leases():
+    """Return the process-wide lease backend configured by settings.LEASE_BACKEND."""
+    return import_string(getattr(settings, "LEASE_BACKEND", "tracker.leases.DatabaseLeases"))()
+
+
+@receiver(setting_changed)
+def _reset_leases(setting, **kwargs):
+    if setting == "LEASE_BACKEND":
+        get_leases.cache_clear()
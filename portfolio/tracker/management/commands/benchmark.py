@@ -0,0 +1,51 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from tracker.benchmarks import DEFAULT_REPEAT, DEFAULT_SCALES, check_budgets, run_endpoints, run_tasks
+
+
+class Command(BaseCommand):
+    help = "Benchmark every endpoint and the price/snapshot tasks on a throwaway database and check the budgets"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)), help="Comma-separated data scales")
+        parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Requests per route and scale")
+        parser.add_argument("--route", action="append", help="Only benchmark these route names")
+        parser.add_argument("--no-latency", action="store_true", help="Only enforce query budgets")
+        parser.add_argument("--json", help="Also write the results to this file")
+
+    def handle(self, *args, **options):
+        scales = [int(scale) for scale in options["scales"].split(",")]
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results, task_results = [], []
+            for scale in scales:
+                self.stdout.write(f"scale {scale}...")
+                endpoint_results = run_endpoints(scale, options["repeat"])
+                if options["route"]:
+                    endpoint_results = [r for r in endpoint_results if r.name in options["route"]]
+                results += endpoint_results
+                task_results += run_tasks(scale)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(f"{'route':<24}{'scale':>7}{'status':>7}{'queries':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for r in results:
+            self.stdout.write(f"{r.name:<24}{r.scale:>7}{r.status:>7}{r.queries:>8}{r.p50_ms:>9}{r.p95_ms:>9}{r.p99_ms:>9}")
+        for t in task_results:
+            self.stdout.write(f"{t.name:<24}{t.scale:>7}  {t.rows} rows in {t.elapsed}s ({t.rows_per_sec} rows/s)")
+
+        if options["json"]:
+            with open(options["json"], "w") as f:
+                json.dump({"endpoints": [r._asdict() for r in results], "tasks": [t._asdict() for t in task_results]}, f, indent=2)
+
+        violations = check_budgets(results + task_results, latency=not options["no_latency"])
+        if violations:
+            raise CommandError("Budgets exceeded:\n  " + "\n  ".join(violations))
+        self.stdout.write(self.style.SUCCESS("All budgets met."))
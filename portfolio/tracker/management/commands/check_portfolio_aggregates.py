@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from tracker.aggregates import diff_aggregates, replace_aggregates
+
+
+class Command(BaseCommand):
+    help = "Rebuild portfolio aggregates from scratch and diff them against the stored ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true", help="Replace the stored aggregates with the rebuilt ones")
+
+    def handle(self, *args, **options):
+        expected, diffs = diff_aggregates()
+
+        for (user_id, name), have, want in diffs:
+            self.stdout.write(f"user={user_id} group={name or '*'}: stored={have} expected={want}")
+
+        if not diffs:
+            self.stdout.write(self.style.SUCCESS(f"All {len(expected)} aggregates are consistent."))
+            return
+
+        if options["fix"]:
+            replace_aggregates(expected)
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(expected)} aggregates ({len(diffs)} differed)."))
+        else:
+            self.stdout.write(self.style.WARNING(f"{len(diffs)} aggregates differ; rerun with --fix to rebuild."))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from tracker.providers import FakeProvider, FakeCoinGeckoServer
+
+
+class Command(BaseCommand):
+    help = "Serve a deterministic fake CoinGecko API on localhost for offline runs and load tests"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--universe", type=int, default=1000, help="Number of synthetic coins")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--latency", type=float, default=0.0, help="Seconds slept per call")
+        parser.add_argument("--rate-limit-every", type=int, default=0, help="Answer every Nth call with 429")
+
+    def handle(self, *args, **options):
+        provider = FakeProvider(
+            universe=options["universe"],
+            seed=options["seed"],
+            latency=options["latency"],
+            rate_limit_every=options["rate_limit_every"],
+        )
+        server = FakeCoinGeckoServer(provider, port=options["port"]).start()
+        self.stdout.write(self.style.SUCCESS(f"Fake CoinGecko listening on {server.url}"))
+        self.stdout.write(
+            'Point the app at it with PRICE_PROVIDER = {"OPTIONS": {"base_url": "%s"}}' % server.url
+        )
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.stop()
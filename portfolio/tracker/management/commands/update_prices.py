@@ -5,5 +5,5 @@ class Command(BaseCommand):
     help = "Update coin prices from CoinGecko"
 
     def handle(self, *args, **kwargs):
-        update_coin_prices()
-        self.stdout.write(self.style.SUCCESS("Coin prices updated successfully!"))
+        changes = update_coin_prices()
+        self.stdout.write(self.style.SUCCESS(f"Coin prices updated successfully! ({len(changes)} changed)"))
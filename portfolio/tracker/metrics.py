@@ -0,0 +1,395 @@
+"""
+Request, upstream and task metrics.
+
+MetricsMiddleware counts and times the SQL queries and price-provider calls
+made while serving each request. It reports them in a Server-Timing header
+and feeds per-route histograms. Provider calls are timed by
+providers.InstrumentedProvider, which reports to whichever request is
+current (also from the provider's fetch pool threads).
+
+Celery tasks report their duration and processed rows.
+
+Web and Celery workers are separate processes, so a scrape of one of them
+must still see everyone's numbers. Each process counts into its own
+registry and flushes the increments since its last flush to the shared
+cache (tracker.cache.shared_cache) with atomic incr(): web processes at most
+every FLUSH_INTERVAL seconds after a request, workers after every task.
+/metrics renders the shared totals, so any web process can be scraped.
+
+render() produces everything in Prometheus' text exposition format.
+"""
+import contextvars
+import hashlib
+import json
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from celery.signals import task_postrun, task_prerun
+from django.db import connections
+
+from .cache import shared_cache
+
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+TASK_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 300, 900)
+SUM_SCALE = 10 ** 6  # histogram sums are kept in the cache as integer micro-units
+METRICS_KEY_PREFIX = "metrics"
+FLUSH_INTERVAL = 1.0  # seconds between flushes of a web process's increments
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def _shared_key(*parts):
+    return ":".join((METRICS_KEY_PREFIX, *map(str, parts)))
+
+
+def _incr(cache, key, amount):
+    cache.add(key, 0, timeout=None)
+    cache.incr(key, amount)
+
+
+class Metric:
+    """
+    A metric counted in this process (`values`) and flushed to the shared
+    cache, where every series is listed once: the process whose cache.add()
+    claims the series takes the next slot of the metric's series list.
+    """
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._flushed = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _series_id(self, key):
+        return hashlib.sha1(json.dumps(key).encode()).hexdigest()[:16]
+
+    def _register(self, cache, key):
+        """Shared cache id of series `key`, listing the series the first time any process flushes it."""
+        series_id = self._series_id(key)
+        if cache.add(_shared_key(self.name, "known", series_id), 1, timeout=None):
+            cache.add(_shared_key(self.name, "slots"), 0, timeout=None)
+            slot = cache.incr(_shared_key(self.name, "slots"))
+            cache.set(_shared_key(self.name, "slot", slot), list(key), timeout=None)
+        return series_id
+
+    def _shared_series(self, cache):
+        """Label values of every series flushed by any process."""
+        slots = cache.get(_shared_key(self.name, "slots")) or 0
+        listed = cache.get_many([_shared_key(self.name, "slot", n) for n in range(1, slots + 1)])
+        return sorted({tuple(key) for key in listed.values()})
+
+    def flush(self, cache):
+        """Add the increments since the last flush to the shared totals."""
+        raise NotImplementedError
+
+    def samples(self, cache):
+        """(suffix, ((label, value), ...), value) of every shared series."""
+        raise NotImplementedError
+
+    def render(self, cache):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.samples(cache):
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values = defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] += amount
+
+    def flush(self, cache):
+        with self._lock:
+            current, flushed = dict(self.values), self._flushed
+            self._flushed = current
+        for key, value in current.items():
+            delta = round(value - flushed.get(key, 0))  # counters count whole events
+            if delta:
+                _incr(cache, _shared_key(self.name, self._register(cache, key)), delta)
+
+    def samples(self, cache):
+        series = self._shared_series(cache)
+        values = cache.get_many([_shared_key(self.name, self._series_id(key)) for key in series])
+        for key in series:
+            yield "", tuple(zip(self.labelnames, key)), values.get(_shared_key(self.name, self._series_id(key)), 0)
+
+
+def histogram_samples(labelnames, buckets, series):
+    """
+    Samples of histogram series given as {label values: (per-bucket counts,
+    sum)}, where the counts are not cumulative and the last one counts
+    observations above the highest bucket.
+    """
+    for key, (counts, total) in sorted(series.items()):
+        labels = tuple(zip(labelnames, key))
+        cumulative = 0
+        for bound, count in zip((*buckets, float("inf")), counts):
+            cumulative += count
+            yield "_bucket", labels + (("le", _format_value(bound) if bound != float("inf") else "+Inf"),), cumulative
+        yield "_count", labels, cumulative
+        yield "_sum", labels, total
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self.values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def flush(self, cache):
+        with self._lock:
+            current = {key: (list(counts), total) for key, (counts, total) in self.values.items()}
+            flushed, self._flushed = self._flushed, current
+        empty = ([0] * (len(self.buckets) + 1), 0.0)
+        for key, (counts, total) in current.items():
+            old_counts, old_total = flushed.get(key, empty)
+            if counts == old_counts:
+                continue
+            series_id = self._register(cache, key)
+            for i, (count, old) in enumerate(zip(counts, old_counts)):
+                if count != old:
+                    _incr(cache, _shared_key(self.name, series_id, "bucket", i), count - old)
+            _incr(cache, _shared_key(self.name, series_id, "sum"), round((total - old_total) * SUM_SCALE))
+
+    def samples(self, cache):
+        series = self._shared_series(cache)
+        suffixes = [("sum",), *(("bucket", i) for i in range(len(self.buckets) + 1))]
+        values = cache.get_many([
+            _shared_key(self.name, self._series_id(key), *suffix) for key in series for suffix in suffixes
+        ])
+        shared = {}
+        for key in series:
+            series_id = self._series_id(key)
+            shared[key] = (
+                [values.get(_shared_key(self.name, series_id, "bucket", i), 0) for i in range(len(self.buckets) + 1)],
+                values.get(_shared_key(self.name, series_id, "sum"), 0) / SUM_SCALE,
+            )
+        return histogram_samples(self.labelnames, self.buckets, shared)
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+        self._flushed_at = 0.0
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def flush(self):
+        cache = shared_cache()
+        self._flushed_at = time.monotonic()
+        for metric in self.metrics:
+            metric.flush(cache)
+
+    def maybe_flush(self):
+        if time.monotonic() - self._flushed_at >= FLUSH_INTERVAL:
+            self.flush()
+
+    def render(self):
+        """Every process's flushed totals, this one's included."""
+        self.flush()
+        cache = shared_cache()
+        return "\n".join(metric.render(cache) for metric in self.metrics) + "\n"
+
+
+registry = Registry()
+
+request_duration = registry.histogram(
+    "http_request_duration_seconds", "Time to produce a response, by route.", ["route", "method", "status"],
+)
+request_sql_queries = registry.histogram(
+    "http_request_sql_queries", "SQL queries per request, by route.", ["route"], buckets=QUERY_BUCKETS,
+)
+request_sql_duration = registry.histogram(
+    "http_request_sql_duration_seconds", "Time spent in SQL per request, by route.", ["route"],
+)
+request_provider_duration = registry.histogram(
+    "http_request_provider_duration_seconds", "Time spent calling the price provider per request, by route.", ["route"],
+)
+provider_calls = registry.counter(
+    "price_provider_calls_total", "Upstream price provider calls, by method and outcome.", ["method", "outcome"],
+)
+provider_duration = registry.histogram(
+    "price_provider_call_duration_seconds", "Duration of upstream price provider calls, by method.", ["method"],
+)
+task_duration = registry.histogram(
+    "celery_task_duration_seconds", "Duration of Celery task runs, by task.", ["task"], buckets=TASK_BUCKETS,
+)
+task_rows = registry.counter(
+    "celery_task_rows_processed_total", "Rows processed by Celery tasks, by task.", ["task"],
+)
+
+
+class RequestTimings:
+    """SQL and provider time of one request; provider calls may report from other threads."""
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.provider_count = 0
+        self.provider_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add_sql(self, seconds):
+        with self._lock:
+            self.sql_count += 1
+            self.sql_seconds += seconds
+
+    def add_provider(self, seconds):
+        with self._lock:
+            self.provider_count += 1
+            self.provider_seconds += seconds
+
+    def server_timing(self, total):
+        return ", ".join([
+            f'db;desc="{self.sql_count} queries";dur={self.sql_seconds * 1000:.1f}',
+            f'provider;desc="{self.provider_count} calls";dur={self.provider_seconds * 1000:.1f}',
+            f"total;dur={total * 1000:.1f}",
+        ])
+
+
+current_timings = contextvars.ContextVar("current_timings", default=None)
+
+
+@contextmanager
+def provider_call(method):
+    """Time one upstream provider call for the registry and the current request."""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - started
+        provider_calls.inc(method=method, outcome=outcome)
+        provider_duration.observe(elapsed, method=method)
+        timings = current_timings.get()
+        if timings is not None:
+            timings.add_provider(elapsed)
+
+
+def _sql_timer(timings):
+    def wrapper(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            timings.add_sql(time.perf_counter() - started)
+    return wrapper
+
+
+class MetricsMiddleware:
+    """
+    Time every request, count its SQL queries and provider calls, send
+    them in a Server-Timing header and record them per route (the URL
+    name, so paths with ids don't each become a series).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_sql_timer(timings)))
+                response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        total = time.perf_counter() - started
+
+        match = getattr(request, "resolver_match", None)
+        route = (match.view_name if match else None) or "unmatched"
+        request_duration.observe(total, route=route, method=request.method, status=response.status_code)
+        request_sql_queries.observe(timings.sql_count, route=route)
+        request_sql_duration.observe(timings.sql_seconds, route=route)
+        request_provider_duration.observe(timings.provider_seconds, route=route)
+        registry.maybe_flush()
+
+        existing = response.get("Server-Timing")
+        server_timing = timings.server_timing(total)
+        response["Server-Timing"] = f"{existing}, {server_timing}" if existing else server_timing
+        return response
+
+
+def observe_task(task, seconds):
+    """Record one run of `task` that took `seconds`."""
+    task_duration.observe(seconds, task=task)
+
+
+def add_task_rows(task, rows):
+    """Count `rows` processed by `task`."""
+    task_rows.inc(rows, task=task)
+
+
+def render():
+    """Every process's metrics, as Prometheus text."""
+    return registry.render()
+
+
+_task_started = {}
+
+
+@task_prerun.connect
+def _start_task_timer(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def _stop_task_timer(task_id=None, task=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None and task is not None:
+        observe_task(task.name, time.perf_counter() - started)
+    registry.flush()
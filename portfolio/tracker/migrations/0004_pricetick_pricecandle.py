@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0003_alter_watchlist_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceCandle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('1m', '1 minute'), ('1h', '1 hour'), ('1d', '1 day')], max_length=2)),
+                ('bucket', models.DateTimeField()),
+                ('open', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('high', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('low', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('close', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('coin', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='candles', to='tracker.coin')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['resolution', 'bucket'], name='tracker_pri_resolut_9a31f6_idx')],
+                'unique_together': {('coin', 'resolution', 'bucket')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PriceTick',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('price', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('coin', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ticks', to='tracker.coin')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['coin', 'timestamp'], name='tracker_pri_coin_id_b029f4_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0005_portfolioaggregate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='coin',
+            index=models.Index(fields=['name'], name='tracker_coi_name_408473_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coin',
+            index=models.Index(fields=['price'], name='tracker_coi_price_c799cd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='watchlist',
+            index=models.Index(fields=['user', '-date_added'], name='tracker_wat_user_id_034e00_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0006_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coin',
+            name='refresh_tier',
+            field=models.CharField(choices=[('hot', 'Hot'), ('warm', 'Warm'), ('cold', 'Cold')], default='cold', max_length=4),
+        ),
+        migrations.AddField(
+            model_name='coin',
+            name='refreshed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='coin',
+            index=models.Index(fields=['refresh_tier'], name='tracker_coi_refresh_9067c7_idx'),
+        ),
+    ]
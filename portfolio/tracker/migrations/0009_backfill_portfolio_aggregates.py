@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def backfill_aggregates(apps, schema_editor):
+    from tracker.aggregates import rebuild_aggregates, replace_aggregates
+
+    expected = rebuild_aggregates(apps.get_model('tracker', 'Portfolio'))
+    replace_aggregates(expected, apps.get_model('tracker', 'PortfolioAggregate'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0008_lease'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_aggregates, migrations.RunPython.noop),
+    ]
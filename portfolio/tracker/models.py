@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import RowNumber
 from decimal import Decimal
 from django.utils.timezone import now
 from django.conf import settings
@@ -9,18 +10,81 @@ from django.conf import settings
 
 
 class Coin(models.Model):
+    REFRESH_TIERS = [
+        ('hot', 'Hot'),
+        ('warm', 'Warm'),
+        ('cold', 'Cold'),
+    ]
+
     coingecko_id = models.CharField(max_length=50, blank=True, unique=True)  
     name = models.CharField(max_length=100,)
     symbol = models.CharField(max_length=10, unique=False)
     price = models.DecimalField(max_digits=20, decimal_places=8, )
     date_created = models.DateTimeField(auto_now_add=True)
+    # demand tier set by tracker.tiers.recompute_tiers, which decides how often the price is refreshed
+    refresh_tier = models.CharField(max_length=4, choices=REFRESH_TIERS, default='cold')
+    refreshed_at = models.DateTimeField(null=True, blank=True)
     
-    
+    class Meta:
+        indexes = [
+            # keyset pagination / ordering keys of the coin list
+            models.Index(fields=["name"]),
+            models.Index(fields=["price"]),
+            # coins of one tier, read by every scheduled refresh
+            models.Index(fields=["refresh_tier"]),
+        ]
+    
+    def save(self, *args, **kwargs):
+        # a price edit moves PortfolioAggregate in the same transaction (tracker.signals)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.name} ({self.symbol})"
     
     
     
+class PortfolioQuerySet(models.QuerySet):
+    
+    def with_current_value(self):
+        """Annotate `current_value` = amount * coin.price, computed by the database."""
+        return self.annotate(
+            current_value=models.ExpressionWrapper(
+                models.F("amount") * models.F("coin__price"),
+                output_field=models.DecimalField(max_digits=40, decimal_places=8),
+            )
+        )
+    
+    def with_valuation(self):
+        """
+        Annotate `initial_value` (value of the earliest PortfolioHistory
+        snapshot, via a correlated subquery); current values come from
+        tracker.valuation.
+        """
+        first_snapshot = (
+            PortfolioHistory.objects.filter(portfolio=models.OuterRef("pk"))
+            .order_by("date")
+            .values("value_usd")[:1]
+        )
+        return self.annotate(initial_value=models.Subquery(first_snapshot))
+    
+    def with_recent_history(self, limit):
+        """Prefetch at most `limit` latest snapshots per holding into `recent_history`."""
+        recent = (
+            PortfolioHistory.objects.annotate(
+                row_number=models.Window(
+                    RowNumber(),
+                    partition_by=models.F("portfolio_id"),
+                    order_by=models.F("date").desc(),
+                )
+            )
+            .filter(row_number__lte=limit)
+            .order_by("date")
+        )
+        return self.prefetch_related(models.Prefetch("history", queryset=recent, to_attr="recent_history"))
+    
+    
+    
 class Portfolio(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="portfolios")
     name  = models.CharField(max_length=100)
@@ -28,6 +92,8 @@ class Portfolio(models.Model):
     amount = models.DecimalField(max_digits=20, decimal_places=8, default=Decimal("0.0"))
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = PortfolioQuerySet.as_manager()
+    
     
     @property
     def value(self):
@@ -35,6 +101,11 @@ class Portfolio(models.Model):
         
         return self.amount * (self.coin.price or Decimal("0.0"))
     
+    def save(self, *args, **kwargs):
+        # tracker.signals move PortfolioAggregate in the same transaction as the row
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.name} {self.coin.symbol}"
     
@@ -73,14 +144,103 @@ class PortfolioHistory(models.Model):
     
     
 
+class WatchlistQuerySet(models.QuerySet):
+
+    def with_in_portfolio(self, user):
+        """Annotate `in_portfolio`: whether `user` holds the watched coin."""
+        return self.annotate(
+            in_portfolio=models.Exists(Portfolio.objects.filter(user=user, coin=models.OuterRef("coin")))
+        )
+
+
 class Watchlist(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="watchlist")
     coin = models.ForeignKey(Coin, on_delete=models.CASCADE, related_name="watchlist")
     date_added = models.DateTimeField(auto_now_add=True)
     
+    objects = WatchlistQuerySet.as_manager()
+    
     class Meta:
         unique_together = ("user", "coin")
         ordering = ["-date_added"]
+        indexes = [models.Index(fields=["user", "-date_added"])]
+    
+    def __str__(self):
+        return f"{self.user.email} → {self.coin.symbol}"
+    
+    
+    
+
+class PortfolioAggregate(models.Model):
+    """
+    Running totals of a user's holdings, maintained incrementally by
+    tracker.aggregates. name="" covers all of the user's holdings, any other
+    name covers the holdings with that Portfolio.name.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="portfolio_aggregates")
+    name = models.CharField(max_length=100, blank=True, default="")
+    total_value = models.DecimalField(max_digits=30, decimal_places=8, default=Decimal("0"))
+    asset_count = models.IntegerField(default=0)
+    top_holding = models.ForeignKey(Portfolio, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    top_value = models.DecimalField(max_digits=30, decimal_places=8, default=Decimal("0"))
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ("user", "name")
+        
+    def __str__(self):
+        return f"{self.user_id} {self.name or '*'} - ${self.total_value}"
+    
+    
+    
+
+class PriceTick(models.Model):
+    """Raw price observed for a coin by one update_coin_prices run."""
+    coin = models.ForeignKey(Coin, on_delete=models.CASCADE, related_name="ticks")
+    timestamp = models.DateTimeField(default=now)
+    price = models.DecimalField(max_digits=20, decimal_places=8)
+    
+    class Meta:
+        indexes = [models.Index(fields=["coin", "timestamp"])]
+        
+    def __str__(self):
+        return f"{self.coin_id} @ {self.timestamp} - ${self.price}"
+    
+    
+    
+
+class PriceCandle(models.Model):
+    """OHLC rollup of PriceTick rows into fixed-width time buckets."""
+    RESOLUTIONS = [
+        ("1m", "1 minute"),
+        ("1h", "1 hour"),
+        ("1d", "1 day"),
+    ]
+    
+    coin = models.ForeignKey(Coin, on_delete=models.CASCADE, related_name="candles")
+    resolution = models.CharField(max_length=2, choices=RESOLUTIONS)
+    bucket = models.DateTimeField()
+    open = models.DecimalField(max_digits=20, decimal_places=8)
+    high = models.DecimalField(max_digits=20, decimal_places=8)
+    low = models.DecimalField(max_digits=20, decimal_places=8)
+    close = models.DecimalField(max_digits=20, decimal_places=8)
+    
+    class Meta:
+        unique_together = ("coin", "resolution", "bucket")
+        indexes = [models.Index(fields=["resolution", "bucket"])]
+        
+    def __str__(self):
+        return f"{self.coin_id} {self.resolution} {self.bucket}"
+    
+    
+    
+
+class Lease(models.Model):
+    """Named lock held by one job until it is released or expires (see tracker.leases)."""
+    name = models.CharField(max_length=100, primary_key=True)
+    holder = models.CharField(max_length=255)
+    acquired_at = models.DateTimeField()
+    expires_at = models.DateTimeField()
     
     def __str__(self):
-        return f"{self.user.email} → {self.coin.symbol}"
\ No newline at end of file
+        return f"{self.name} held by {self.holder} until {self.expires_at}"
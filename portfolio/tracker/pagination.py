@@ -1,7 +1,61 @@
-from rest_framework.pagination import PageNumberPagination
+from django.db import connections
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class StandardResultSetPagination(PageNumberPagination):
     page_size = 20
     page_size_query_param = 'page_size'
-    max_page_size = 100 
\ No newline at end of file
+    max_page_size = 100
+
+
+TOTAL_COUNT_CAP = 10000
+
+
+def approximate_count(queryset, cap=TOTAL_COUNT_CAP):
+    """
+    (count, is_approximate) of `queryset` without an unbounded COUNT(*):
+    PostgreSQL's planner estimate for an unfiltered table, otherwise a count
+    that stops after `cap` rows.
+    """
+    if not queryset.query.where and connections[queryset.db].vendor == "postgresql":
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] >= 0:
+            return row[0], True
+    count = queryset.order_by()[:cap + 1].count()
+    return min(count, cap), count > cap
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor (keyset) pagination: pages seek on an indexed ordering key, so a
+    deep page costs the same as the first. The primary key is appended as a
+    tie-breaker to keep pages stable. ?with_total=true adds an approximate
+    `total` to the response.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = '-id'
+    total_query_param = 'with_total'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            ordering += ('-id' if ordering[0].startswith('-') else 'id',)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # views declare their keyset with `ordering`, as they would for OrderingFilter
+        self.ordering = getattr(view, 'ordering', None) or self.ordering
+        self.total = None
+        if request.query_params.get(self.total_query_param, '').lower() in ('1', 'true', 'yes'):
+            self.total = approximate_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.total is not None:
+            response.data['total'], response.data['total_is_approximate'] = self.total
+        return response
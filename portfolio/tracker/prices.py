@@ -0,0 +1,120 @@
+"""
+Process-local price table.
+
+Every coin's current price is held in memory as a dense array indexed by
+coin id, in the scaled integer units of tracker.valuation. Read paths look
+prices up there instead of joining Coin for them. The table is reloaded
+whole when the price version (tracker.cache.price_version, kept in the
+shared cache and bumped by every refresh and coin write, in any process)
+changes, so it costs one query per version per process. Serializers of
+Coin rows keep the row's own price.
+
+PriceSnapshotMiddleware pins the snapshot first used by a request for the
+rest of it, so every value in one response comes from the same prices.
+"""
+import contextvars
+import threading
+from decimal import Decimal
+
+import numpy as np
+
+from .cache import price_version
+from .models import Coin
+from .valuation import to_units
+
+
+class PriceSnapshot:
+    """Immutable prices of one version: `units[coin_id]`, valid where `present[coin_id]`."""
+
+    def __init__(self, version, units, present):
+        self.version = version
+        self.units = units
+        self.present = present
+
+    def covers(self, coin_ids):
+        ids = np.asarray(coin_ids, dtype=np.int64)
+        inside = ids[ids < len(self.present)]
+        return len(inside) == len(ids) and bool(self.present[inside].all())
+
+    def units_of(self, coin_ids):
+        """Scaled prices of `coin_ids` (0 for unknown coins) as an object array."""
+        ids = np.asarray(coin_ids, dtype=np.int64)
+        known = ids < len(self.units)
+        units = np.zeros(len(ids), dtype=object)
+        units[known] = self.units[ids[known]]
+        return units
+
+    def price(self, coin_id):
+        """Decimal price of a coin, or None when the snapshot doesn't have it."""
+        if coin_id >= len(self.present) or not self.present[coin_id]:
+            return None
+        return Decimal(int(self.units[coin_id])).scaleb(-8)
+
+
+class PriceTable:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.snapshot = None
+
+    def clear(self):
+        self.snapshot = None
+
+    def load(self, version):
+        """Read every coin's price into a new snapshot of `version` and swap it in."""
+        rows = list(Coin.objects.values_list("id", "price").iterator(chunk_size=5000))
+        size = max((coin_id for coin_id, _ in rows), default=-1) + 1
+        units = np.zeros(size, dtype=object)
+        present = np.zeros(size, dtype=bool)
+        if rows:
+            ids = np.fromiter((coin_id for coin_id, _ in rows), dtype=np.int64, count=len(rows))
+            units[ids] = to_units([price for _, price in rows])
+            present[ids] = True
+        snapshot = PriceSnapshot(version, units, present)
+        with self._lock:
+            self.snapshot = snapshot
+        return snapshot
+
+    def current(self):
+        """The snapshot of the current price version, loading it if needed."""
+        version, _ = price_version()
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.version != version:
+            snapshot = self.load(version)
+        return snapshot
+
+
+price_table = PriceTable()
+
+_pinned = contextvars.ContextVar("pinned_prices", default=None)
+
+
+def current_prices(coin_ids=()):
+    """
+    The snapshot pinned to the current request, or the latest one outside
+    requests. A snapshot missing any of `coin_ids` (coins bulk-created
+    without a version bump) is reloaded once.
+    """
+    pinned = _pinned.get()
+    snapshot = pinned.get("snapshot") if pinned is not None else None
+    if snapshot is None:
+        snapshot = price_table.current()
+    if len(coin_ids) and not snapshot.covers(coin_ids):
+        snapshot = price_table.load(snapshot.version)
+    if pinned is not None:
+        pinned["snapshot"] = snapshot
+    return snapshot
+
+
+class PriceSnapshotMiddleware:
+    """Pin one price snapshot per request, taken when the request first reads a price."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _pinned.set({})
+        try:
+            return self.get_response(request)
+        finally:
+            _pinned.reset(token)
@@ -0,0 +1,549 @@
+"""
+Price providers.
+
+Every outbound market-data call goes through a PriceProvider returned by
+get_provider(). The backend is chosen with settings.PRICE_PROVIDER:
+
+    PRICE_PROVIDER = {
+        "BACKEND": "tracker.providers.CoinGeckoProvider",
+        "OPTIONS": {"base_url": "https://api.coingecko.com/api/v3"},
+    }
+
+FakeProvider is a deterministic offline stand-in (latency, 429s, large coin
+universes) and FakeCoinGeckoServer serves it over localhost with CoinGecko's
+JSON shapes. RecordingProvider/ReplayProvider capture and play back responses.
+Every backend is wrapped in an InstrumentedProvider for request metrics.
+
+An optional "CACHE" entry wraps the backend in a CachedProvider:
+
+    "CACHE": {"ALIAS": "default", "TTL": {"coin_detail": 60}, "NEGATIVE_TTL": 300}
+
+and an optional "RATE_LIMIT" entry puts calls that miss the cache on a
+shared outbound budget (see tracker.ratelimit).
+"""
+import contextvars
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from decimal import Decimal
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .cache import single_flight
+from .metrics import provider_call
+
+
+COINGECKO_BASE = "https://api.coingecko.com/api/v3"
+PRICE_QUANT = Decimal("0.00000001")  # matches Coin.price decimal_places
+
+CoinData = namedtuple("CoinData", ["id", "name", "symbol", "price"])
+
+# Shared by coin_details() so a slow upstream never needs a pool torn down per request.
+FETCH_WORKERS = 8
+_fetch_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="price-provider")
+
+
+class ProviderError(Exception):
+    """The provider could not answer the request."""
+
+
+class ProviderUnavailable(ProviderError):
+    """Network failure or timeout talking to the provider."""
+
+
+class RateLimited(ProviderError):
+    """The provider answered 429; `retry_after` is in seconds."""
+
+    def __init__(self, message="Rate limited by price provider", retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def to_price(value):
+    return Decimal(str(value or 0)).quantize(PRICE_QUANT)
+
+
+class PriceProvider:
+    """Interface shared by every price backend."""
+
+    def simple_prices(self, coin_ids):
+        """Return {coingecko_id: Decimal usd price} for the ids the provider knows."""
+        raise NotImplementedError
+
+    def top_coins(self, n=100):
+        """Return the top `n` coins by market cap as a list of CoinData."""
+        raise NotImplementedError
+
+    def coin_detail(self, coin_id):
+        """Return CoinData for `coin_id`, or None when the provider does not know it."""
+        raise NotImplementedError
+
+    def search(self, query):
+        """Return coingecko ids matching `query`, best match first."""
+        raise NotImplementedError
+
+    def coin_details(self, coin_ids, deadline=None):
+        """
+        Fetch coin_detail() for every id concurrently and return
+        {coin_id: CoinData} for those answered within `deadline` seconds.
+        Unknown coins, failed calls and calls still running at the deadline
+        are left out.
+        """
+        # each call runs in a copy of the caller's context, so request metrics still see it
+        futures = {
+            _fetch_pool.submit(contextvars.copy_context().run, self.coin_detail, coin_id): coin_id
+            for coin_id in coin_ids
+        }
+        done, pending = wait(futures, timeout=deadline)
+        for future in pending:
+            future.cancel()
+
+        details = {}
+        for future in done:
+            try:
+                detail = future.result()
+            except ProviderError:
+                continue
+            if detail is not None:
+                details[futures[future]] = detail
+        return details
+
+
+class CoinGeckoProvider(PriceProvider):
+
+    def __init__(self, base_url=COINGECKO_BASE, timeout=10, api_key=None, pool_size=FETCH_WORKERS):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        # keep-alive connections shared by every thread using this provider
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if api_key:
+            self.session.headers["x-cg-demo-api-key"] = api_key
+
+    def _get(self, path, params=None, allow_404=False):
+        try:
+            response = self.session.get(f"{self.base_url}{path}", params=params, timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise ProviderUnavailable(str(e)) from e
+
+        if response.status_code == 429:
+            retry_after = response.headers.get("Retry-After")
+            raise RateLimited(retry_after=int(retry_after) if retry_after and retry_after.isdigit() else None)
+        if response.status_code == 404 and allow_404:
+            return None
+        if response.status_code != 200:
+            raise ProviderError(f"{path} returned HTTP {response.status_code}")
+        return response.json()
+
+    def simple_prices(self, coin_ids):
+        data = self._get("/simple/price", {"ids": ",".join(coin_ids), "vs_currencies": "usd"})
+        return {k: to_price(v["usd"]) for k, v in data.items() if v.get("usd") is not None}
+
+    def top_coins(self, n=100):
+        data = self._get("/coins/markets", {"vs_currency": "usd", "order": "market_cap_desc", "per_page": n, "page": 1})
+        return [CoinData(c["id"], c["name"], c["symbol"].upper(), to_price(c["current_price"])) for c in data]
+
+    def coin_detail(self, coin_id):
+        data = self._get(f"/coins/{coin_id.lower()}", allow_404=True)
+        if data is None:
+            return None
+        price = data.get("market_data", {}).get("current_price", {}).get("usd", 0)
+        return CoinData(data["id"], data["name"], data["symbol"].upper(), to_price(price))
+
+    def search(self, query):
+        data = self._get("/search", {"query": query})
+        return [c["id"] for c in data.get("coins", [])]
+
+
+class FakeProvider(PriceProvider):
+    """
+    Deterministic in-process provider with `universe` synthetic coins
+    (fake-0, fake-1, ...). Prices drift on every simple_prices() call but
+    depend only on (seed, coin, call number). `latency` seconds are slept
+    per call and every `rate_limit_every`-th call raises RateLimited.
+    """
+
+    def __init__(self, universe=1000, seed=0, latency=0.0, rate_limit_every=0, retry_after=1):
+        self.universe = universe
+        self.seed = seed
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.calls = 0
+        self.ticks = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+            calls = self.calls
+        if self.latency:
+            time.sleep(self.latency)
+        if self.rate_limit_every and calls % self.rate_limit_every == 0:
+            raise RateLimited(retry_after=self.retry_after)
+
+    def _index(self, coin_id):
+        prefix, _, number = coin_id.lower().partition("-")
+        if prefix == "fake" and number.isdigit() and int(number) < self.universe:
+            return int(number)
+        return None
+
+    def _price(self, index, tick):
+        base = random.Random(f"{self.seed}:{index}").uniform(0.01, 50000)
+        drift = random.Random(f"{self.seed}:{index}:{tick}").uniform(-0.02, 0.02)
+        return to_price(base * (1 + drift))
+
+    def _coin(self, index, tick=None):
+        tick = self.ticks if tick is None else tick
+        return CoinData(f"fake-{index}", f"Fake Coin {index}", f"FK{index}", self._price(index, tick))
+
+    def simple_prices(self, coin_ids):
+        self._call()
+        with self._lock:
+            self.ticks += 1
+            tick = self.ticks
+        indexes = [self._index(coin_id) for coin_id in coin_ids]
+        return {f"fake-{i}": self._price(i, tick) for i in indexes if i is not None}
+
+    def top_coins(self, n=100):
+        self._call()
+        return [self._coin(i) for i in range(min(n, self.universe))]
+
+    def coin_detail(self, coin_id):
+        self._call()
+        index = self._index(coin_id)
+        return None if index is None else self._coin(index)
+
+    def search(self, query):
+        self._call()
+        query = query.lower()
+        if query.startswith("fake-") or query.startswith("fk"):
+            number = query.split("-", 1)[-1].removeprefix("fk")
+            index = self._index(f"fake-{number}")
+            return [] if index is None else [f"fake-{index}"]
+        return []
+
+
+def _encode(value):
+    if isinstance(value, CoinData):
+        return {"__coin__": [value.id, value.name, value.symbol, str(value.price)]}
+    if isinstance(value, Decimal):
+        return {"__decimal__": str(value)}
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if "__coin__" in value:
+            coin_id, name, symbol, price = value["__coin__"]
+            return CoinData(coin_id, name, symbol, Decimal(price))
+        if "__decimal__" in value:
+            return Decimal(value["__decimal__"])
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+def _call_key(method, args):
+    return f"{method}:{json.dumps(list(args))}"
+
+
+class RecordingProvider(PriceProvider):
+    """Pass calls through to `inner` and save every answer to the JSON file at `path`."""
+
+    def __init__(self, inner, path):
+        self.inner = inner
+        self.path = path
+        self.recorded = {}
+        self._lock = threading.Lock()
+
+    def _record(self, method, *args):
+        result = getattr(self.inner, method)(*args)
+        with self._lock:
+            self.recorded[_call_key(method, args)] = _encode(result)
+            with open(self.path, "w") as fh:
+                json.dump(self.recorded, fh, indent=1, sort_keys=True)
+        return result
+
+    def simple_prices(self, coin_ids):
+        return self._record("simple_prices", list(coin_ids))
+
+    def top_coins(self, n=100):
+        return self._record("top_coins", n)
+
+    def coin_detail(self, coin_id):
+        return self._record("coin_detail", coin_id)
+
+    def search(self, query):
+        return self._record("search", query)
+
+
+class ReplayProvider(PriceProvider):
+    """Answer from a file written by RecordingProvider; unknown calls raise ProviderError."""
+
+    def __init__(self, path):
+        with open(path) as fh:
+            self.recorded = json.load(fh)
+
+    def _replay(self, method, *args):
+        key = _call_key(method, args)
+        if key not in self.recorded:
+            raise ProviderError(f"No recorded response for {key}")
+        return _decode(self.recorded[key])
+
+    def simple_prices(self, coin_ids):
+        return self._replay("simple_prices", list(coin_ids))
+
+    def top_coins(self, n=100):
+        return self._replay("top_coins", n)
+
+    def coin_detail(self, coin_id):
+        return self._replay("coin_detail", coin_id)
+
+    def search(self, query):
+        return self._replay("search", query)
+
+
+# Seconds each endpoint's answers are cached for; 0 disables caching.
+# simple_prices feeds ingestion, which must always see live prices.
+DEFAULT_CACHE_TTL = {
+    "simple_prices": 0,
+    "top_coins": 120,
+    "coin_detail": 60,
+    "search": 300,
+}
+
+
+class CachedProvider(PriceProvider):
+    """
+    Cache `inner`'s answers in Django's cache framework with a TTL per
+    endpoint. Unknown coins (coin_detail → None) are cached for
+    `negative_ttl`. Concurrent identical calls share one upstream request
+    (see tracker.cache.single_flight).
+    """
+
+    def __init__(self, inner, alias="default", ttl=None, negative_ttl=300, prefix="provider"):
+        self.inner = inner
+        self.alias = alias
+        self.ttl = {**DEFAULT_CACHE_TTL, **(ttl or {})}
+        self.negative_ttl = negative_ttl
+        self.prefix = prefix
+
+    def _cached(self, method, *args):
+        call = getattr(self.inner, method)
+        ttl = self.ttl.get(method)
+        if not ttl:
+            return call(*args)
+        digest = hashlib.md5(_call_key(method, args).encode()).hexdigest()
+        return single_flight(
+            f"{self.prefix}:{method}:{digest}",
+            lambda: call(*args),
+            ttl,
+            negative_ttl=self.negative_ttl,
+            alias=self.alias,
+        )
+
+    def simple_prices(self, coin_ids):
+        return self._cached("simple_prices", list(coin_ids))
+
+    def top_coins(self, n=100):
+        return self._cached("top_coins", n)
+
+    def coin_detail(self, coin_id):
+        return self._cached("coin_detail", coin_id.lower())
+
+    def search(self, query):
+        return self._cached("search", query.lower())
+
+
+class InstrumentedProvider(PriceProvider):
+    """Time every call made to `inner` (see tracker.metrics.provider_call)."""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    def simple_prices(self, coin_ids):
+        with provider_call("simple_prices"):
+            return self.inner.simple_prices(coin_ids)
+
+    def top_coins(self, n=100):
+        with provider_call("top_coins"):
+            return self.inner.top_coins(n)
+
+    def coin_detail(self, coin_id):
+        with provider_call("coin_detail"):
+            return self.inner.coin_detail(coin_id)
+
+    def search(self, query):
+        with provider_call("search"):
+            return self.inner.search(query)
+
+
+class RateLimitedProvider(PriceProvider):
+    """
+    Take a token from `limiter` (see tracker.ratelimit) before every call to
+    `inner`; a 429 from `inner` pauses the limiter for its Retry-After.
+    """
+
+    def __init__(self, inner, limiter):
+        self.inner = inner
+        self.limiter = limiter
+
+    def _call(self, method, *args):
+        self.limiter.acquire()
+        try:
+            return getattr(self.inner, method)(*args)
+        except RateLimited as e:
+            self.limiter.pause(e.retry_after)
+            raise
+
+    def simple_prices(self, coin_ids):
+        return self._call("simple_prices", coin_ids)
+
+    def top_coins(self, n=100):
+        return self._call("top_coins", n)
+
+    def coin_detail(self, coin_id):
+        return self._call("coin_detail", coin_id)
+
+    def search(self, query):
+        return self._call("search", query)
+
+
+class FakeCoinGeckoServer:
+    """
+    Serve a PriceProvider over HTTP on localhost using CoinGecko's URL
+    layout and JSON shapes, so CoinGeckoProvider(base_url=server.url) can be
+    exercised end to end offline. RateLimited answers become HTTP 429.
+    """
+
+    def __init__(self, provider=None, host="127.0.0.1", port=0):
+        self.provider = provider or FakeProvider()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/api/v3"
+
+    def _handler(server):
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                try:
+                    status, body = server.route(parsed.path.removeprefix("/api/v3"), params)
+                except RateLimited as e:
+                    self.send_response(429)
+                    if e.retry_after is not None:
+                        self.send_header("Retry-After", str(e.retry_after))
+                    self.end_headers()
+                    return
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def route(self, path, params):
+        provider = self.provider
+        if path == "/simple/price":
+            prices = provider.simple_prices([i for i in params.get("ids", "").split(",") if i])
+            return 200, {k: {"usd": float(v)} for k, v in prices.items()}
+        if path == "/coins/markets":
+            coins = provider.top_coins(int(params.get("per_page", 100)))
+            return 200, [
+                {"id": c.id, "name": c.name, "symbol": c.symbol.lower(), "current_price": float(c.price)}
+                for c in coins
+            ]
+        if path == "/search":
+            return 200, {"coins": [{"id": coin_id} for coin_id in provider.search(params.get("query", ""))]}
+        if path.startswith("/coins/"):
+            coin = provider.coin_detail(path.removeprefix("/coins/"))
+            if coin is None:
+                return 404, {"error": "coin not found"}
+            return 200, {
+                "id": coin.id,
+                "name": coin.name,
+                "symbol": coin.symbol.lower(),
+                "market_data": {"current_price": {"usd": float(coin.price)}},
+            }
+        return 404, {"error": "Not found"}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+@lru_cache(maxsize=None)
+def get_provider():
+    """Return the process-wide provider configured by settings.PRICE_PROVIDER."""
+    config = getattr(settings, "PRICE_PROVIDER", {})
+    backend = import_string(config.get("BACKEND", "tracker.providers.CoinGeckoProvider"))
+    # instrumented inside the limiter and the cache, so only calls that reach the backend are timed
+    provider = InstrumentedProvider(backend(**config.get("OPTIONS", {})))
+
+    limit_config = config.get("RATE_LIMIT")
+    if limit_config is not None:
+        from .ratelimit import RateLimiter
+
+        bucket = import_string(limit_config.get("BACKEND", "tracker.ratelimit.CacheBucket"))
+        limiter = RateLimiter(
+            bucket(limit_config["RATE"], limit_config["BURST"], **limit_config.get("OPTIONS", {})),
+            classes=limit_config.get("PRIORITIES"),
+        )
+        provider = RateLimitedProvider(provider, limiter)
+
+    cache_config = config.get("CACHE")
+    if cache_config is not None:
+        provider = CachedProvider(
+            provider,
+            alias=cache_config.get("ALIAS", "default"),
+            ttl=cache_config.get("TTL"),
+            negative_ttl=cache_config.get("NEGATIVE_TTL", 300),
+        )
+    return provider
+
+
+@receiver(setting_changed)
+def _reset_provider(setting, **kwargs):
+    if setting == "PRICE_PROVIDER":
+        get_provider.cache_clear()
@@ -0,0 +1,186 @@
+"""
+Outbound request budget for the price provider.
+
+Every call that reaches the upstream API first takes a token from a token
+bucket refilled at RATE tokens/sec up to BURST. CacheBucket keeps the
+bucket in the shared cache (tracker.cache.shared_cache), so web and Celery
+workers share one budget; it refuses a per-process cache, which would give
+every process a full budget of its own. LocalBucket is an in-process
+stand-in.
+
+Callers run under a priority class (see `priority()`), each with a
+`reserve` (the share of the burst it must leave in the bucket) and a
+`max_wait`. The scheduled refresh has no reserve, so it can always use the
+tokens ad-hoc lookups must leave behind. When no token is available a call
+queues for at most max_wait seconds and is then shed with RateLimited, so
+request handlers fail fast instead of piling onto an exhausted quota. A 429
+from upstream pauses the whole bucket for its Retry-After.
+
+    PRICE_PROVIDER = {
+        ...
+        "RATE_LIMIT": {"BACKEND": "tracker.ratelimit.CacheBucket", "RATE": 0.5, "BURST": 10},
+    }
+"""
+import contextvars
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from .cache import shared_cache
+from .metrics import registry
+from .providers import RateLimited
+
+
+PriorityClass = namedtuple("PriorityClass", ["reserve", "max_wait"])
+
+REFRESH, INTERACTIVE, BACKGROUND = "refresh", "interactive", "background"
+PRIORITY_CLASSES = {
+    REFRESH: PriorityClass(reserve=0.0, max_wait=60.0),  # scheduled price refresh
+    INTERACTIVE: PriorityClass(reserve=0.2, max_wait=2.0),  # lookups made while serving a request
+    BACKGROUND: PriorityClass(reserve=0.5, max_wait=10.0),  # backfills and admin commands
+}
+DEFAULT_PAUSE = 60  # seconds the bucket is paused by a 429 without Retry-After
+LOCK_POLL_MAX = 0.05  # CacheBucket's lock polling backs off from 1ms up to this
+
+current_priority = contextvars.ContextVar("current_priority", default=INTERACTIVE)
+
+budget_outcomes = registry.counter(
+    "price_provider_budget_total",
+    "Outbound budget requests, by priority and outcome (immediate, queued, shed).",
+    ["priority", "outcome"],
+)
+
+
+@contextmanager
+def priority(name):
+    """Run provider calls made inside the block under priority class `name`."""
+    token = current_priority.set(name)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+def take_token(state, now, rate, burst, floor):
+    """
+    Token bucket step on a (tokens, stamp, paused_until) state. Takes one
+    token if that leaves at least `floor` behind. Returns the new state and
+    the seconds to wait before retrying (0 when the token was taken).
+    """
+    tokens, stamp, paused_until = state if state is not None else (burst, now, 0.0)
+    if now < paused_until:
+        return (tokens, stamp, paused_until), paused_until - now
+    tokens = min(burst, tokens + max(0.0, now - stamp) * rate)
+    if tokens - 1 >= floor:
+        return (tokens - 1, now, paused_until), 0.0
+    return (tokens, now, paused_until), (floor + 1 - tokens) / rate
+
+
+def paused(state, now, seconds):
+    """State of a bucket paused for `seconds`: empty, refilling from the end of the pause."""
+    paused_until = state[2] if state is not None else 0.0
+    return 0.0, now + seconds, max(paused_until, now + seconds)
+
+
+class LocalBucket:
+    """Token bucket in this process's memory; the stand-in for tests and single-process setups."""
+
+    def __init__(self, rate, burst, clock=time.time):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.state = None
+        self._lock = threading.Lock()
+
+    def take(self, floor, timeout=None):
+        with self._lock:
+            self.state, wait = take_token(self.state, self.clock(), self.rate, self.burst, floor)
+        return wait
+
+    def pause(self, seconds):
+        with self._lock:
+            self.state = paused(self.state, self.clock(), seconds)
+
+
+class CacheBucket:
+    """
+    Token bucket kept in a Django cache, shared by every process using that
+    cache. Updates are serialized with a cache.add() lock, as in
+    tracker.cache.single_flight. Waiting for the lock is bounded by the
+    caller's remaining `timeout` (lock_timeout when not given), after which
+    the call is shed with RateLimited like an exhausted budget.
+    """
+
+    def __init__(self, rate, burst, alias="default", key="ratelimit:provider", clock=time.time, lock_timeout=5):
+        self.rate = rate
+        self.burst = burst
+        self.alias = alias
+        self.key = key
+        self.clock = clock
+        self.lock_timeout = lock_timeout
+
+    @contextmanager
+    def _locked(self, timeout=None):
+        cache = shared_cache(self.alias)
+        lock_key = f"{self.key}:lock"
+        deadline = time.monotonic() + (self.lock_timeout if timeout is None else timeout)
+        delay = 0.001
+        # a holder that died releases the lock when it expires
+        while not cache.add(lock_key, 1, timeout=self.lock_timeout):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RateLimited("Price provider budget is busy", retry_after=1)
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, LOCK_POLL_MAX)
+        try:
+            yield cache
+        finally:
+            cache.delete(lock_key)
+
+    def take(self, floor, timeout=None):
+        with self._locked(timeout) as cache:
+            state, wait = take_token(cache.get(self.key), self.clock(), self.rate, self.burst, floor)
+            cache.set(self.key, state, timeout=None)
+        return wait
+
+    def pause(self, seconds):
+        with self._locked() as cache:
+            cache.set(self.key, paused(cache.get(self.key), self.clock(), seconds), timeout=None)
+
+
+class RateLimiter:
+
+    def __init__(self, bucket, classes=None, sleep=time.sleep):
+        self.bucket = bucket
+        self.classes = {**PRIORITY_CLASSES, **(classes or {})}
+        self.sleep = sleep
+
+    def acquire(self, name=None):
+        """
+        Take a token under priority class `name` (default: the current
+        one), queueing up to its max_wait. Raises RateLimited when the
+        budget will not allow a call within that time.
+        """
+        name = name or current_priority.get()
+        priority_class = self.classes[name]
+        floor = priority_class.reserve * self.bucket.burst
+        waited = 0.0
+        while True:
+            try:
+                wait = self.bucket.take(floor, timeout=priority_class.max_wait - waited)
+            except RateLimited:
+                budget_outcomes.inc(priority=name, outcome="shed")
+                raise
+            if not wait:
+                budget_outcomes.inc(priority=name, outcome="queued" if waited else "immediate")
+                return waited
+            if waited + wait > priority_class.max_wait:
+                budget_outcomes.inc(priority=name, outcome="shed")
+                raise RateLimited("Price provider budget exhausted", retry_after=max(1, round(wait)))
+            self.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds=None):
+        """Stop every caller for `seconds`, e.g. the Retry-After of a 429."""
+        self.bucket.pause(seconds or DEFAULT_PAUSE)
@@ -0,0 +1,207 @@
+"""
+In-process coin search index.
+
+Every coin's name and symbol are held in memory with 1-2 character prefix
+postings and trigram postings, so a typeahead lookup never touches the
+database. Results are ranked: exact symbol, exact name, symbol prefix, name
+prefix, substring, then (optionally) fuzzy trigram matches.
+
+Coins added through upsert_coins() or saved individually are indexed right
+away and announced through the shared cache, so other processes load rows
+newer than the last id they have seen; a periodic full rebuild picks up renames
+and deletions.
+"""
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from rest_framework.filters import SearchFilter
+
+from .cache import shared_cache
+from .models import Coin
+
+
+INDEX_VERSION_KEY = "coins:search:version"
+PREFIX_MAX = 2  # longer queries find prefix matches through their trigrams
+TRIGRAM_MIN_SCORE = 0.5  # share of the query's trigrams a fuzzy match must have
+CHECK_INTERVAL = 1.0  # seconds between checks of the shared version
+REBUILD_INTERVAL = 60 * 60
+FILTER_MATCH_LIMIT = 1000  # ids handed to the database by CoinIndexSearchFilter
+
+EXACT_SYMBOL, EXACT_NAME, SYMBOL_PREFIX, NAME_PREFIX, SUBSTRING, FUZZY = range(6)
+
+
+def normalize(text):
+    return " ".join(re.findall(r"[a-z0-9]+", (text or "").lower()))
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class CoinIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.entries = {}  # coin id -> (name, symbol), normalized
+            self.prefixes = defaultdict(set)
+            self.trigrams = defaultdict(set)
+            self.short_results = {}  # ranked ids of 1-2 character queries, the widest ones
+            self.max_id = 0
+            self._version = None
+            self._built_at = None
+            self._checked_at = 0.0
+
+    def _keys(self, name, symbol):
+        prefixes = {word[:n] for word in (symbol, *name.split()) for n in range(1, PREFIX_MAX + 1) if word}
+        return prefixes, trigrams(name) | trigrams(symbol)
+
+    def _add(self, coin_id, name, symbol):
+        self._remove(coin_id)
+        name, symbol = normalize(name), normalize(symbol)
+        self.entries[coin_id] = (name, symbol)
+        prefixes, grams = self._keys(name, symbol)
+        for key in prefixes:
+            self.prefixes[key].add(coin_id)
+        for gram in grams:
+            self.trigrams[gram].add(coin_id)
+
+    def _remove(self, coin_id):
+        entry = self.entries.pop(coin_id, None)
+        if entry is None:
+            return
+        prefixes, grams = self._keys(*entry)
+        for key in prefixes:
+            self.prefixes[key].discard(coin_id)
+        for gram in grams:
+            self.trigrams[gram].discard(coin_id)
+
+    def add(self, rows):
+        """Index (id, name, symbol) rows, replacing earlier entries of the same ids."""
+        with self._lock:
+            for row in rows:
+                self._add(*row)
+            self.short_results = {}
+
+    def rebuild(self):
+        """Reindex every coin off to the side, then swap the new postings in."""
+        version = shared_cache().get(INDEX_VERSION_KEY)
+        fresh = CoinIndex()
+        rows = list(Coin.objects.values_list("id", "name", "symbol").iterator(chunk_size=5000))
+        fresh.add(rows)
+        with self._lock:
+            self.entries, self.prefixes, self.trigrams = fresh.entries, fresh.prefixes, fresh.trigrams
+            self.short_results = {}
+            # only ids read from the database advance max_id, so rows other
+            # processes inserted below a locally indexed id are not skipped
+            self.max_id = max((row[0] for row in rows), default=0)
+        self._version, self._built_at = version, time.monotonic()
+
+    def load_new(self):
+        """Index coins created since the highest id loaded from the database."""
+        version = shared_cache().get(INDEX_VERSION_KEY)
+        rows = list(Coin.objects.filter(id__gt=self.max_id).values_list("id", "name", "symbol"))
+        self.add(rows)
+        self.max_id = max((row[0] for row in rows), default=self.max_id)
+        self._version = version
+
+    def ensure_current(self):
+        now = time.monotonic()
+        if self._built_at is not None and now - self._checked_at < CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        if self._built_at is None or now - self._built_at > REBUILD_INTERVAL:
+            self.rebuild()
+        elif shared_cache().get(INDEX_VERSION_KEY) != self._version:
+            self.load_new()
+
+    def _rank(self, query, coin_id):
+        name, symbol = self.entries[coin_id]
+        if symbol == query:
+            return EXACT_SYMBOL
+        if name == query:
+            return EXACT_NAME
+        if symbol.startswith(query):
+            return SYMBOL_PREFIX
+        if name.startswith(query) or f" {query}" in name:
+            return NAME_PREFIX
+        if query in name or query in symbol:
+            return SUBSTRING
+        return None
+
+    def search(self, query, limit=None, fuzzy=True):
+        """Ids of coins matching `query`, best first."""
+        query = normalize(query)
+        if not query:
+            return []
+        self.ensure_current()
+
+        with self._lock:
+            if query in self.short_results:
+                ranked = self.short_results[query]
+                return ranked[:limit] if limit else list(ranked)
+
+            scored = {}
+            if len(query) <= PREFIX_MAX:
+                for coin_id in self.prefixes.get(query, ()):
+                    rank = self._rank(query, coin_id)
+                    if rank is not None:
+                        scored[coin_id] = (rank, 0.0)
+            else:
+                grams = trigrams(query)
+                shared = Counter()
+                for gram in grams:
+                    shared.update(self.trigrams.get(gram, ()))
+                for coin_id, count in shared.items():
+                    # a substring match contains every trigram of the query
+                    rank = self._rank(query, coin_id) if count == len(grams) else None
+                    if rank is not None:
+                        scored[coin_id] = (rank, 0.0)
+                    elif fuzzy and count / len(grams) >= TRIGRAM_MIN_SCORE:
+                        scored[coin_id] = (FUZZY, -count / len(grams))
+
+            ranked = sorted(scored, key=lambda i: (*scored[i], len(self.entries[i][0]), i))
+            if len(query) <= PREFIX_MAX:
+                self.short_results[query] = ranked
+        return ranked[:limit] if limit else list(ranked)
+
+
+coin_index = CoinIndex()
+
+
+def index_coins(coins):
+    """Index Coin instances here and tell other processes to load them."""
+    coin_index.add((coin.id, coin.name, coin.symbol) for coin in coins)
+    shared_cache().set(INDEX_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def search_coins(query, limit=None, fuzzy=True):
+    return coin_index.search(query, limit=limit, fuzzy=fuzzy)
+
+
+class CoinIndexSearchFilter(SearchFilter):
+    """
+    ?search= answered from the coin index instead of icontains scans. Every
+    term must match (as with SearchFilter); fuzzy matches are left out.
+
+    At most FILTER_MATCH_LIMIT ids (the best-ranked ones) go to the database,
+    so a one-letter term cannot build a giant IN clause; when matches were
+    dropped the view is flagged and the page says "search_truncated".
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        ids = search_coins(terms[0], fuzzy=False)
+        for term in terms[1:]:
+            also = set(search_coins(term, fuzzy=False))
+            ids = [coin_id for coin_id in ids if coin_id in also]
+        view.search_truncated = len(ids) > FILTER_MATCH_LIMIT
+        return queryset.filter(id__in=ids[:FILTER_MATCH_LIMIT])
+
@@ -1,6 +1,10 @@
+import numpy as np
 from rest_framework import serializers
 from django.utils.timezone import now
+from .downsampling import downsampled_history
 from .models import Coin, Portfolio, PortfolioHistory, Watchlist
+from .prices import current_prices
+from .valuation import to_units, value_holdings
 
 
 
@@ -8,6 +12,8 @@ class CoinSerializer(serializers.ModelSerializer):
     class Meta:
         model = Coin
         fields = "__all__"
+        # maintained by the scheduled refresh
+        read_only_fields = ["refresh_tier", "refreshed_at"]
 
     def validate_price(self, value):
         if value <= 0:
@@ -35,12 +41,42 @@ class WatchlistSerializer(serializers.ModelSerializer):
         fields = ["id", "coin", "coin_id", "date_added", "in_portfolio"]
         
     def get_in_portfolio(self, obj):
+        if hasattr(obj, "in_portfolio"):
+            return obj.in_portfolio
         user = self._context["request"].user
         return obj.coin.holdings.filter(user=user).exists()
     
     
 
+def set_current_values(portfolios):
+    """Value Portfolio instances in one kernel pass, at the request's price snapshot."""
+    portfolios = list(portfolios)
+    coin_ids = np.array([p.coin_id for p in portfolios], dtype=np.int64)
+    unique_coins, coin_index = np.unique(coin_ids, return_inverse=True)
+    valuation = value_holdings(
+        to_units([p.amount for p in portfolios]), coin_index, current_prices(unique_coins).units_of(unique_coins),
+    )
+    for portfolio, value in zip(portfolios, valuation.values):
+        portfolio.current_value = float(value)
+    return portfolios
+
+
+class PortfolioListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        portfolios = list(data.all() if hasattr(data, "all") else data)
+        return super().to_representation(set_current_values(portfolios))
+
+
 class PortfolioSerializer(serializers.ModelSerializer):
+    """
+    Reads `initial_value` from the annotation added by
+    PortfolioQuerySet.with_valuation() and the snapshots prefetched by
+    with_recent_history(), falling back to queries for bare instances.
+    `current_value` comes from the valuation kernel, for a whole page at once
+    when serializing many.
+    `history` is only included when the context sets include_history.
+    """
     # relationships
     coin = CoinSerializer(read_only=True)
     coin_id = serializers.PrimaryKeyRelatedField(
@@ -53,7 +89,7 @@ class PortfolioSerializer(serializers.ModelSerializer):
     current_value = serializers.SerializerMethodField()
     usd_growth = serializers.SerializerMethodField()
     pct_growth = serializers.SerializerMethodField()
-    history = PortfolioHistorySerializer(many=True, read_only=True)
+    history = serializers.SerializerMethodField()
 
     class Meta:
         model = Portfolio
@@ -69,17 +105,33 @@ class PortfolioSerializer(serializers.ModelSerializer):
             "pct_growth",
             "history",
         ]
+        list_serializer_class = PortfolioListSerializer
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self.context.get("include_history"):
+            fields.pop("history")
+        return fields
+
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        # a value computed before amount/coin changed is stale
+        set_current_values([instance])
+        return instance
         
     def get_user(self, obj):
         return obj.user.name
 
     def get_initial_value(self, obj):
-        first_snapshot = obj.history.order_by("date").first()
-        return float(first_snapshot.value_usd) if first_snapshot else None
+        if not hasattr(obj, "initial_value"):
+            first_snapshot = obj.history.order_by("date").first()
+            obj.initial_value = first_snapshot.value_usd if first_snapshot else None
+        return float(obj.initial_value) if obj.initial_value is not None else None
 
     def get_current_value(self, obj):
-        live_price = obj.coin.price if obj.coin else 0
-        return float(obj.amount) * float(live_price)
+        if not hasattr(obj, "current_value"):
+            set_current_values([obj])
+        return float(obj.current_value)
 
     def get_usd_growth(self, obj):
         initial_value = self.get_initial_value(obj)
@@ -95,6 +147,22 @@ class PortfolioSerializer(serializers.ModelSerializer):
             return 0
         return ((current_value - initial_value) / initial_value) * 100
 
+    def get_history(self, obj):
+        limit = self.context.get("history_limit", 30)
+        history = getattr(obj, "recent_history", None)
+        if history is None:
+            history = list(reversed(obj.history.order_by("-date")[:limit]))
+
+        resolution = self.context.get("history_resolution")
+        max_points = self.context.get("history_max_points")
+        if resolution or max_points:
+            series = (
+                np.array([h.date for h in history], dtype="datetime64[D]"),
+                np.array([h.value_usd for h in history], dtype=np.float64),
+            )
+            return downsampled_history(obj.id, resolution, max_points, series=series, scope=f"latest{limit}")
+        return PortfolioHistorySerializer(history, many=True).data
+
 
 
 
@@ -0,0 +1,79 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .aggregates import Holding, apply_holding_change, apply_price_changes, holding_state
+from .cache import invalidate_prices
+from .search import index_coins
+from .models import Coin, Portfolio
+from .utils import PriceChange, publish_price_changes
+
+
+@receiver(pre_save, sender=Portfolio)
+def remember_holding_state(sender, instance, raw=False, **kwargs):
+    """Keep the stored state of a holding so post_save can apply the delta."""
+    instance._previous_state = None
+    if instance.pk and not raw:
+        previous = (
+            Portfolio.objects.filter(pk=instance.pk)
+            .values_list("user_id", "name", "coin_id", "amount")
+            .first()
+        )
+        if previous is not None:
+            instance._previous_state = Holding(instance.pk, *previous)
+
+
+@receiver(post_save, sender=Portfolio)
+def update_aggregates_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    apply_holding_change(getattr(instance, "_previous_state", None), holding_state(instance))
+
+
+@receiver(post_delete, sender=Portfolio)
+def update_aggregates_on_delete(sender, instance, origin=None, **kwargs):
+    # the user's aggregates are being deleted along with their holdings
+    if isinstance(origin, get_user_model()):
+        return
+    apply_holding_change(holding_state(instance), None)
+
+
+@receiver(pre_save, sender=Coin)
+def remember_coin_price(sender, instance, raw=False, **kwargs):
+    """Lock the stored row and keep its price, so post_save can apply the move."""
+    instance._previous_price = None
+    if instance.pk and not raw:
+        instance._previous_price = (
+            Coin.objects.select_for_update().filter(pk=instance.pk).values_list("price", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Coin)
+def publish_saved_price(sender, instance, raw=False, **kwargs):
+    # admin and API edits; refreshes and upserts write in bulk and apply their own changes
+    old_price = getattr(instance, "_previous_price", None)
+    if raw or old_price is None:
+        return
+    price = Decimal(str(instance.price))
+    if price == old_price:
+        return
+    changes = [PriceChange(instance.pk, old_price, price)]
+    apply_price_changes(changes)
+    transaction.on_commit(lambda: publish_price_changes(changes))
+
+
+@receiver(post_save, sender=Coin)
+@receiver(post_delete, sender=Coin)
+def invalidate_coin_list(sender, **kwargs):
+    invalidate_prices()
+
+
+@receiver(post_save, sender=Coin)
+def index_saved_coin(sender, instance, raw=False, **kwargs):
+    # fetch_coin_on_demand, admin and API edits; bulk upserts index themselves
+    if not raw:
+        index_coins([instance])
+
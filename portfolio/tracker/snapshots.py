@@ -0,0 +1,68 @@
+import time
+
+from django.utils.timezone import now
+
+from .models import Portfolio, PortfolioHistory
+from .valuation import as_cents, to_units, value_holdings
+
+
+SNAPSHOT_CHUNK_SIZE = 2000
+
+
+def _upsert(snapshots):
+    PortfolioHistory.objects.bulk_create(
+        snapshots,
+        update_conflicts=True,
+        unique_fields=["portfolio", "date"],
+        update_fields=["value_usd"],
+    )
+
+
+def _snapshot_chunk(rows, day):
+    """PortfolioHistory rows of one chunk of (id, amount, price), valued in one kernel pass."""
+    ids, amounts, prices = zip(*rows)
+    valuation = value_holdings(to_units(amounts), range(len(rows)), to_units(prices))
+    return [
+        PortfolioHistory(portfolio_id=portfolio_id, date=day, value_usd=value)
+        for portfolio_id, value in zip(ids, as_cents(valuation.units))
+    ]
+
+
+def snapshot_portfolios(day=None, chunk_size=SNAPSHOT_CHUNK_SIZE):
+    """
+    Record today's PortfolioHistory row for every priced holding.
+
+    Holdings are streamed joined to their coin price with a server-side
+    cursor, valued exactly by tracker.valuation (half-up to cents) one
+    chunk at a time and upserted with one INSERT .. ON CONFLICT per chunk,
+    so memory stays flat however many holdings exist. Returns {"date", "rows", "elapsed", "rows_per_sec"}.
+    """
+    day = day or now().date()
+    started = time.monotonic()
+
+    rows = (
+        Portfolio.objects.filter(coin__price__gt=0)
+        .order_by()
+        .values_list("id", "amount", "coin__price")
+        .iterator(chunk_size=chunk_size)
+    )
+
+    written = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            _upsert(_snapshot_chunk(batch, day))
+            written += len(batch)
+            batch = []
+    if batch:
+        _upsert(_snapshot_chunk(batch, day))
+        written += len(batch)
+
+    elapsed = time.monotonic() - started
+    return {
+        "date": day,
+        "rows": written,
+        "elapsed": round(elapsed, 3),
+        "rows_per_sec": round(written / elapsed, 1) if elapsed > 0 else None,
+    }
@@ -0,0 +1,166 @@
+"""
+Live price feed for Server-Sent Events.
+
+publish_feed() appends every published change set (and the alerts it
+triggered) to a sequence of entries in the shared cache (see
+tracker.cache.shared_cache), so it works from Celery workers as well as
+web processes; a per-process cache is refused with ImproperlyConfigured
+rather than leaving streams silent. Each ASGI process runs a single PriceBroadcaster
+poller that reads the new entries once per tick, merges them and fans the
+result out to its subscriptions, indexed by coin and by user. A
+subscription holds only the latest price per coin until its client reads
+it, so slow consumers get coalesced updates instead of a growing backlog.
+"""
+import asyncio
+from collections import defaultdict
+
+from .cache import shared_cache
+
+
+FEED_SEQ_KEY = "prices:feed:seq"
+FEED_ENTRY_TTL = 60 * 10
+POLL_INTERVAL = 1.0  # seconds between feed reads of a process's poller
+MAX_BACKLOG = 100  # feed entries a poller catches up on after a stall
+ALERT_BACKLOG = 50  # triggered alerts kept for a subscriber that is not reading
+
+
+def feed_key(seq):
+    return f"prices:feed:{seq}"
+
+
+def publish_feed(changes, alerts=()):
+    """Append a changed-set of PriceChange and its triggered alerts to the feed."""
+    entry = {
+        "prices": {c.coin_id: str(c.new_price) for c in changes},
+        "alerts": [
+            {
+                "id": alert.id,
+                "user_id": alert.user_id,
+                "coin_id": alert.coin_id,
+                "target_price": str(alert.target_price),
+                "message": alert.message,
+            }
+            for alert in alerts
+        ],
+    }
+    cache = shared_cache()
+    cache.add(FEED_SEQ_KEY, 0, timeout=None)
+    seq = cache.incr(FEED_SEQ_KEY)
+    cache.set(feed_key(seq), entry, FEED_ENTRY_TTL)
+    return seq
+
+
+class Subscription:
+
+    def __init__(self, coin_ids, user_id=None):
+        self.coin_ids = frozenset(coin_ids)
+        self.user_id = user_id
+        self.seq = 0
+        self.prices = {}
+        self.alerts = []
+        self._ready = asyncio.Event()
+
+    def push(self, seq, prices, alerts):
+        self.seq = seq
+        self.prices.update(prices)  # newer prices replace unread ones
+        self.alerts = (self.alerts + alerts)[-ALERT_BACKLOG:]
+        self._ready.set()
+
+    async def next(self, timeout=None):
+        """(seq, prices, alerts) accumulated since the last call; raises TimeoutError when idle."""
+        await asyncio.wait_for(self._ready.wait(), timeout)
+        self._ready.clear()
+        prices, alerts, self.prices, self.alerts = self.prices, self.alerts, {}, []
+        return self.seq, prices, alerts
+
+
+class PriceBroadcaster:
+
+    def __init__(self, poll_interval=POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.subscriptions = set()
+        self.by_coin = defaultdict(set)
+        self.by_user = defaultdict(set)
+        self.last_seq = None
+        self._waiting_on = None
+        self._task = None
+
+    def subscribe(self, coin_ids, user_id=None):
+        shared_cache()  # fail the request now, not the poller later
+        subscription = Subscription(coin_ids, user_id)
+        self.subscriptions.add(subscription)
+        for coin_id in subscription.coin_ids:
+            self.by_coin[coin_id].add(subscription)
+        if user_id is not None:
+            self.by_user[user_id].add(subscription)
+
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.discard(subscription)
+        for coin_id in subscription.coin_ids:
+            self.by_coin[coin_id].discard(subscription)
+            if not self.by_coin[coin_id]:
+                del self.by_coin[coin_id]
+        if subscription.user_id is not None:
+            self.by_user[subscription.user_id].discard(subscription)
+            if not self.by_user[subscription.user_id]:
+                del self.by_user[subscription.user_id]
+
+    def broadcast(self, seq, prices, alerts):
+        """Deliver one merged tick to the subscriptions it concerns."""
+        touched = defaultdict(lambda: ({}, []))
+        for coin_id, price in prices.items():
+            for subscription in self.by_coin.get(coin_id, ()):
+                touched[subscription][0][coin_id] = price
+        for alert in alerts:
+            for subscription in self.by_user.get(alert["user_id"], ()):
+                touched[subscription][1].append(alert)
+        for subscription, (sub_prices, sub_alerts) in touched.items():
+            subscription.push(seq, sub_prices, sub_alerts)
+        return len(touched)
+
+    async def poll_once(self):
+        """Read feed entries newer than the last one seen and broadcast them as one tick."""
+        cache = shared_cache()
+        seq = await cache.aget(FEED_SEQ_KEY, 0)
+        if self.last_seq is None or seq < self.last_seq:
+            self.last_seq = seq  # first poll, or the counter was lost
+            return 0
+        if seq == self.last_seq:
+            return 0
+
+        first = max(self.last_seq + 1, seq - MAX_BACKLOG + 1)
+        entries = await cache.aget_many([feed_key(n) for n in range(first, seq + 1)])
+        prices, alerts = {}, []
+        delivered = first - 1
+        for n in range(first, seq + 1):
+            entry = entries.get(feed_key(n))
+            if entry is None:
+                if n != self._waiting_on:
+                    # counter bumped but entry not written yet: retry next tick
+                    self._waiting_on = n
+                    break
+                self._waiting_on = None  # still missing a tick later: expired, skip it
+            else:
+                prices.update(entry["prices"])
+                alerts += entry["alerts"]
+            delivered = n
+
+        if delivered >= first:
+            self.last_seq = delivered
+            return self.broadcast(delivered, prices, alerts)
+        return 0
+
+    async def _run(self):
+        await self.poll_once()
+        while self.subscriptions:
+            await asyncio.sleep(self.poll_interval)
+            await self.poll_once()
+        self.last_seq = None  # the next subscriber starts from the current tick
+
+
+broadcaster = PriceBroadcaster()
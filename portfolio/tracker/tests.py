@@ -1,5 +1,1390 @@
-from django.test import TestCase
+import asyncio
+from importlib import import_module
+import json
+import os
+from types import SimpleNamespace
+import tempfile
+import threading
+import time
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from unittest.mock import patch
 
-# Create your tests here.
+import numpy as np
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from kombu.exceptions import OperationalError
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
 
+from accounts.models import CustomUser
+from alerts.models import Alert
+from . import analytics, benchmarks, downsampling, metrics, tiers, valuation
+from .aggregates import apply_price_changes, diff_aggregates
+from .cache import PRICE_VERSION_KEY, invalidate_prices, price_version, single_flight
+from .models import Coin, Portfolio, PortfolioAggregate, PortfolioHistory, PriceTick, PriceCandle, Watchlist
+from .prices import PriceSnapshotMiddleware, current_prices, price_table
+from .leases import DatabaseLeases, LocalLeases, get_leases
+from .search import coin_index, search_coins
+from .snapshots import snapshot_portfolios
+from .streaming import PriceBroadcaster, broadcaster, publish_feed
+from .ticks import record_ticks, rollup, prune, pick_resolution
+from .providers import (
+    CachedProvider, CoinGeckoProvider, FakeProvider, FakeCoinGeckoServer, InstrumentedProvider, RateLimitedProvider,
+    RecordingProvider, ReplayProvider, ProviderError, RateLimited, get_provider,
+)
+from .ratelimit import (
+    CacheBucket, LocalBucket, PriorityClass, RateLimiter, budget_outcomes, INTERACTIVE, REFRESH,
+)
+from .utils import (
+    apply_coin_prices, update_coin_prices, populate_top_coins, record_portfolio_snapshots, publish_price_changes, PriceChange,
+    recompute_refresh_tiers, refresh_coin_price, refresh_leases,
+)
 
+
+def updates(ctx):
+    return [q["sql"] for q in ctx.captured_queries if q["sql"].startswith("UPDATE")]
+
+
+class PriceIngestionTestCase(TestCase):
+
+    def setUp(self):
+        self.btc = Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price="30000")
+        self.eth = Coin.objects.create(coingecko_id="ethereum", name="Ethereum", symbol="ETH", price="2000")
+
+    def test_apply_coin_prices_writes_only_changed_rows(self):
+        with CaptureQueriesContext(connection) as ctx:
+            changes = apply_coin_prices({"bitcoin": Decimal("31000"), "ethereum": Decimal("2000")})
+
+        self.assertEqual(len(updates(ctx)), 1)
+        self.assertEqual(changes, [PriceChange(self.btc.id, Decimal("30000"), Decimal("31000"))])
+        self.btc.refresh_from_db()
+        self.assertEqual(self.btc.price, Decimal("31000"))
+
+    def test_apply_coin_prices_no_changes_skips_update(self):
+        with CaptureQueriesContext(connection) as ctx:
+            changes = apply_coin_prices({"bitcoin": Decimal("30000")})
+
+        self.assertEqual(updates(ctx), [])
+        self.assertEqual(changes, [])
+
+    @patch("tracker.utils.PRICE_CHUNK_SIZE", 1)
+    @patch("tracker.utils.get_coin_prices")
+    def test_update_coin_prices_chunks_ids(self, mock_get):
+        mock_get.side_effect = lambda ids: {i: Decimal("1") for i in ids}
+
+        changes = update_coin_prices()
+
+        self.assertEqual([c.args[0] for c in mock_get.call_args_list], [["bitcoin"], ["ethereum"]])
+        self.assertEqual({c.coin_id for c in changes}, {self.btc.id, self.eth.id})
+
+
+class PriceHistoryTestCase(TestCase):
+
+    def setUp(self):
+        self.coin = Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price="100")
+        self.t0 = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+    def test_rollup_builds_ohlc_candles_per_resolution(self):
+        prices = ["100", "105", "95", "102"]
+        record_ticks([(self.coin.id, Decimal(p)) for p in prices[:2]], self.t0)
+        record_ticks([(self.coin.id, Decimal(prices[2]))], self.t0 + timedelta(seconds=30))
+        record_ticks([(self.coin.id, Decimal(prices[3]))], self.t0 + timedelta(minutes=1))
+
+        self.assertEqual(rollup("1m"), 2)
+        self.assertEqual(rollup("1h"), 1)
+        hourly = PriceCandle.objects.get(resolution="1h")
+        self.assertEqual(
+            (hourly.open, hourly.high, hourly.low, hourly.close),
+            (Decimal("100"), Decimal("105"), Decimal("95"), Decimal("102")),
+        )
+
+    def test_prune_applies_retention(self):
+        record_ticks([(self.coin.id, Decimal("1"))], self.t0)
+        record_ticks([(self.coin.id, Decimal("2"))], self.t0 + timedelta(days=3))
+        rollup("1m")
+
+        prune(at=self.t0 + timedelta(days=3))
+
+        self.assertEqual(PriceTick.objects.count(), 1)
+        self.assertEqual(PriceCandle.objects.filter(resolution="1m").count(), 2)
+
+    def test_history_rejects_unbounded_hours(self):
+        for hours in ("1e9", "nan", "inf", "-1", "soon"):
+            with self.subTest(hours=hours):
+                response = self.client.get(f"/api/coins/{self.coin.id}/history/", {"hours": hours})
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(f"/api/coins/{self.coin.id}/history/", {"hours": "48"}).status_code, 200)
+
+    @patch("tracker.utils.PRICE_CHUNK_SIZE", 1)
+    @patch("tracker.utils.get_coin_prices")
+    def test_refresh_stamps_each_chunk_when_applied(self, mock_get):
+        Coin.objects.create(coingecko_id="ethereum", name="Ethereum", symbol="ETH", price="10")
+        mock_get.side_effect = lambda ids: {i: Decimal("1") for i in ids}
+        stamps = iter([self.t0, self.t0 + timedelta(minutes=5)])
+
+        with patch("tracker.utils.now", side_effect=lambda: next(stamps)):
+            update_coin_prices()
+
+        self.assertEqual(
+            sorted(PriceTick.objects.values_list("timestamp", flat=True)),
+            [self.t0, self.t0 + timedelta(minutes=5)],
+        )
+
+    def test_pick_resolution_steps_coarser_for_long_ranges(self):
+        at = self.t0
+        self.assertEqual(pick_resolution(at - timedelta(hours=1), at, 500, at=at), "1m")
+        self.assertEqual(pick_resolution(at - timedelta(days=2), at, 500, at=at), "1h")
+        self.assertEqual(pick_resolution(at - timedelta(days=365), at, 500, at=at), "1d")
+
+
+FAKE_PROVIDER = {"BACKEND": "tracker.providers.FakeProvider", "OPTIONS": {"universe": 50}}
+
+
+class PriceProviderTestCase(TestCase):
+
+    def test_fake_provider_is_deterministic(self):
+        a, b = FakeProvider(seed=3), FakeProvider(seed=3)
+        self.assertEqual(a.simple_prices(["fake-1", "fake-2"]), b.simple_prices(["fake-1", "fake-2"]))
+        self.assertIsNone(a.coin_detail("bitcoin"))
+
+    def test_fake_provider_rate_limits(self):
+        provider = FakeProvider(rate_limit_every=2)
+        provider.top_coins(1)
+        with self.assertRaises(RateLimited):
+            provider.top_coins(1)
+
+    @override_settings(PRICE_PROVIDER=FAKE_PROVIDER)
+    def test_ingestion_runs_offline_against_fake_provider(self):
+        populate_top_coins(20)
+        self.assertEqual(Coin.objects.count(), 20)
+
+        changes = update_coin_prices()
+
+        self.assertEqual(len(changes), 20)
+
+    def test_coingecko_provider_against_fake_server(self):
+        with FakeCoinGeckoServer(FakeProvider(universe=10, rate_limit_every=4)) as server:
+            provider = CoinGeckoProvider(base_url=server.url)
+
+            self.assertEqual(set(provider.simple_prices(["fake-1", "fake-2", "bitcoin"])), {"fake-1", "fake-2"})
+            self.assertEqual(provider.coin_detail("fake-3").symbol, "FK3")
+            self.assertIsNone(provider.coin_detail("bitcoin"))
+            with self.assertRaises(RateLimited):
+                provider.search("fk1")
+
+    def test_record_and_replay(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "recording.json")
+            recorder = RecordingProvider(FakeProvider(), path)
+            prices = recorder.simple_prices(["fake-1"])
+            top = recorder.top_coins(3)
+
+            replay = ReplayProvider(path)
+
+            self.assertEqual(replay.simple_prices(["fake-1"]), prices)
+            self.assertEqual(replay.top_coins(3), top)
+            with self.assertRaises(ProviderError):
+                replay.search("nothing recorded")
+
+
+class SearchCoinTestCase(APITestCase):
+
+    def setUp(self):
+        coin_index.clear()
+
+    def test_search_miss_fetches_details_concurrently(self):
+        provider = FakeProvider(universe=10, latency=0.2)
+        provider.search = lambda query: [f"fake-{i}" for i in range(5)]
+
+        with patch("tracker.views.get_provider", return_value=provider):
+            started = time.monotonic()
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get("/api/search-coin/", {"query": "fake"})
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c["coingecko_id"] for c in response.data], [f"fake-{i}" for i in range(5)])
+        self.assertLess(elapsed, 0.2 * 5)
+        # local lookup, existing prices, one upsert, one re-read (+ savepoint and release under TestCase)
+        self.assertEqual(len(ctx.captured_queries), 6)
+
+    def test_near_miss_of_a_local_coin_still_searches_upstream(self):
+        Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price="100")
+        provider = FakeProvider(universe=10)
+        provider.search = lambda query: ["fake-1"]
+
+        with patch("tracker.views.get_provider", return_value=provider):
+            for query in ("bitcoin cash", "bitcoinz", "bitcoin-sv"):
+                with self.subTest(query=query):
+                    response = self.client.get("/api/search-coin/", {"query": query})
+                    self.assertEqual([c["coingecko_id"] for c in response.data], ["fake-1"])
+
+        self.assertEqual(self.client.get("/api/search-coin/", {"query": "bitc"}).data[0]["symbol"], "BTC")
+
+    def test_search_deadline_drops_slow_details(self):
+        provider = FakeProvider(universe=10, latency=0.5)
+        provider.search = lambda query: ["fake-1"]
+
+        with patch("tracker.views.get_provider", return_value=provider), patch("tracker.views.SEARCH_DEADLINE", 0.05):
+            response = self.client.get("/api/search-coin/", {"query": "fake"})
+
+        self.assertEqual(response.data, [])
+
+
+class CachedProviderTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_caches_answers_and_404s(self):
+        inner = FakeProvider(universe=10)
+        provider = CachedProvider(inner)
+
+        self.assertEqual(provider.coin_detail("fake-1"), provider.coin_detail("FAKE-1"))
+        self.assertIsNone(provider.coin_detail("bitcoin"))
+        self.assertIsNone(provider.coin_detail("bitcoin"))
+
+        self.assertEqual(inner.calls, 2)
+
+    def test_simple_prices_are_not_cached_by_default(self):
+        inner = FakeProvider(universe=10)
+        provider = CachedProvider(inner)
+
+        provider.simple_prices(["fake-1"])
+        provider.simple_prices(["fake-1"])
+
+        self.assertEqual(inner.calls, 2)
+
+    def test_concurrent_identical_requests_share_one_upstream_call(self):
+        inner = FakeProvider(universe=10, latency=0.2)
+        provider = CachedProvider(inner)
+
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            results = list(pool.map(lambda _: provider.coin_detail("fake-2"), range(10)))
+
+        self.assertEqual(inner.calls, 1)
+        self.assertEqual(len(set(results)), 1)
+
+    def test_slow_key_does_not_hold_up_others_on_its_stripe(self):
+        calls = []
+
+        def slow(key):
+            calls.append(key)
+            time.sleep(0.2)
+            return key
+
+        one_stripe = threading.Lock()
+        with patch("tracker.cache._thread_lock", return_value=one_stripe), ThreadPoolExecutor(max_workers=4) as pool:
+            started = time.monotonic()
+            results = list(pool.map(lambda key: single_flight(key, lambda: slow(key), ttl=60), ["a", "b", "c", "a"]))
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(results, ["a", "b", "c", "a"])
+        self.assertEqual(sorted(calls), ["a", "b", "c"])
+        self.assertLess(elapsed, 0.4)
+
+    def test_failures_are_not_cached(self):
+        inner = FakeProvider(universe=10, rate_limit_every=1)
+        provider = CachedProvider(inner)
+
+        for _ in range(2):
+            with self.assertRaises(RateLimited):
+                provider.coin_detail("fake-1")
+        self.assertEqual(inner.calls, 2)
+
+
+class PortfolioSummaryTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="owner@example.com", password="pw")
+        other = CustomUser.objects.create_user(email="other@example.com", password="pw")
+        btc = Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="btc", price="100")
+        eth = Coin.objects.create(coingecko_id="ethereum", name="Ethereum", symbol="ETH", price="10")
+        Portfolio.objects.create(user=self.user, name="main", coin=eth, amount="50")
+        Portfolio.objects.create(user=self.user, name="main", coin=btc, amount="1")
+        Portfolio.objects.create(user=other, name="main", coin=btc, amount="1000")
+        self.client.force_authenticate(self.user)
+
+    def test_summary_is_scoped_and_ordered_by_value(self):
+        price_table.current()
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/portfolio/summary/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["total_value_usd"], 600.0)
+        self.assertEqual(response.data["holdings_count"], 2)
+        self.assertEqual([h["symbol"] for h in response.data["breakdown"]], ["ETH", "BTC"])
+        self.assertEqual(response.data["breakdown"][0]["value_usd"], 500.0)
+
+
+class PortfolioListTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="owner@example.com", password="pw", name="Owner")
+        coin = Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price="200")
+        for i in range(5):
+            holding = Portfolio.objects.create(user=self.user, name="main", coin=coin, amount="1")
+            for day in range(1, 4):
+                PortfolioHistory.objects.create(portfolio=holding, date=date(2025, 1, day), value_usd=100 * day)
+        self.client.force_authenticate(self.user)
+
+    def test_list_query_count_is_constant(self):
+        price_table.current()
+        # page count + page of annotated holdings
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/portfolio/")
+
+        item = response.data["results"][0]
+        self.assertNotIn("history", item)
+        self.assertEqual(item["initial_value"], 100.0)
+        self.assertEqual(item["current_value"], 200.0)
+        self.assertEqual(item["usd_growth"], 100.0)
+        self.assertEqual(item["pct_growth"], 100.0)
+        self.assertEqual(item["user"], "Owner")
+
+    def test_history_is_opt_in_and_bounded(self):
+        price_table.current()
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/portfolio/", {"include_history": "true", "history_limit": 2})
+
+        history = response.data["results"][0]["history"]
+        self.assertEqual([h["date"] for h in history], ["2025-01-02", "2025-01-03"])
+
+    def test_update_reports_fresh_current_value(self):
+        holding = Portfolio.objects.filter(user=self.user).first()
+
+        response = self.client.patch(f"/api/portfolio/{holding.id}/", {"amount": "3"})
+
+        self.assertEqual(response.data["current_value"], 600.0)
+
+
+class SnapshotTestCase(TestCase):
+
+    def setUp(self):
+        user = CustomUser.objects.create_user(email="owner@example.com", password="pw")
+        coin = Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price="10.005")
+        unpriced = Coin.objects.create(coingecko_id="nothing", name="Nothing", symbol="NIL", price="0")
+        self.holdings = [Portfolio.objects.create(user=user, name="main", coin=coin, amount=i + 1) for i in range(5)]
+        Portfolio.objects.create(user=user, name="main", coin=unpriced, amount="1")
+
+    def test_snapshot_upserts_in_chunks(self):
+        day = date(2025, 1, 1)
+        PortfolioHistory.objects.create(portfolio=self.holdings[0], date=day, value_usd="1")
+
+        with CaptureQueriesContext(connection) as ctx:
+            stats = snapshot_portfolios(day, chunk_size=2)
+
+        self.assertEqual(stats["rows"], 5)
+        self.assertEqual(len([q for q in ctx.captured_queries if q["sql"].startswith("INSERT")]), 3)
+        self.assertEqual(PortfolioHistory.objects.filter(date=day).count(), 5)
+        self.assertEqual(PortfolioHistory.objects.get(portfolio=self.holdings[0], date=day).value_usd, Decimal("10.01"))
+
+    def test_snapshot_task_reports_throughput(self):
+        stats = record_portfolio_snapshots()
+
+        self.assertEqual(stats["rows"], 5)
+        self.assertIn("rows_per_sec", stats)
+
+
+
+class PortfolioAggregateTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="owner@example.com", password="pw")
+        self.btc = Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price="100")
+        self.eth = Coin.objects.create(coingecko_id="ethereum", name="Ethereum", symbol="ETH", price="10")
+
+    def aggregate(self, name=""):
+        return PortfolioAggregate.objects.get(user=self.user, name=name)
+
+    def assertConsistent(self):
+        self.assertEqual(diff_aggregates()[1], [])
+
+    def test_holding_writes_apply_deltas(self):
+        btc = Portfolio.objects.create(user=self.user, name="long", coin=self.btc, amount="2")
+        eth = Portfolio.objects.create(user=self.user, name="short", coin=self.eth, amount="5")
+        self.assertEqual(self.aggregate().total_value, Decimal("250"))
+        self.assertEqual(self.aggregate().top_holding_id, btc.id)
+        self.assertEqual(self.aggregate("long").asset_count, 1)
+
+        eth.amount = Decimal("50")
+        eth.name = "long"
+        eth.save()
+        self.assertEqual(self.aggregate().top_holding_id, eth.id)
+        self.assertEqual(self.aggregate("long").total_value, Decimal("700"))
+        self.assertEqual(self.aggregate("short").asset_count, 0)
+
+        eth.delete()
+        self.assertEqual(self.aggregate().total_value, Decimal("200"))
+        self.assertEqual(self.aggregate().top_holding_id, btc.id)
+        self.assertConsistent()
+
+    def test_price_changes_apply_delta_times_amount_held(self):
+        Portfolio.objects.create(user=self.user, name="long", coin=self.btc, amount="2")
+        eth = Portfolio.objects.create(user=self.user, name="long", coin=self.eth, amount="15")
+
+        Coin.objects.filter(id=self.eth.id).update(price="20")
+        apply_price_changes([PriceChange(self.eth.id, Decimal("10"), Decimal("20"))])
+
+        self.assertEqual(self.aggregate().total_value, Decimal("500"))
+        self.assertEqual(self.aggregate("long").top_holding_id, eth.id)
+        self.assertConsistent()
+
+    def test_top_holding_that_falls_is_reranked(self):
+        btc = Portfolio.objects.create(user=self.user, name="long", coin=self.btc, amount="1")
+        eth = Portfolio.objects.create(user=self.user, name="long", coin=self.eth, amount="5")
+        self.assertEqual(self.aggregate().top_holding_id, btc.id)
+
+        Coin.objects.filter(id=self.btc.id).update(price="20")
+        apply_price_changes([PriceChange(self.btc.id, Decimal("100"), Decimal("20"))])
+
+        self.assertEqual(self.aggregate().top_holding_id, eth.id)
+        self.assertConsistent()
+
+    def test_rising_prices_rerank_from_the_changed_coins_only(self):
+        Portfolio.objects.create(user=self.user, name="long", coin=self.btc, amount="1")
+        eth = Portfolio.objects.create(user=self.user, name="long", coin=self.eth, amount="5")
+
+        Coin.objects.filter(id=self.eth.id).update(price="30")
+        with patch("tracker.aggregates._top_holdings") as full_reload:
+            apply_price_changes([PriceChange(self.eth.id, Decimal("10"), Decimal("30"))])
+
+        full_reload.assert_not_called()
+        self.assertEqual(self.aggregate().top_holding_id, eth.id)
+        self.assertConsistent()
+
+    def test_stale_in_memory_coin_does_not_drift(self):
+        holding = Portfolio.objects.create(user=self.user, name="long", coin=self.btc, amount="1")
+        Coin.objects.filter(id=self.btc.id).update(price="300")
+        apply_price_changes([PriceChange(self.btc.id, Decimal("100"), Decimal("300"))])
+
+        holding.amount = Decimal("2")  # holding.coin still says 100
+        holding.save()
+
+        self.assertEqual(self.aggregate().total_value, Decimal("600"))
+        self.assertConsistent()
+
+    def test_holding_saved_between_price_write_and_publish_is_counted_once(self):
+        holding = Portfolio.objects.create(user=self.user, name="long", coin=self.btc, amount="1")
+
+        changes = apply_coin_prices({"bitcoin": Decimal("300")})
+        self.assertEqual(self.aggregate().total_value, Decimal("300"))
+
+        holding.amount = Decimal("2")
+        holding.save()
+        publish_price_changes(changes)
+
+        self.assertEqual(self.aggregate().total_value, Decimal("600"))
+        self.assertConsistent()
+
+    def test_saved_coin_price_moves_aggregates_and_publishes(self):
+        Portfolio.objects.create(user=self.user, name="long", coin=self.btc, amount="2")
+
+        with patch("tracker.signals.publish_price_changes") as publish, self.captureOnCommitCallbacks(execute=True):
+            self.btc.price = Decimal("150")
+            self.btc.save()
+            self.btc.save()  # unchanged, nothing to apply
+
+        publish.assert_called_once_with([PriceChange(self.btc.id, Decimal("100"), Decimal("150"))])
+        self.assertEqual(self.aggregate().total_value, Decimal("300"))
+        self.assertConsistent()
+
+    def test_backfill_migration_builds_missing_aggregates(self):
+        from django.apps import apps
+
+        backfill = import_module("tracker.migrations.0009_backfill_portfolio_aggregates").backfill_aggregates
+        Portfolio.objects.create(user=self.user, name="long", coin=self.btc, amount="2")
+        PortfolioAggregate.objects.all().delete()  # holdings from before aggregates existed
+
+        backfill(apps, None)
+
+        self.assertEqual(self.aggregate().total_value, Decimal("200"))
+        self.assertConsistent()
+
+    def test_empty_dashboard_has_the_same_shape(self):
+        self.client.force_authenticate(self.user)
+
+        response = self.client.get("/api/portfolio/dashboard/")
+
+        self.assertIn("updated_at", response.data)
+        self.assertIsNone(response.data["top_holding"])
+
+    def test_dashboard_is_a_single_lookup(self):
+        Portfolio.objects.create(user=self.user, name="long", coin=self.btc, amount="2")
+        self.client.force_authenticate(self.user)
+
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/portfolio/dashboard/")
+
+        self.assertEqual(response.data["total_value_usd"], 200.0)
+        self.assertEqual(response.data["top_holding"]["coin"], "Bitcoin")
+
+    def test_check_command_detects_and_fixes_drift(self):
+        Portfolio.objects.create(user=self.user, name="long", coin=self.btc, amount="2")
+        Coin.objects.filter(id=self.btc.id).update(price="300")  # bypasses the change feed
+
+        out = StringIO()
+        call_command("check_portfolio_aggregates", stdout=out)
+        self.assertIn("differ", out.getvalue())
+
+        call_command("check_portfolio_aggregates", "--fix", stdout=out)
+        self.assertEqual(self.aggregate().total_value, Decimal("600"))
+        self.assertConsistent()
+
+
+class AnalyticsTestCase(APITestCase):
+
+    def test_metrics_on_known_series(self):
+        values = np.array([100.0, 110.0, 99.0, 120.0])
+
+        returns = analytics.daily_returns(values)
+
+        np.testing.assert_allclose(returns, [0.1, -0.1, 120 / 99 - 1])
+        self.assertAlmostEqual(analytics.cumulative_return(values), 0.2)
+        self.assertAlmostEqual(analytics.max_drawdown(values), -0.1)
+        self.assertAlmostEqual(analytics.annualized_volatility(returns, periods=1), returns.std(ddof=1))
+        self.assertGreater(analytics.sharpe_ratio(returns), 0)
+
+    def test_rolling_windows_align_with_dates(self):
+        dates = np.arange("2025-01-01", "2025-01-06", dtype="datetime64[D]")
+        values = np.array([100.0, 110.0, 121.0, 133.1, 146.41])
+
+        rolling = analytics.rolling_metrics(dates, analytics.daily_returns(values), 2)
+
+        self.assertEqual(str(rolling["dates"][0]), "2025-01-03")
+        np.testing.assert_allclose(rolling["returns"], [0.21, 0.21, 0.21])
+
+    def test_performance_endpoint_metrics_parameters(self):
+        user = CustomUser.objects.create_user(email="owner@example.com", password="pw")
+        coin = Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price="150")
+        holding = Portfolio.objects.create(user=user, name="main", coin=coin, amount="1")
+        for day, value in enumerate([100, 120, 90, 130], start=1):
+            PortfolioHistory.objects.create(portfolio=holding, date=date(2025, 1, day), value_usd=value)
+        self.client.force_authenticate(user)
+
+        plain = self.client.get(f"/api/portfolio/{holding.id}/performance/")
+        self.assertNotIn("metrics", plain.data)
+        self.assertEqual(plain.data["initial_value"], 100.0)
+
+        response = self.client.get(f"/api/portfolio/{holding.id}/performance/", {"window": 2})
+        self.assertAlmostEqual(response.data["metrics"]["max_drawdown"], -0.25)
+        self.assertEqual(len(response.data["metrics"]["rolling"]["points"]), 2)
+
+        self.assertEqual(self.client.get(f"/api/portfolio/{holding.id}/performance/", {"window": "x"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/portfolio/performance/").data["metrics"]["observations"], 4)
+
+
+class DownsamplingTestCase(APITestCase):
+
+    def test_bucket_series_keeps_closing_value(self):
+        dates = np.arange("2025-01-01", "2025-03-01", dtype="datetime64[D]")
+        values = np.arange(len(dates), dtype=np.float64)
+
+        month_dates, month_values = downsampling.bucket_series(dates, values, "month")
+        week_dates, _ = downsampling.bucket_series(dates, values, "week")
+
+        self.assertEqual([str(d) for d in month_dates], ["2025-01-31", "2025-02-28"])
+        self.assertEqual(month_values.tolist(), [30.0, 58.0])
+        # 2025-01-05 is the first Sunday
+        self.assertEqual(str(week_dates[0]), "2025-01-05")
+
+    def test_lttb_keeps_endpoints_and_peaks(self):
+        dates = np.arange("2025-01-01", "2025-04-11", dtype="datetime64[D]")
+        values = np.zeros(len(dates))
+        values[50] = 100.0
+
+        kept_dates, kept_values = downsampling.lttb(dates, values, 10)
+
+        self.assertEqual(len(kept_dates), 10)
+        self.assertEqual((kept_dates[0], kept_dates[-1]), (dates[0], dates[-1]))
+        self.assertIn(100.0, kept_values)
+
+    def test_performance_history_is_downsampled_and_cached(self):
+        cache.clear()
+        user = CustomUser.objects.create_user(email="owner@example.com", password="pw")
+        coin = Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price="1")
+        holding = Portfolio.objects.create(user=user, name="main", coin=coin, amount="1")
+        PortfolioHistory.objects.bulk_create([
+            PortfolioHistory(portfolio=holding, date=date(2025, 1, 1) + timedelta(days=i), value_usd=i + 1)
+            for i in range(60)
+        ])
+        self.client.force_authenticate(user)
+        url = f"/api/portfolio/{holding.id}/performance/"
+
+        response = self.client.get(url, {"resolution": "week", "max_points": 5})
+        self.assertEqual(len(response.data["history"]), 5)
+
+        # holding + newest snapshot (cache hit) + first snapshot
+        with self.assertNumQueries(3):
+            self.client.get(url, {"resolution": "week", "max_points": 5})
+
+        self.assertEqual(self.client.get(url, {"resolution": "year"}).status_code, 400)
+
+        listed = self.client.get("/api/portfolio/", {"include_history": "true", "history_limit": 60, "max_points": 4})
+        self.assertEqual(len(listed.data["results"][0]["history"]), 4)
+
+
+class ExportTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="owner@example.com", password="pw")
+        other = CustomUser.objects.create_user(email="other@example.com", password="pw")
+        coin = Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price="2.5")
+        self.holding = Portfolio.objects.create(user=self.user, name="main", coin=coin, amount="4")
+        Portfolio.objects.create(user=other, name="main", coin=coin, amount="1")
+        PortfolioHistory.objects.bulk_create([
+            PortfolioHistory(portfolio=self.holding, date=date(2025, 1, 1) + timedelta(days=i), value_usd=i)
+            for i in range(3)
+        ])
+        self.client.force_authenticate(self.user)
+
+    def test_holdings_csv_streams_only_own_rows(self):
+        response = self.client.get("/api/export/holdings/")
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(",")[:7], ["id", "name", "symbol", "coin", "amount", "price", "value_usd"])
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(Decimal(lines[1].split(",")[6]), Decimal("10"))
+
+    def test_history_ndjson_with_date_range(self):
+        response = self.client.get("/api/export/history/", {"output": "ndjson", "start": "2025-01-02"})
+
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row["date"] for row in rows], ["2025-01-02", "2025-01-03"])
+        self.assertEqual(rows[0]["portfolio"], self.holding.id)
+
+        self.assertEqual(self.client.get("/api/export/history/", {"output": "xml"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/export/history/", {"start": "soon"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/export/history/", {"portfolio": "abc"}).status_code, 400)
+
+
+class KeysetPaginationTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        Coin.objects.bulk_create([
+            Coin(coingecko_id=f"coin-{i}", name=f"Coin {i % 10}", symbol=f"C{i}", price=i)
+            for i in range(45)
+        ])
+
+    def test_pages_walk_every_coin_once_by_seeking(self):
+        seen = []
+        url, params = "/api/coins/", {"page_size": 20, "with_total": "true"}
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url, params)
+            page = response.json()
+            self.assertEqual(page["total"], 45)
+            self.assertFalse(page["total_is_approximate"])
+            if params is None:
+                # later pages seek past the previous key (OFFSET only skips ties)
+                self.assertIn('"tracker_coin"."name" >', ctx.captured_queries[-1]["sql"])
+            params = None
+            seen += [coin["id"] for coin in page["results"]]
+            url = page["next"]
+
+        self.assertEqual(len(seen), 45)
+        self.assertEqual(len(set(seen)), 45)
+
+    def test_cursor_follows_requested_ordering(self):
+        page = self.client.get("/api/coins/", {"ordering": "-price", "page_size": 5}).json()
+        following = self.client.get(page["next"]).json()
+
+        prices = [Decimal(c["price"]) for c in page["results"] + following["results"]]
+        self.assertEqual(prices, sorted(prices, reverse=True))
+        self.assertEqual(prices[0], Decimal("44"))
+        self.assertNotIn("total", page)
+
+
+class CoinListCacheTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.coin = Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price="100")
+
+    def test_rendered_page_is_reused_until_prices_change(self):
+        first = self.client.get("/api/coins/")
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first["ETag"].startswith('"coins-'))
+        self.assertIn("Last-Modified", first)
+
+        with self.assertNumQueries(0):
+            again = self.client.get("/api/coins/")
+        self.assertEqual(again.content, first.content)
+
+        not_modified = self.client.get("/api/coins/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+
+        changes = apply_coin_prices({"bitcoin": Decimal("120")})
+        publish_price_changes(changes)
+
+        refreshed = self.client.get("/api/coins/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(refreshed.status_code, 200)
+        self.assertNotEqual(refreshed["ETag"], first["ETag"])
+        self.assertEqual(Decimal(refreshed.json()["results"][0]["price"]), Decimal("120"))
+
+    def test_query_string_gets_its_own_body(self):
+        Coin.objects.create(coingecko_id="ethereum", name="Ethereum", symbol="ETH", price="10")
+
+        by_name = self.client.get("/api/coins/").json()["results"]
+        by_price = self.client.get("/api/coins/", {"ordering": "price"}).json()["results"]
+
+        self.assertEqual([c["symbol"] for c in by_name], ["BTC", "ETH"])
+        self.assertEqual([c["symbol"] for c in by_price], ["ETH", "BTC"])
+
+    def test_version_bumped_by_another_process_retires_the_etag(self):
+        first = self.client.get("/api/coins/")
+
+        cache.incr(PRICE_VERSION_KEY)  # what a worker's refresh does to the shared cache
+
+        refreshed = self.client.get("/api/coins/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(refreshed.status_code, 200)
+        self.assertNotEqual(refreshed["ETag"], first["ETag"])
+
+    @override_settings(ALLOW_LOCAL_CACHE=False)
+    def test_per_process_cache_is_refused(self):
+        with self.assertRaises(ImproperlyConfigured):
+            price_version()
+
+
+class CoinSearchIndexTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        coin_index.clear()
+        self.btc = Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price="1")
+        self.wbtc = Coin.objects.create(coingecko_id="wrapped-bitcoin", name="Wrapped Bitcoin", symbol="WBTC", price="1")
+        self.bch = Coin.objects.create(coingecko_id="bitcoin-cash", name="Bitcoin Cash", symbol="BCH", price="1")
+
+    def test_ranks_exact_symbol_then_prefix_then_substring(self):
+        self.assertEqual(search_coins("btc"), [self.btc.id, self.wbtc.id])
+        self.assertEqual(search_coins("bitcoin"), [self.btc.id, self.bch.id, self.wbtc.id])
+        self.assertEqual(search_coins("b", limit=1), [self.btc.id])
+        # one typo away still matches fuzzily, but not for the list filter
+        self.assertIn(self.btc.id, search_coins("bitcoim"))
+        self.assertEqual(search_coins("bitcoim", fuzzy=False), [])
+
+    def test_new_coins_are_indexed_without_a_rebuild(self):
+        search_coins("eth")
+        with self.assertNumQueries(0):
+            self.assertEqual(search_coins("eth"), [])
+
+        provider = FakeProvider(universe=3)
+        with patch("tracker.utils.get_provider", return_value=provider):
+            populate_top_coins(3)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(len(search_coins("fake")), 3)
+
+    def test_search_endpoints_use_the_index(self):
+        self.assertEqual(
+            [c["symbol"] for c in self.client.get("/api/search-coin/", {"query": "btc"}).data],
+            ["BTC", "WBTC"],
+        )
+        listed = self.client.get("/api/coins/", {"search": "cash"}).json()["results"]
+        self.assertEqual([c["symbol"] for c in listed], ["BCH"])
+
+    def test_capped_search_says_so(self):
+        listed = self.client.get("/api/coins/", {"search": "bitcoin"}).json()
+        self.assertNotIn("search_truncated", listed)
+
+        with patch("tracker.search.FILTER_MATCH_LIMIT", 2):
+            listed = self.client.get("/api/coins/", {"search": "bitcoin", "page_size": 1}).json()
+        self.assertTrue(listed["search_truncated"])
+        self.assertEqual([c["symbol"] for c in listed["results"]], ["BTC"])
+
+
+class PriceStreamTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email="owner@example.com", password="pw")
+        self.coin = Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price="100")
+        Watchlist.objects.create(user=self.user, coin=self.coin)
+
+    async def test_slow_consumer_gets_one_coalesced_update(self):
+        feed = PriceBroadcaster(poll_interval=3600)
+        subscription = feed.subscribe([1, 2], user_id=7)
+        other = feed.subscribe([3])
+        feed._task.cancel()  # poll by hand instead
+        await feed.poll_once()
+
+        publish_feed([PriceChange(1, Decimal("10"), Decimal("11")), PriceChange(2, Decimal("5"), Decimal("6"))])
+        publish_feed([PriceChange(1, Decimal("11"), Decimal("12"))], [SimpleNamespace(
+            id=9, user_id=7, coin_id=1, target_price=Decimal("12"), message="hit",
+        )])
+        self.assertEqual(await feed.poll_once(), 1)
+
+        seq, prices, alerts = await subscription.next(timeout=1)
+        self.assertEqual(prices, {1: "12", 2: "6"})
+        self.assertEqual([alert["id"] for alert in alerts], [9])
+        with self.assertRaises(asyncio.TimeoutError):
+            await other.next(timeout=0.01)
+
+        feed.unsubscribe(subscription)
+        feed.unsubscribe(other)
+        self.assertEqual((feed.by_coin, feed.by_user), ({}, {}))
+
+    async def test_stream_sends_snapshot_then_watchlist_prices(self):
+        self.assertEqual((await self.async_client.get("/api/stream/prices/")).status_code, 401)
+
+        response = await self.async_client.get("/api/stream/prices/", {"token": str(AccessToken.for_user(self.user))})
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = response.streaming_content
+
+        snapshot = (await anext(events)).decode()
+        self.assertIn("event: snapshot", snapshot)
+        self.assertIn('"100', snapshot)
+
+        await broadcaster.poll_once()  # the poller's starting point, whichever runs first
+        publish_feed([PriceChange(self.coin.id, Decimal("100"), Decimal("120"))])
+        await broadcaster.poll_once()
+        update = (await anext(events)).decode()
+        self.assertIn("event: prices", update)
+        self.assertIn(f'"{self.coin.id}": "120"', update)
+
+        # a client disconnect cancels the pending read, which must unsubscribe
+        pending = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0.01)
+        pending.cancel()
+        await asyncio.gather(pending, return_exceptions=True)
+        self.assertEqual(broadcaster.subscriptions, set())
+
+    @override_settings(ALLOW_LOCAL_CACHE=False)
+    def test_per_process_cache_is_refused(self):
+        with self.assertRaises(ImproperlyConfigured):
+            publish_feed([PriceChange(self.coin.id, Decimal("100"), Decimal("120"))])
+        with self.assertRaises(ImproperlyConfigured):
+            self.client.get("/api/stream/prices/", {"token": str(AccessToken.for_user(self.user))})
+
+
+class ValuationKernelTestCase(APITestCase):
+
+    def test_values_totals_and_weights_are_exact(self):
+        amounts = valuation.to_units([Decimal("0.1"), Decimal("0.2"), Decimal("99999999999.99999999")])
+        prices = valuation.to_units([Decimal("0.3"), Decimal("99999999999.99999999")])
+
+        result = valuation.value_holdings(amounts, [0, 0, 1], prices, groups=[7, 7, 8])
+
+        self.assertEqual(valuation.as_decimals(result.total_units)[0], Decimal("0.09"))
+        # far past float precision, still exact
+        self.assertEqual(
+            valuation.as_decimals(result.units)[2],
+            Decimal("99999999999.99999999") * Decimal("99999999999.99999999"),
+        )
+        self.assertEqual(result.groups.tolist(), [7, 8])
+        self.assertAlmostEqual(result.weights[0], 1 / 3)
+        self.assertEqual(result.weights[2], 1.0)
+
+    def test_cents_round_half_up(self):
+        units = valuation.value_one(Decimal("1"), Decimal("10.005")).units
+        self.assertEqual(valuation.as_cents(units), [Decimal("10.01")])
+        self.assertEqual(valuation.as_cents(-units), [Decimal("-10.01")])
+
+    def test_insight_uses_kernel_weights(self):
+        user = CustomUser.objects.create_user(email="owner@example.com", password="pw")
+        btc = Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price="300")
+        eth = Coin.objects.create(coingecko_id="ethereum", name="Ethereum", symbol="ETH", price="100")
+        Portfolio.objects.create(user=user, name="main", coin=btc, amount="1")
+        Portfolio.objects.create(user=user, name="main", coin=eth, amount="1")
+        self.client.force_authenticate(user)
+        price_table.current()
+
+        with self.assertNumQueries(1):
+            data = self.client.get("/api/insight/").data
+
+        self.assertEqual(data["total_value_usd"], 400.0)
+        self.assertEqual(data["top_holding"]["coin"], "Bitcoin")
+        self.assertEqual([h["percentage"] for h in data["holdings"]], [75.0, 25.0])
+
+
+class PriceTableTestCase(TestCase):
+
+    def setUp(self):
+        price_table.clear()
+        self.btc = Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price="100.5")
+
+    def test_loads_once_per_price_version(self):
+        with self.assertNumQueries(1):
+            current_prices([self.btc.id])
+        with self.assertNumQueries(0):
+            snapshot = current_prices([self.btc.id])
+
+        self.assertEqual(snapshot.price(self.btc.id), Decimal("100.5"))
+        self.assertIsNone(snapshot.price(self.btc.id + 1))
+
+        self.btc.price = Decimal("200")
+        self.btc.save()  # bumps the price version
+        self.assertEqual(current_prices().price(self.btc.id), Decimal("200"))
+
+    def test_reloads_when_another_process_bumps_the_version(self):
+        current_prices()
+        Coin.objects.filter(id=self.btc.id).update(price="200")
+
+        cache.incr(PRICE_VERSION_KEY)  # a worker's refresh, seen through the shared cache
+
+        self.assertEqual(current_prices().price(self.btc.id), Decimal("200"))
+
+    def test_reloads_for_coins_created_without_a_version_bump(self):
+        current_prices()
+        eth, = Coin.objects.bulk_create([Coin(coingecko_id="ethereum", name="Ethereum", symbol="ETH", price="10")])
+
+        snapshot = current_prices([eth.id])
+
+        self.assertEqual(snapshot.units_of([self.btc.id, eth.id, eth.id + 1]).tolist(), [100_5000_0000, 10_0000_0000, 0])
+
+    def test_request_keeps_the_snapshot_it_first_read(self):
+        def view(request):
+            before = current_prices().price(self.btc.id)
+            Coin.objects.filter(id=self.btc.id).update(price="300")
+            invalidate_prices()
+            return before, current_prices().price(self.btc.id)
+
+        self.assertEqual(PriceSnapshotMiddleware(view)(None), (Decimal("100.5"), Decimal("100.5")))
+        self.assertEqual(current_prices().price(self.btc.id), Decimal("300"))
+
+
+class BenchmarkBudgetTestCase(TestCase):
+
+    def test_every_route_is_benchmarked(self):
+        from django.urls import get_resolver
+
+        named = {
+            pattern.name
+            for module in ("tracker.urls", "alerts.urls", "accounts.urls")
+            for pattern in get_resolver(module).url_patterns
+        }
+        self.assertEqual(named, {route.name for route in benchmarks.ROUTES})
+        self.assertTrue(named <= set(benchmarks.BUDGETS))
+
+    def test_query_and_throughput_budgets_hold_across_scales(self):
+        results = []
+        for scale in (3, 30):
+            results += benchmarks.run_endpoints(scale, repeat=2)
+            results += benchmarks.run_tasks(scale)
+
+        self.assertEqual(benchmarks.check_budgets(results, latency=False), [])
+        summary = [r for r in results if r.name == "portfolio-summary"]
+        self.assertTrue(all(r.queries <= 3 for r in summary))
+
+
+def server_timing(response):
+    """{metric: (description, duration ms)} of a Server-Timing header."""
+    timings = {}
+    for entry in response["Server-Timing"].split(", "):
+        name, *params = entry.split(";")
+        params = dict(param.split("=", 1) for param in params)
+        timings[name] = (params.get("desc", "").strip('"'), float(params["dur"]))
+    return timings
+
+
+class MetricsTestCase(APITestCase):
+
+    def setUp(self):
+        metrics.registry.flush()  # earlier tests' increments go out before the wipe
+        cache.clear()
+        coin_index.clear()
+        self.coin = Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price=Decimal("100"))
+
+    def test_server_timing_counts_sql_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(f"/api/coins/{self.coin.id}/")
+
+        timings = server_timing(response)
+        self.assertEqual(timings["db"][0], f"{len(ctx.captured_queries)} queries")
+        self.assertEqual(timings["provider"][0], "0 calls")
+        self.assertGreaterEqual(timings["total"][1], timings["db"][1])
+
+    def test_provider_calls_are_counted_across_fetch_threads(self):
+        provider = FakeProvider(universe=10)
+        provider.search = lambda query: [f"fake-{i}" for i in range(5)]
+
+        with patch("tracker.views.get_provider", return_value=InstrumentedProvider(provider)):
+            response = self.client.get("/api/search-coin/", {"query": "fake"})
+
+        self.assertEqual(len(response.data), 5)
+        # one search, then the details of every hit from the fetch pool
+        self.assertEqual(server_timing(response)["provider"][0], "6 calls")
+
+    @override_settings(METRICS_TOKEN="s3cret")
+    def test_metrics_endpoint_renders_routes_and_tasks(self):
+        self.client.get(f"/api/coins/{self.coin.id}/")
+        metrics.observe_task("tracker.utils.update_coin_prices", 0.3)
+        metrics.add_task_rows("tracker.utils.update_coin_prices", 42)
+
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer s3cret")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], metrics.CONTENT_TYPE)
+        body = response.content.decode()
+        self.assertIn('http_request_duration_seconds_count{route="coin-detail",method="GET",status="200"}', body)
+        self.assertIn('http_request_sql_queries_bucket{route="coin-detail",le="+Inf"}', body)
+        self.assertIn('celery_task_duration_seconds_bucket{task="tracker.utils.update_coin_prices",le="0.1"} 0', body)
+        self.assertIn('celery_task_duration_seconds_bucket{task="tracker.utils.update_coin_prices",le="0.5"} 1', body)
+        self.assertIn('celery_task_rows_processed_total{task="tracker.utils.update_coin_prices"} 42', body)
+
+    def test_snapshot_task_counts_rows(self):
+        user = CustomUser.objects.create_user(email="m@example.com", name="M", password="pw")
+        Portfolio.objects.create(user=user, name="main", coin=self.coin, amount=Decimal("2"))
+
+        record_portfolio_snapshots()
+
+        self.assertIn(
+            'celery_task_rows_processed_total{task="tracker.utils.record_portfolio_snapshots"} 1',
+            metrics.render(),
+        )
+
+    @override_settings(METRICS_TOKEN="s3cret")
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer s3cret").status_code, 200)
+
+    def test_metrics_without_token_only_in_debug(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get("/metrics").status_code, 200)
+
+    @override_settings(METRICS_TOKEN="s3cret")
+    def test_metrics_add_up_across_processes(self):
+        self.client.get(f"/api/coins/{self.coin.id}/")
+        metrics.registry.flush()
+        # another web process or worker flushing the same series
+        other = metrics.Registry()
+        other.register(metrics.Counter(metrics.provider_calls.name, "", ["method", "outcome"])).inc(
+            3, method="search", outcome="ok",
+        )
+        other.register(metrics.Histogram(metrics.request_duration.name, "", ["route", "method", "status"])).observe(
+            0.001, route="coin-detail", method="GET", status=200,
+        )
+        other.flush()
+
+        body = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer s3cret").content.decode()
+
+        self.assertIn('price_provider_calls_total{method="search",outcome="ok"} 3', body)
+        self.assertIn('http_request_duration_seconds_count{route="coin-detail",method="GET",status="200"} 2', body)
+
+    @override_settings(ALLOW_LOCAL_CACHE=False)
+    def test_metrics_need_a_shared_cache(self):
+        metrics.add_task_rows("tracker.utils.update_coin_prices", 1)
+        with self.assertRaises(ImproperlyConfigured):
+            metrics.render()
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RateLimiterTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.clock = FakeClock()
+
+    def limiter(self, bucket, **classes):
+        return RateLimiter(bucket, classes=classes, sleep=self.clock.sleep)
+
+    def test_interactive_calls_leave_the_reserve_to_the_refresh(self):
+        limiter = self.limiter(LocalBucket(rate=1, burst=5, clock=self.clock), **{INTERACTIVE: PriorityClass(0.2, 0)})
+
+        for _ in range(4):
+            self.assertEqual(limiter.acquire(INTERACTIVE), 0)
+        with self.assertRaises(RateLimited):
+            limiter.acquire(INTERACTIVE)  # shed: the last token is reserved
+
+        self.assertEqual(limiter.acquire(REFRESH), 0)
+        self.assertEqual(limiter.acquire(REFRESH), 1.0)  # queued until the next token
+        self.assertEqual(self.clock.now, 1001.0)
+
+    def test_upstream_429_pauses_every_worker(self):
+        # two workers sharing one budget through the cache
+        first = RateLimitedProvider(
+            FakeProvider(universe=10, rate_limit_every=1, retry_after=30),
+            self.limiter(CacheBucket(rate=1, burst=5, clock=self.clock)),
+        )
+        inner = FakeProvider(universe=10)
+        second = RateLimitedProvider(inner, self.limiter(CacheBucket(rate=1, burst=5, clock=self.clock)))
+
+        with self.assertRaises(RateLimited):
+            first.coin_detail("fake-1")
+        with self.assertRaises(RateLimited) as shed:
+            second.coin_detail("fake-1")  # 30s pause > the interactive max_wait
+
+        self.assertEqual(inner.calls, 0)
+        self.assertEqual(shed.exception.retry_after, 30)
+        second.limiter.acquire(REFRESH)  # the refresh queues through the pause
+        self.assertEqual(self.clock.now, 1031.0)
+
+    @override_settings(PRICE_PROVIDER={
+        "BACKEND": "tracker.providers.FakeProvider",
+        "RATE_LIMIT": {"BACKEND": "tracker.ratelimit.LocalBucket", "RATE": 100, "BURST": 10},
+    })
+    def test_refresh_task_calls_under_refresh_priority(self):
+        Coin.objects.create(coingecko_id="fake-1", name="Fake", symbol="FK1", price=Decimal("1"))
+        self.assertIsInstance(get_provider(), RateLimitedProvider)
+        before = budget_outcomes.values[(REFRESH, "immediate")]
+
+        update_coin_prices()
+
+        self.assertEqual(budget_outcomes.values[(REFRESH, "immediate")], before + 1)
+
+    def test_shed_search_answers_429(self):
+        bucket = LocalBucket(rate=0.01, burst=1, clock=self.clock)
+        bucket.pause(120)
+        provider = RateLimitedProvider(FakeProvider(universe=10), self.limiter(bucket))
+
+        with patch("tracker.views.get_provider", return_value=provider):
+            response = self.client.get("/api/search-coin/", {"query": "fake-1"})
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "120")
+
+    def test_shed_coin_lookup_answers_429_not_404(self):
+        bucket = LocalBucket(rate=0.01, burst=1, clock=self.clock)
+        bucket.pause(120)
+        provider = RateLimitedProvider(FakeProvider(universe=10), self.limiter(bucket))
+
+        with patch("tracker.utils.get_provider", return_value=provider):
+            response = self.client.get("/api/coins/search/fake-1/")
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "120")
+
+    def test_stuck_bucket_lock_is_shed_at_the_callers_deadline(self):
+        bucket = CacheBucket(rate=1, burst=5, clock=self.clock)
+        limiter = RateLimiter(bucket, classes={INTERACTIVE: PriorityClass(0.2, 0.05)})
+        cache.add(f"{bucket.key}:lock", 1, timeout=60)  # a holder that never lets go
+
+        started = time.monotonic()
+        with self.assertRaises(RateLimited):
+            limiter.acquire(INTERACTIVE)
+
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    @override_settings(ALLOW_LOCAL_CACHE=False)
+    def test_cache_bucket_refuses_a_per_process_cache(self):
+        with self.assertRaises(ImproperlyConfigured):
+            CacheBucket(rate=1, burst=5, clock=self.clock).take(0)
+
+
+class RefreshTierTestCase(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="t@example.com", name="T", password="pw")
+        self.held, self.watched, self.ignored = (
+            Coin.objects.create(coingecko_id=f"fake-{i}", name=f"Fake {i}", symbol=f"FK{i}", price=Decimal("1"))
+            for i in range(3)
+        )
+        Portfolio.objects.create(user=self.user, name="main", coin=self.held, amount=Decimal("1"))
+        Watchlist.objects.create(user=self.user, coin=self.held)
+        Watchlist.objects.create(user=self.user, coin=self.watched)
+        Alert.objects.create(user=self.user, coin=self.ignored, target_price=Decimal("2"), triggered=True)
+
+    def tiers(self):
+        return dict(Coin.objects.values_list("coingecko_id", "refresh_tier"))
+
+    @patch("tracker.tiers.HOT_LIMIT", 1)
+    @patch("tracker.tiers.WARM_LIMIT", 1)
+    def test_coins_are_ranked_into_tiers_by_demand(self):
+        self.assertEqual(tiers.coin_demand(), {self.held.id: 2, self.watched.id: 1})
+
+        moved = recompute_refresh_tiers()
+
+        self.assertEqual(moved, {"hot": 1, "warm": 1, "cold": 0})
+        self.assertEqual(self.tiers(), {"fake-0": "hot", "fake-1": "warm", "fake-2": "cold"})
+
+        Watchlist.objects.filter(coin=self.watched).delete()
+        recompute_refresh_tiers()
+        self.assertEqual(self.tiers()["fake-1"], "cold")
+
+    @patch("tracker.utils.get_coin_prices")
+    def test_refresh_only_touches_its_tier(self, mock_get):
+        mock_get.side_effect = lambda ids: {i: Decimal("5") for i in ids}
+        recompute_refresh_tiers()
+
+        changes = update_coin_prices(tier="hot")
+
+        mock_get.assert_called_once_with(["fake-0", "fake-1"])
+        self.assertEqual({c.coin_id for c in changes}, {self.held.id, self.watched.id})
+        refreshed = dict(Coin.objects.values_list("coingecko_id", "refreshed_at"))
+        self.assertIsNotNone(refreshed["fake-0"])
+        self.assertIsNone(refreshed["fake-2"])
+
+
+class LeaseTestCase(TestCase):
+
+    def test_one_holder_at_a_time(self):
+        for leases in (DatabaseLeases(), LocalLeases()):
+            with self.subTest(backend=type(leases).__name__):
+                self.assertEqual(leases.acquire("job", "a", 60).holder, "a")
+                self.assertEqual(leases.acquire("job", "b", 60).holder, "a")
+                renewed = leases.acquire("job", "a", 120)
+                self.assertEqual(renewed.holder, "a")
+                self.assertGreater(renewed.expires_at, now() + timedelta(seconds=60))
+
+                leases.release("job", "b")  # not the holder: no effect
+                self.assertEqual(leases.current("job").holder, "a")
+                leases.release("job", "a")
+                self.assertIsNone(leases.current("job"))
+
+                leases.acquire("job", "crashed", 0)  # expired right away
+                self.assertEqual(leases.acquire("job", "b", 60).holder, "b")
+                leases.release("job", "b")
+
+
+class RefreshJobTestCase(APITestCase):
+
+    def setUp(self):
+        self.admin = CustomUser.objects.create_superuser(email="admin@example.com", name="Admin", password="pw")
+        self.client.force_authenticate(self.admin)
+        Coin.objects.create(coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price=Decimal("1"))
+
+    @patch("tracker.utils.get_coin_prices")
+    def test_refresh_skips_while_another_job_holds_the_lease(self, mock_get):
+        mock_get.return_value = {"bitcoin": Decimal("2")}
+        get_leases().acquire("price-refresh:cold", "other-job", 60)
+
+        self.assertEqual(update_coin_prices(), [])
+        mock_get.assert_not_called()
+        # the hot and warm leases it took are given back
+        self.assertEqual([lease.holder for lease in get_leases().held(refresh_leases())], ["other-job"])
+
+        get_leases().release("price-refresh:cold", "other-job")
+        self.assertEqual(len(update_coin_prices()), 1)
+        self.assertEqual(get_leases().held(refresh_leases()), [])  # released after the run
+
+    @patch("tracker.utils.get_coin_prices")
+    def test_tiers_refresh_independently(self, mock_get):
+        mock_get.return_value = {"bitcoin": Decimal("2")}
+        get_leases().acquire("price-refresh:hot", "hot-job", 60)
+
+        self.assertEqual(len(update_coin_prices(tier="cold")), 1)
+        self.assertEqual(update_coin_prices(tier="hot"), [])
+        self.assertEqual(update_coin_prices(), [])  # a full refresh needs every tier
+
+    @patch("tracker.views.update_coin_prices.apply_async")
+    def test_admin_refresh_is_queued_once(self, mock_apply):
+        response = self.client.post("/api/coins/update-prices/")
+
+        self.assertEqual(response.status_code, 202)
+        job_id = response.data["job_id"]
+        mock_apply.assert_called_once_with(task_id=job_id)
+        self.assertTrue(response.data["status_url"].endswith(f"/api/coins/update-prices/{job_id}/"))
+
+        again = self.client.post("/api/coins/update-prices/")
+        self.assertEqual(again.status_code, 409)
+        self.assertEqual(again.data["job_id"], job_id)
+        self.assertEqual(mock_apply.call_count, 1)
+
+        status = self.client.get(f"/api/coins/update-prices/{job_id}/")
+        self.assertEqual(status.data["state"], "PENDING")
+        self.assertTrue(status.data["in_progress"])
+        self.assertEqual(self.client.get("/api/coins/update-prices/").data["job_id"], job_id)
+
+    def test_job_status_reports_the_result(self):
+        done = SimpleNamespace(state="SUCCESS", result=[[1, "1", "2"], [2, "3", "4"]])
+        with patch("tracker.views.AsyncResult", return_value=done):
+            response = self.client.get("/api/coins/update-prices/some-job/")
+
+        self.assertEqual(response.data, {"job_id": "some-job", "state": "SUCCESS", "in_progress": False, "changed": 2})
+
+    def test_refresh_with_no_coins_releases_the_lease(self):
+        Coin.objects.all().delete()
+
+        with benchmarks.eager_tasks():
+            responses = [self.client.post("/api/coins/update-prices/") for _ in range(2)]
+
+        self.assertEqual([r.status_code for r in responses], [202, 202])
+        self.assertEqual(get_leases().held(refresh_leases()), [])
+
+    @patch("tracker.views.update_coin_prices.apply_async", side_effect=OperationalError("broker down"))
+    def test_broker_failure_releases_the_lease(self, mock_apply):
+        response = self.client.post("/api/coins/update-prices/")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(get_leases().held(refresh_leases()), [])
+
+
+
+class StaleWhileRevalidateTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.btc = Coin.objects.create(
+            coingecko_id="bitcoin", name="Bitcoin", symbol="BTC", price=Decimal("100"), refreshed_at=now(),
+        )
+
+    @patch("tracker.utils.refresh_coin_price.delay")
+    def test_fresh_coin_is_served_without_a_refresh(self, mock_delay):
+        response = self.client.get("/api/coins/search/bitcoin/")
+
+        self.assertEqual(response.data["price"], "100.00000000")
+        self.assertEqual(response.data["staleness"], 0)
+        self.assertFalse(response.data["stale"])
+        mock_delay.assert_not_called()
+
+    @patch("tracker.utils.refresh_coin_price.delay")
+    def test_stale_coin_is_served_and_refreshed_once(self, mock_delay):
+        Coin.objects.filter(id=self.btc.id).update(refreshed_at=now() - timedelta(hours=1))
+
+        with patch("tracker.utils.get_provider") as mock_provider:
+            responses = [self.client.get("/api/coins/search/bitcoin/") for _ in range(3)]
+            mock_provider.assert_not_called()
+
+        self.assertEqual(responses[0].data["price"], "100.00000000")
+        self.assertTrue(all(r.data["stale"] for r in responses))
+        self.assertGreaterEqual(responses[0].data["staleness"], 3600)
+        mock_delay.assert_called_once_with(self.btc.id)
+
+    @patch("tracker.utils.get_coin_prices")
+    def test_background_refresh_stamps_and_publishes(self, mock_get):
+        mock_get.return_value = {"bitcoin": Decimal("120")}
+
+        changes = refresh_coin_price(self.btc.id)
+
+        self.assertEqual(changes, [PriceChange(self.btc.id, Decimal("100"), Decimal("120"))])
+        self.btc.refresh_from_db()
+        self.assertEqual(self.btc.price, Decimal("120"))
+        self.assertIsNotNone(self.btc.refreshed_at)
+
+    def test_background_refresh_stamps_when_the_price_arrived(self):
+        arrived = []
+
+        def slow_prices(ids):
+            time.sleep(0.01)  # waiting for budget
+            arrived.append(now())
+            return {"bitcoin": Decimal("120")}
+
+        with patch("tracker.utils.get_coin_prices", side_effect=slow_prices):
+            refresh_coin_price(self.btc.id)
+
+        self.btc.refresh_from_db()
+        self.assertGreaterEqual(self.btc.refreshed_at, arrived[0])
+        self.assertGreaterEqual(PriceTick.objects.get(coin=self.btc).timestamp, arrived[0])
+
+    @patch("tracker.utils.refresh_coin_price.delay", side_effect=OperationalError("broker down"))
+    def test_failed_enqueue_is_retried_by_the_next_lookup(self, mock_delay):
+        Coin.objects.filter(id=self.btc.id).update(refreshed_at=None)
+
+        for _ in range(2):
+            response = self.client.get("/api/coins/search/bitcoin/")
+            self.assertIsNone(response.data["staleness"])
+
+        self.assertEqual(mock_delay.call_count, 2)
@@ -0,0 +1,149 @@
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils.timezone import now
+
+from .models import PriceTick, PriceCandle
+
+
+# Bucket width of each rollup resolution, finest first.
+RESOLUTIONS = {
+    "1m": timedelta(minutes=1),
+    "1h": timedelta(hours=1),
+    "1d": timedelta(days=1),
+}
+
+# Each resolution is rolled up from the next finer one (None → raw ticks).
+ROLLUP_SOURCE = {"1m": None, "1h": "1m", "1d": "1h"}
+
+# How long rows are kept per resolution; None keeps them forever.
+DEFAULT_RETENTION = {
+    "tick": timedelta(days=2),
+    "1m": timedelta(days=7),
+    "1h": timedelta(days=180),
+    "1d": None,
+}
+
+ROLLUP_BATCH_SIZE = 1000
+
+
+def get_retention():
+    return {**DEFAULT_RETENTION, **getattr(settings, "PRICE_HISTORY_RETENTION", {})}
+
+
+def floor_bucket(ts, width):
+    """Start of the `width`-sized bucket (aligned to the epoch, UTC) containing `ts`."""
+    seconds = int(width.total_seconds())
+    return datetime.fromtimestamp(int(ts.timestamp()) // seconds * seconds, tz=timezone.utc)
+
+
+def record_ticks(coin_prices, timestamp=None):
+    """Append one PriceTick per (coin_id, price) pair."""
+    timestamp = timestamp or now()
+    PriceTick.objects.bulk_create(
+        [PriceTick(coin_id=coin_id, timestamp=timestamp, price=price) for coin_id, price in coin_prices],
+        batch_size=ROLLUP_BATCH_SIZE,
+    )
+
+
+def _source_rows(source, since):
+    """Yield (coin_id, ts, open, high, low, close) ordered by coin then time."""
+    if source is None:
+        rows = PriceTick.objects.order_by("coin_id", "timestamp").values_list("coin_id", "timestamp", "price")
+        if since is not None:
+            rows = rows.filter(timestamp__gte=since)
+        for coin_id, ts, price in rows.iterator(chunk_size=ROLLUP_BATCH_SIZE):
+            yield coin_id, ts, price, price, price, price
+        return
+
+    rows = (
+        PriceCandle.objects.filter(resolution=source)
+        .order_by("coin_id", "bucket")
+        .values_list("coin_id", "bucket", "open", "high", "low", "close")
+    )
+    if since is not None:
+        rows = rows.filter(bucket__gte=since)
+    yield from rows.iterator(chunk_size=ROLLUP_BATCH_SIZE)
+
+
+def rollup(resolution):
+    """
+    (Re)build `resolution` candles from the finer source data, starting at
+    the newest existing bucket so the still-open bucket is recomputed.
+    Returns the number of candles written.
+    """
+    width = RESOLUTIONS[resolution]
+    since = PriceCandle.objects.filter(resolution=resolution).aggregate(latest=Max("bucket"))["latest"]
+
+    buckets = {}
+    for coin_id, ts, o, h, l, c in _source_rows(ROLLUP_SOURCE[resolution], since):
+        key = (coin_id, floor_bucket(ts, width))
+        candle = buckets.get(key)
+        if candle is None:
+            buckets[key] = [o, h, l, c]
+        else:
+            candle[1] = max(candle[1], h)
+            candle[2] = min(candle[2], l)
+            candle[3] = c
+
+    PriceCandle.objects.bulk_create(
+        [
+            PriceCandle(coin_id=coin_id, resolution=resolution, bucket=bucket, open=o, high=h, low=l, close=c)
+            for (coin_id, bucket), (o, h, l, c) in buckets.items()
+        ],
+        batch_size=ROLLUP_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=["coin", "resolution", "bucket"],
+        update_fields=["open", "high", "low", "close"],
+    )
+    return len(buckets)
+
+
+def prune(at=None):
+    """Delete ticks and candles older than their retention. Returns rows deleted."""
+    at = at or now()
+    retention = get_retention()
+    deleted = 0
+
+    if retention["tick"] is not None:
+        deleted += PriceTick.objects.filter(timestamp__lt=at - retention["tick"]).delete()[0]
+
+    for resolution in RESOLUTIONS:
+        if retention[resolution] is not None:
+            deleted += PriceCandle.objects.filter(
+                resolution=resolution, bucket__lt=at - retention[resolution]
+            ).delete()[0]
+
+    return deleted
+
+
+def pick_resolution(start, end, max_points, at=None):
+    """
+    Choose the resolution to read [start, end) from: the finest one that is
+    still retained back to `start` and fits the range into `max_points`
+    buckets, stepping to coarser buckets only when needed.
+    """
+    at = at or now()
+    retention = get_retention()
+    span = end - start
+
+    for resolution, width in RESOLUTIONS.items():
+        kept = retention[resolution]
+        if kept is not None and start < at - kept:
+            continue
+        if span / width <= max_points:
+            return resolution
+    return "1d"
+
+
+def price_series(coin, start, end=None, max_points=500):
+    """Return (resolution, candles) covering [start, end) for `coin`."""
+    end = end or now()
+    resolution = pick_resolution(start, end, max_points)
+    candles = (
+        PriceCandle.objects.filter(coin=coin, resolution=resolution, bucket__gte=floor_bucket(start, RESOLUTIONS[resolution]), bucket__lt=end)
+        .order_by("bucket")
+        .values("bucket", "open", "high", "low", "close")
+    )
+    return resolution, list(candles)
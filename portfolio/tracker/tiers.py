@@ -0,0 +1,49 @@
+"""
+Demand-tiered price refresh.
+
+A coin's demand is the number of holdings, watchlist entries and
+untriggered alerts on it. recompute_tiers() ranks coins by demand: the
+HOT_LIMIT most demanded coins are hot, the next WARM_LIMIT warm, and
+everything else (including coins nobody follows) cold. CELERY_BEAT_SCHEDULE
+runs update_coin_prices once per tier at that tier's REFRESH_INTERVALS, so
+the API budget goes where the reads are.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count
+
+from alerts.models import Alert
+from .models import Coin, Portfolio, Watchlist
+
+
+HOT, WARM, COLD = "hot", "warm", "cold"
+REFRESH_INTERVALS = {HOT: 60, WARM: 10 * 60, COLD: 60 * 60}  # seconds, as scheduled in CELERY_BEAT_SCHEDULE
+HOT_LIMIT = 250  # one simple/price call a minute
+WARM_LIMIT = 2500  # ten calls every 10 minutes
+
+
+def coin_demand():
+    """Counter of {coin id: holdings + watchlist entries + untriggered alerts}."""
+    demand = Counter()
+    for queryset in (Portfolio.objects.all(), Watchlist.objects.all(), Alert.objects.filter(triggered=False)):
+        demand.update(dict(queryset.values("coin_id").annotate(n=Count("id")).values_list("coin_id", "n")))
+    return demand
+
+
+def rank_tiers(demand):
+    """(hot ids, warm ids) of a demand Counter; ties go to the older coin."""
+    ranked = sorted((coin_id for coin_id, n in demand.items() if n > 0), key=lambda coin_id: (-demand[coin_id], coin_id))
+    return ranked[:HOT_LIMIT], ranked[HOT_LIMIT:HOT_LIMIT + WARM_LIMIT]
+
+
+def recompute_tiers():
+    """Move every coin to the tier of its current demand; returns {tier: coins moved into it}."""
+    hot, warm = rank_tiers(coin_demand())
+    with transaction.atomic():
+        moved = {
+            HOT: Coin.objects.filter(id__in=hot).exclude(refresh_tier=HOT).update(refresh_tier=HOT),
+            WARM: Coin.objects.filter(id__in=warm).exclude(refresh_tier=WARM).update(refresh_tier=WARM),
+            COLD: Coin.objects.exclude(id__in=hot + warm).exclude(refresh_tier=COLD).update(refresh_tier=COLD),
+        }
+    return moved
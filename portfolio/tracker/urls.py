@@ -3,40 +3,57 @@ from .views import (
     CoinListView,
     CoinDetailView,
     refresh_coin_prices,
+    refresh_job_status,
     get_coin,
+    coin_price_history,
     search_coin,
     
     PortfolioListCreateView,
     PortfolioDetailView,
     portfolio_summary,
+    portfolio_dashboard,
     portfolio_performance,
+    combined_performance,
     record_portfolio_snapshots,
     PortfolioInsightView,
     
     WatchlistListCreateView,
     WatchlistDetailView,
+    
+    export_holdings,
+    export_history,
+    stream_prices,
 )
 
 urlpatterns = [
     path('coins/', CoinListView.as_view(), name='coin-list-create'),
     path('coins/<int:pk>/', CoinDetailView.as_view(), name='coin-detail'),
     path('coins/update-prices/', refresh_coin_prices, name='refresh-prices'),
+    path('coins/update-prices/<str:job_id>/', refresh_job_status, name='refresh-job'),
     path('coins/search/<str:coin_id>/', get_coin, name='get-coin'),
+    path('coins/<int:pk>/history/', coin_price_history, name='coin-price-history'),
     path("search-coin/", search_coin, name="search-coin"),
     
     path("portfolio/", PortfolioListCreateView.as_view(), name="portfolio-list-create"),
     path("portfolio/<int:pk>/", PortfolioDetailView.as_view(), name="portfolio-detail"),
     path("portfolio/summary/", portfolio_summary, name="portfolio-summary"),
+    path("portfolio/dashboard/", portfolio_dashboard, name="portfolio-dashboard"),
     
     
     
     path("portfolio/<int:portfolio_id>/performance/", portfolio_performance, name="portfolio-performance"),
+    path("portfolio/performance/", combined_performance, name="combined-performance"),
     path("snapshot/", record_portfolio_snapshots, name="portfolio-snapshot"),
     
     path("insight/", PortfolioInsightView.as_view(), name="insight"),
     
     path("watchlist/", WatchlistListCreateView.as_view(), name="watchlist-list"),
     path("watchlist/<int:pk>/", WatchlistDetailView.as_view(), name="watchlist-detail"),
+    
+    path("export/holdings/", export_holdings, name="export-holdings"),
+    path("export/history/", export_history, name="export-history"),
+    
+    path("stream/prices/", stream_prices, name="stream-prices"),
 
 ]
 
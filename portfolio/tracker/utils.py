@@ -1,54 +1,149 @@
-import requests
-from decimal import Decimal
+from collections import namedtuple
+from uuid import uuid4
+from django.core.cache import cache
+from django.db import transaction
+from kombu.exceptions import OperationalError
 from .models import Coin
 from django.utils.timezone import now
-from .models import Portfolio, PortfolioHistory
+from .snapshots import snapshot_portfolios
+from .ticks import record_ticks, rollup, prune, RESOLUTIONS
 from celery import shared_task
-from requests.exceptions import HTTPError, ConnectionError, Timeout
+from alerts.engine import evaluate_price_changes
+from .aggregates import apply_price_changes
+from .cache import invalidate_prices
+from .search import index_coins
+from .streaming import publish_feed
+from .metrics import add_task_rows
+from .ratelimit import priority, REFRESH, BACKGROUND
+from .tiers import recompute_tiers, HOT, WARM, COLD
+from .leases import get_leases
+from .providers import get_provider, ProviderError, ProviderUnavailable, RateLimited
 
 
 
+PRICE_CHUNK_SIZE = 250  # ids per simple/price call, keeps the URL well under 8k chars
+REFRESH_LEASE = "price-refresh"  # one lease per tier, f"{REFRESH_LEASE}:{tier}"
+REFRESH_LEASE_TTL = 5 * 60  # seconds; renewed after every chunk
+COIN_FRESH_FOR = 5 * 60  # seconds an on-demand lookup serves a stored price without refreshing it
+COIN_REFRESH_DEDUPE = 60  # seconds one scheduled single-coin refresh holds off the others
+PriceChange = namedtuple("PriceChange", ["coin_id", "old_price", "new_price"])
+
+
+def chunked(items, size):
+    """Yield successive lists of at most `size` items."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
 def get_coin_prices(coin_ids):
-    url = "https://api.coingecko.com/api/v3/simple/price"
-    params = {"ids":",".join(coin_ids), "vs_currencies": "usd"}
-    response = requests.get(url, params=params)
-    response.raise_for_status()
-    return {k: v['usd'] for k, v in response.json().items()}
+    return get_provider().simple_prices(coin_ids)
 
 
-@shared_task(bind=True, max_retries=5)
-def update_coin_prices(self):
-    coins = Coin.objects.all()
-    if not coins:
-        print("⚠️ No coins in DB. Run populate_top_coins first.")
+def publish_price_changes(changes):
+    """
+    Fan a committed changed-set out to caches, alerts and the price feed.
+    Portfolio aggregates move with the price write itself (see
+    apply_coin_prices), not here.
+    """
+    if not changes:
         return
+    invalidate_prices()
+    triggered = evaluate_price_changes(changes)
+    publish_feed(changes, triggered)
 
-    coin_ids = [coin.coingecko_id for coin in coins]
-    url = "https://api.coingecko.com/api/v3/simple/price"
-    params = {"ids": ",".join(coin_ids), "vs_currencies": "usd"}
 
-    try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        prices = response.json()
+def apply_coin_prices(prices, timestamp=None):
+    """
+    Write `prices` ({coingecko_id: Decimal}) to the coins that track them.
+    Only rows whose price actually moved are updated, in a single
+    bulk_update inside one transaction that also applies the moves to the
+    portfolio aggregates; every observed price is also appended to the
+    PriceTick history.
+    Returns a list of PriceChange(coin_id, old_price, new_price).
+    """
+    if not prices:
+        return []
+
+    changes = []
+    changed_coins = []
+    with transaction.atomic():
+        coins = list(
+            Coin.objects.select_for_update()
+            .filter(coingecko_id__in=list(prices))
+            .order_by("id")
+            .only("id", "coingecko_id", "price")
+        )
+        record_ticks([(coin.id, prices[coin.coingecko_id]) for coin in coins], timestamp)
 
         for coin in coins:
-            if coin.coingecko_id in prices:
-                coin.price = Decimal(str(prices[coin.coingecko_id]["usd"]))
-                coin.save()
-                print(f"✅ Updated {coin.name} (${coin.price})")
-
-    except HTTPError as e:
-        if e.response.status_code == 429:
-            # Too many requests → back off and retry
-            delay = 60 * (self.request.retries + 1)
-            print(f"⚠️ Rate limited by API. Retrying in {delay} seconds...")
-            raise self.retry(exc=e, countdown=delay)
-        else:
-            print(f"❌ HTTP Error: {e}")
-            raise e
-
-    except (ConnectionError, Timeout) as e:
+            new_price = prices[coin.coingecko_id]
+            if coin.price == new_price:
+                continue
+            changes.append(PriceChange(coin.id, coin.price, new_price))
+            coin.price = new_price
+            changed_coins.append(coin)
+
+        if changed_coins:
+            Coin.objects.bulk_update(changed_coins, ["price"])
+            apply_price_changes(changes)
+
+    return changes
+
+
+@shared_task(bind=True, max_retries=5)
+def update_coin_prices(self, tier=None):
+    """
+    Refresh the tracked coins of refresh `tier` (every coin when None) from
+    CoinGecko, one simple/price call per chunk of ids, and return the
+    changed-set as a list of PriceChange. Calls go out under the refresh
+    priority of the outbound budget.
+
+    Only one refresh per tier runs at a time: the run holds its tier's
+    lease (every tier's for a full refresh, see refresh_leases) under its
+    job id, renewed after every chunk, and a run that finds one held by
+    another job skips. Tiers don't block each other.
+    """
+    coins = Coin.objects.exclude(coingecko_id="")
+    if tier is not None:
+        coins = coins.filter(refresh_tier=tier)
+    coin_ids = list(coins.order_by("id").values_list("coingecko_id", flat=True))
+    if not coin_ids:
+        if tier is None:
+            print("⚠️ No coins in DB. Run populate_top_coins first.")
+        if self.request.id:
+            # the admin endpoint claims the lease under the job id before queueing
+            release_price_refresh(self.request.id, tier)
+        return []
+
+    job_id = self.request.id or f"local-{uuid4()}"
+    lease = claim_price_refresh(job_id, tier)
+    if lease.holder != job_id:
+        print(f"⏭️ Price refresh of {lease.name} already in progress (job {lease.holder}), skipping")
+        return []
+
+    changes = []
+    try:
+        for chunk in chunked(coin_ids, PRICE_CHUNK_SIZE):
+            with priority(REFRESH):
+                prices = get_coin_prices(chunk)
+            # stamped when applied: rollup() has moved past the buckets of a long run's start
+            applied_at = now()
+            chunk_changes = apply_coin_prices(prices, timestamp=applied_at)
+            Coin.objects.filter(coingecko_id__in=chunk).update(refreshed_at=applied_at)
+            # publish per chunk: a retry after a later chunk fails will not see these moves again
+            publish_price_changes(chunk_changes)
+            changes.extend(chunk_changes)
+            if claim_price_refresh(job_id, tier).holder != job_id:
+                print("⚠️ Price refresh lease expired and was taken over, stopping")
+                break
+
+    except RateLimited as e:
+        # Too many requests → back off and retry
+        delay = max(e.retry_after or 0, 60 * (self.request.retries + 1))
+        print(f"⚠️ Rate limited by API. Retrying in {delay} seconds...")
+        raise self.retry(exc=e, countdown=delay)
+
+    except ProviderUnavailable as e:
         # Retry after 30 seconds if network fails
         print("⚠️ Network issue. Retrying in 30 seconds...")
         raise self.retry(exc=e, countdown=30)
@@ -56,83 +151,223 @@ def update_coin_prices(self):
     except Exception as e:
         print(f"❌ Unexpected error: {e}")
         raise e
+
+    finally:
+        release_price_refresh(job_id, tier)
+
+    add_task_rows(self.name, len(coin_ids))
+    print(f"✅ Updated {len(changes)} of {len(coin_ids)} {tier or 'tracked'} coins")
+    return changes
             
         
 
+def refresh_leases(tier=None):
+    """Lease names a refresh of `tier` holds: its own, or every tier's for a full refresh."""
+    return [f"{REFRESH_LEASE}:{name}" for name in ((tier,) if tier else (HOT, WARM, COLD))]
+
+
+def claim_price_refresh(job_id, tier=None):
+    """
+    Take (or renew) the refresh leases of `tier` for `job_id`, e.g. for a
+    job about to be enqueued, so concurrent triggers see it as running.
+    Returns a LeaseInfo: the first lease held by another job, whose refresh
+    is still in progress (the ones taken are then given back), or else one
+    of the leases now held by `job_id`.
+    """
+    leases = get_leases()
+    taken = []
+    for name in refresh_leases(tier):
+        lease = leases.acquire(name, job_id, REFRESH_LEASE_TTL)
+        if lease.holder != job_id:
+            for held in taken:
+                leases.release(held, job_id)
+            return lease
+        taken.append(name)
+    return lease
+
+
+def release_price_refresh(job_id, tier=None):
+    leases = get_leases()
+    for name in refresh_leases(tier):
+        leases.release(name, job_id)
+
+
 def get_top_coins(n=100):
     """
-    Fetch top `n` coins by market cap from CoinGecko.
-    Returns a list of coin IDs.
+    Fetch top `n` coins by market cap from the price provider.
+    Returns a list of CoinData.
     """
-    url = "https://api.coingecko.com/api/v3/coins/markets"
-    params = {
-        "vs_currency": "usd",
-        "order": "market_cap_desc",
-        "per_page": n,
-        "page": 1,
-    }
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-    except requests.RequestException as e:
+        return get_provider().top_coins(n)
+    except ProviderError as e:
         print(f"Error fetching top coins: {e}")
         return []
 
-    data = response.json()
-    return data  # return full data, not just IDs
 
 
+def upsert_coins(coins_data):
+    """
+    Create or update a Coin for every CoinData in one INSERT .. ON CONFLICT
+    statement; price moves of coins that already existed are published like
+    any refresh. Returns {coingecko_id: Coin}.
+    """
+    if not coins_data:
+        return {}
+
+    ids = [c.id for c in coins_data]
+    refreshed_at = now()
+    with transaction.atomic():
+        before = dict(
+            Coin.objects.select_for_update()
+            .filter(coingecko_id__in=ids)
+            .order_by("id")
+            .values_list("coingecko_id", "price")
+        )
+        Coin.objects.bulk_create(
+            [
+                Coin(coingecko_id=c.id, name=c.name, symbol=c.symbol, price=c.price, refreshed_at=refreshed_at)
+                for c in coins_data
+            ],
+            update_conflicts=True,
+            unique_fields=["coingecko_id"],
+            update_fields=["name", "symbol", "price", "refreshed_at"],
+        )
+        coins = Coin.objects.in_bulk(ids, field_name="coingecko_id")
+        changes = [
+            PriceChange(coin.id, before[cg_id], coin.price)
+            for cg_id, coin in coins.items()
+            if cg_id in before and before[cg_id] != coin.price
+        ]
+        apply_price_changes(changes)
+
+    invalidate_prices()  # new coins, names or symbols
+    index_coins(coins.values())
+    publish_price_changes(changes)
+    return coins
+
 
 def populate_top_coins(n=100):
-    url = "https://api.coingecko.com/api/v3/coins/markets"
-    params = {"vs_currency": "usd", "order": "market_cap_desc", "per_page": n, "page": 1}
-    response = requests.get(url, params=params)
-    response.raise_for_status()
-    coins_data = response.json()
-
-    for coin_data in coins_data:
-        coin, created = Coin.objects.update_or_create(
-            coingecko_id=coin_data["id"],  # Use unique ID
-            defaults={
-                "name": coin_data["name"],
-                "symbol": coin_data["symbol"].upper(),
-                "price": Decimal(str(coin_data["current_price"]))
-            }
-        )
-        action = "Created" if created else "Updated"
-        print(f"{action} {coin.name} ({coin.symbol}) - ${coin.price}")
+    with priority(BACKGROUND):
+        top = get_provider().top_coins(n)
+    coins = upsert_coins(top)
+    print(f"✅ Stored {len(coins)} top coins")
+
+
+def staleness(coin, at=None):
+    """Seconds since `coin`'s price was last refreshed, or None if it never was."""
+    if coin.refreshed_at is None:
+        return None
+    return max(0, int(((at or now()) - coin.refreshed_at).total_seconds()))
+
+
+def is_stale(coin, at=None):
+    age = staleness(coin, at)
+    return age is None or age > COIN_FRESH_FOR
 
 
 def fetch_coin_on_demand(coin_id):
+    """
+    The Coin of a CoinGecko id, stale-while-revalidate: a stored coin is
+    returned at once, and when its price is older than COIN_FRESH_FOR one
+    background refresh of it is scheduled. Only a coin that isn't stored
+    yet waits on the provider. Returns None for unknown coins and raises
+    RateLimited when the outbound budget sheds that lookup.
+    """
     from .models import Coin
     try:
         # check DB first by CoinGecko ID
-        return Coin.objects.get(coingecko_id__iexact=coin_id)
+        coin = Coin.objects.get(coingecko_id__iexact=coin_id)
     except Coin.DoesNotExist:
-        url = f"https://api.coingecko.com/api/v3/coins/{coin_id.lower()}"
-        response = requests.get(url)
+        try:
+            data = get_provider().coin_detail(coin_id)
+        except RateLimited:
+            raise  # over the outbound budget: not the same as an unknown coin
+        except ProviderError:
+            return None
 
-        if response.status_code == 200:
-            data = response.json()
+        if data is not None:
             coin = Coin.objects.create(
-                coingecko_id=data["id"],
-                name=data["name"],
-                symbol=data["symbol"].upper(),
-                price=Decimal(str(data["market_data"]["current_price"]["usd"]))
+                coingecko_id=data.id,
+                name=data.name,
+                symbol=data.symbol,
+                price=data.price,
+                refreshed_at=now(),
             )
             return coin
         return None
 
+    if is_stale(coin):
+        schedule_coin_refresh(coin)
+    return coin
+
+
+def schedule_coin_refresh(coin):
+    """
+    Enqueue refresh_coin_price for `coin` unless one was already scheduled
+    within COIN_REFRESH_DEDUPE seconds (by any process sharing the cache).
+    Returns whether this call enqueued it.
+    """
+    key = f"coin-refresh:{coin.id}"
+    if not cache.add(key, 1, timeout=COIN_REFRESH_DEDUPE):
+        return False
+    try:
+        refresh_coin_price.delay(coin.id)
+    except OperationalError as e:
+        cache.delete(key)
+        print(f"⚠️ Could not queue a price refresh of {coin.coingecko_id}: {e}")
+        return False
+    return True
+
+
+@shared_task()
+def refresh_coin_price(coin_id):
+    """
+    Refresh one coin ahead of its tier's schedule, for a lookup that found
+    its price stale. Runs under the background priority of the outbound
+    budget and gives up (the next stale lookup schedules another) when the
+    provider fails.
+    """
+    coin = Coin.objects.filter(id=coin_id).exclude(coingecko_id="").first()
+    if coin is None:
+        return []
+
+    try:
+        with priority(BACKGROUND):
+            prices = get_coin_prices([coin.coingecko_id])
+    except ProviderError as e:
+        print(f"⚠️ Could not refresh {coin.coingecko_id}: {e}")
+        return []
+    if coin.coingecko_id not in prices:
+        return []
+
+    # stamped when the price arrived, not when the (possibly long) wait for budget began
+    refreshed_at = now()
+
+    changes = apply_coin_prices(prices, timestamp=refreshed_at)
+    Coin.objects.filter(id=coin.id).update(refreshed_at=refreshed_at)
+    publish_price_changes(changes)
+    return changes
+
 @shared_task()
 def record_portfolio_snapshots():
-    today = now().date()
-    portfolios = Portfolio.objects.all()
-
-    for p in portfolios:
-        if p.coin and p.coin.price:
-            value = float(p.amount) * float(p.coin.price)
-            PortfolioHistory.objects.update_or_create(
-                portfolio=p,
-                date=today,
-                defaults={"value_usd": value}
-            )
+    stats = snapshot_portfolios()
+    add_task_rows(record_portfolio_snapshots.name, stats["rows"])
+    print(f"✅ Snapshot {stats['date']}: {stats['rows']} holdings in {stats['elapsed']}s ({stats['rows_per_sec']} rows/s)")
+    return {**stats, "date": stats["date"].isoformat()}
+
+
+@shared_task()
+def recompute_refresh_tiers():
+    """Re-rank coins into refresh tiers by current demand (see tracker.tiers)."""
+    moved = recompute_tiers()
+    print(f"✅ Recomputed refresh tiers, moved {moved}")
+    return moved
+
+
+@shared_task()
+def rollup_price_ticks():
+    """Roll ticks up into 1m/1h/1d candles, then apply the retention policy."""
+    written = {resolution: rollup(resolution) for resolution in RESOLUTIONS}
+    deleted = prune()
+    print(f"✅ Rolled up price ticks {written}, pruned {deleted} rows")
+    return {"written": written, "deleted": deleted}
@@ -0,0 +1,115 @@
+"""
+Batch valuation kernel.
+
+Holdings are valued all at once from arrays: amounts, the index of each
+holding's coin in a price vector, and that price vector. Money stays exact:
+amounts and prices (DecimalField(decimal_places=8)) become integers scaled
+by 10**8, so every value is an integer scaled by 10**16. Those arrays hold
+Python ints, since 20-digit amounts times 20-digit prices overflow int64.
+Floats are derived once from the exact values, for weights and JSON output.
+"""
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+
+
+SCALE = 10 ** 8  # units of amounts and prices
+VALUE_SCALE = SCALE * SCALE  # units of values
+CENT_UNITS = VALUE_SCALE // 100
+
+Valuation = namedtuple("Valuation", ["units", "values", "groups", "group_index", "total_units", "totals", "weights"])
+Holdings = namedtuple("Holdings", ["ids", "user_ids", "coin_ids", "coin_index", "amounts", "prices", "rows"])
+
+
+def to_units(decimals):
+    """Exact scaled-integer array of Decimal (or None) amounts/prices."""
+    return np.array(
+        [int((Decimal(str(d or 0)) * SCALE).to_integral_value(ROUND_HALF_UP)) for d in decimals],
+        dtype=object,
+    )
+
+
+def as_floats(units, scale=VALUE_SCALE):
+    # int / int is correctly rounded, unlike converting the int to float first
+    return (units / scale).astype(np.float64) if len(units) else np.zeros(0)
+
+
+def as_decimals(units, places=16):
+    """Exact Decimals of scaled integers (values have 16 places, amounts/prices 8)."""
+    return [Decimal(int(u)).scaleb(-places) for u in units]
+
+
+def as_cents(units):
+    """Values rounded half-up to whole cents, as Decimals."""
+    half = CENT_UNITS // 2
+    cents = np.where(units < 0, -((-units + half) // CENT_UNITS), (units + half) // CENT_UNITS)
+    return [Decimal(int(c)).scaleb(-2) for c in cents]
+
+
+def value_holdings(amounts, coin_index, prices, groups=None):
+    """
+    Value holdings in one pass. `amounts` and `prices` are scaled-integer
+    arrays (see to_units), `coin_index[i]` the position of holding i's coin
+    in `prices`, and `groups` an optional key per holding (e.g. user id).
+
+    Returns a Valuation: exact `units` and float `values` per holding, the
+    unique `groups` with each holding's `group_index`, exact `total_units`
+    and float `totals` per group, and each holding's `weights` in its group.
+    """
+    coin_index = np.asarray(coin_index, dtype=np.int64)
+    units = amounts * prices[coin_index] if len(coin_index) else np.zeros(0, dtype=object)
+    values = as_floats(units)
+
+    if groups is None:
+        groups = np.zeros(len(units), dtype=np.int64)
+    unique, group_index = np.unique(np.asarray(groups), return_inverse=True)
+    total_units = np.zeros(len(unique), dtype=object)
+    np.add.at(total_units, group_index, units)
+    totals = as_floats(total_units)
+
+    denominators = totals[group_index]
+    weights = np.divide(values, denominators, out=np.zeros(len(values)), where=denominators != 0)
+    return Valuation(units, values, unique, group_index, total_units, totals, weights)
+
+
+def value_one(amount, price):
+    """Valuation of a single holding, e.g. one instance being saved."""
+    return value_holdings(to_units([amount]), [0], to_units([price]))
+
+
+def load_holdings(queryset, *fields):
+    """
+    Holdings of a Portfolio queryset as kernel inputs, in one query: ids,
+    user ids, the distinct coin ids with each holding's `coin_index` into
+    them, scaled `amounts`, and the rows of any extra `fields`. `prices`
+    come from the price snapshot of the request (see tracker.prices).
+    """
+    from .prices import current_prices
+
+    rows = list(queryset.values_list("id", "user_id", "coin_id", "amount", *fields))
+    if not rows:
+        empty = np.zeros(0, dtype=np.int64)
+        return Holdings(empty, empty, empty, empty, np.zeros(0, dtype=object), np.zeros(0, dtype=object), [])
+
+    ids, user_ids, coin_ids, amounts = (list(column) for column in zip(*(row[:4] for row in rows)))
+    unique_coins, coin_index = np.unique(np.array(coin_ids, dtype=np.int64), return_inverse=True)
+    return Holdings(
+        np.array(ids, dtype=np.int64),
+        np.array(user_ids, dtype=np.int64),
+        unique_coins,
+        coin_index,
+        to_units(amounts),
+        current_prices(unique_coins).units_of(unique_coins),
+        [row[4:] for row in rows],
+    )
+
+
+def value_queryset(queryset, *fields, group_by_user=False):
+    """load_holdings() + value_holdings(); returns (holdings, valuation)."""
+    holdings = load_holdings(queryset, *fields)
+    valuation = value_holdings(
+        holdings.amounts, holdings.coin_index, holdings.prices,
+        groups=holdings.user_ids if group_by_user else None,
+    )
+    return holdings, valuation
@@ -1,6 +1,28 @@
-from django.shortcuts import render
+import asyncio
+import hashlib
+import json
+import math
+from datetime import timedelta
+from urllib.parse import urlencode
+from uuid import uuid4
+
+import numpy as np
+
+from asgiref.sync import sync_to_async
+from celery import states
+from celery.result import AsyncResult
+from kombu.exceptions import OperationalError
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import render, get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date
+from django.utils.dateparse import parse_date
 from django.utils.timezone import now
-from django.db.models import Q
 
 # DRF modules
 from rest_framework import generics, filters
@@ -11,23 +33,42 @@ from rest_framework.response import Response
 from rest_framework import status
 # from rest_framework.permissions import IsAuthenticated
 from rest_framework import permissions
-from rest_framework.exceptions import ValidationError
-
-import requests
+from rest_framework.exceptions import ValidationError, AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
 
 # App modules
 from accounts.permissions import IsOwner
-from .models import Coin, Portfolio, PortfolioHistory, Watchlist
+from .models import Coin, Portfolio, PortfolioAggregate, PortfolioHistory, Watchlist
 from .serializers import CoinSerializer, PortfolioSerializer, WatchlistSerializer
-from .utils import update_coin_prices
-from .utils import fetch_coin_on_demand
-from . pagination import StandardResultSetPagination
+from .utils import update_coin_prices, claim_price_refresh, refresh_leases, release_price_refresh
+from .utils import fetch_coin_on_demand, is_stale, staleness, upsert_coins
+from .leases import get_leases
+from .providers import get_provider, ProviderError, RateLimited
+from . pagination import StandardResultSetPagination, KeysetPagination
+from .analytics import load_holding_series, load_user_series, performance_metrics
+from .downsampling import (
+    as_points, downsample, downsampled_history,
+    RESOLUTIONS as DOWNSAMPLE_RESOLUTIONS, MIN_POINTS as DOWNSAMPLE_MIN_POINTS, MAX_POINTS as DOWNSAMPLE_MAX_POINTS,
+)
+from .cache import price_version, shared_cache
+from .prices import current_prices
+from .exports import stream_export, EXPORT_CHUNK_SIZE, FORMATS as EXPORT_FORMATS
+from .search import CoinIndexSearchFilter, search_coins
+from .valuation import SCALE, as_cents, as_floats, value_one, value_queryset
+from .snapshots import snapshot_portfolios
+from .streaming import broadcaster
+from . import metrics as request_metrics
+from .ticks import price_series
 from alerts.models import Alert
 
 
 # Create your views here.
-
-COINGECKO_BASE = "https://api.coingecko.com/api/v3"
+SEARCH_RESULT_LIMIT = 5
+SEARCH_DEADLINE = 5  # seconds allowed for all coin detail fetches of one search
+COIN_LIST_CACHE_TTL = 60 * 10  # rendered coin pages; a version bump retires them sooner
+SEARCH_LOCAL_LIMIT = 25  # local matches returned; browse beyond that with /coins/?search=
+PRICE_HISTORY_MAX_HOURS = 24 * 365 * 10  # daily candles are kept forever; ten years is plenty
 
 
 class CoinListView(generics.ListAPIView):
@@ -35,11 +76,47 @@ class CoinListView(generics.ListAPIView):
     serializer_class = CoinSerializer
     
     # permission_classes = [IsAuthenticated]
-    pagination_class = StandardResultSetPagination
+    pagination_class = KeysetPagination
     
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, CoinIndexSearchFilter, filters.OrderingFilter]
     search_fields = ["name", "symbol"]
     ordering_fields = ["price", "name"]
+    ordering = ["name"]
+
+    def list(self, request, *args, **kwargs):
+        """
+        JSON pages are rendered once per (price version, query string) and
+        served from the cache until the next refresh bumps the version.
+        A strong ETag / Last-Modified let pollers revalidate with a 304.
+        """
+        if request.accepted_renderer.format != "json":
+            return super().list(request, *args, **kwargs)
+
+        # read the version before the rows, so a body is never newer-labelled than its data
+        version, modified = price_version()
+        # pagination links in the body are absolute, so the host is part of the key
+        query = urlencode(sorted(request.query_params.lists()), doseq=True)
+        digest = hashlib.sha1(f"{request.build_absolute_uri('/')}?{query}".encode()).hexdigest()[:16]
+        etag = f'"coins-{version}-{digest}"'
+
+        response = get_conditional_response(request, etag=etag, last_modified=modified)
+        if response is None:
+            key = f"coins:list:{version}:{digest}"
+            body = cache.get(key)
+            if body is None:
+                body = request.accepted_renderer.render(super().list(request, *args, **kwargs).data)
+                cache.set(key, body, COIN_LIST_CACHE_TTL)
+            response = HttpResponse(body, content_type="application/json")
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(modified)
+        response["Cache-Control"] = "no-cache"
+        return response
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if getattr(self, "search_truncated", False):
+            response.data["search_truncated"] = True
+        return response
     
     
     
@@ -47,16 +124,20 @@ class CoinListView(generics.ListAPIView):
 class CoinDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Coin.objects.all()
     serializer_class = CoinSerializer
+    # price edits are applied and published by the Coin save signals
 
 class WatchlistListCreateView(generics.ListCreateAPIView):
     serializer_class = WatchlistSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+    ordering = ["-date_added"]
 
     def get_queryset(self):
         user = self.request.user
+        queryset = Watchlist.objects.select_related("coin").with_in_portfolio(user)
         if user.is_staff or user.is_superuser:
-            return Watchlist.objects.all()
-        return Watchlist.objects.filter(user=user)
+            return queryset
+        return queryset.filter(user=user)
 
     def perform_create(self, serializer):
         user = self.request.user
@@ -89,125 +170,222 @@ class WatchlistDetailView(generics.RetrieveDestroyAPIView):
 
     def get_queryset(self):
         user = self.request.user
+        queryset = Watchlist.objects.select_related("coin").with_in_portfolio(user)
         if user.is_staff or user.is_superuser:
-            return Watchlist.objects.all()
-        return Watchlist.objects.filter(user=user)
+            return queryset
+        return queryset.filter(user=user)
+
+
+
+def rate_limited(exc, message):
+    """429 for a RateLimited provider call: over the outbound budget (or upstream said so), with when to come back."""
+    return Response(
+        {"error": message},
+        status=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": str(exc.retry_after or 1)},
+    )
 
 
+def refresh_job_handle(request, job_id):
+    return {
+        "job_id": job_id,
+        "status_url": request.build_absolute_uri(reverse("refresh-job", args=[job_id])),
+    }
+
 
 @api_view(["GET", "POST"])
 @permission_classes([permissions.IsAdminUser])
 def refresh_coin_prices(request):
-    
+    """
+    POST enqueues a refresh of every coin and answers 202 with its job
+    handle, or 409 with the handle of the refresh already in progress.
+    GET reports the longest-running refresh in progress (of any tier), if any.
+    """
+    if request.method == "GET":
+        held = get_leases().held(refresh_leases())
+        if not held:
+            return Response({"in_progress": False})
+        lease = held[0]
+        return Response({
+            "in_progress": True, "since": lease.acquired_at, "lease": lease.name,
+            **refresh_job_handle(request, lease.holder),
+        })
+
+    job_id = str(uuid4())
+    lease = claim_price_refresh(job_id)
+    if lease.holder != job_id:
+        return Response(
+            {"error": "A price refresh is already in progress", **refresh_job_handle(request, lease.holder)},
+            status=status.HTTP_409_CONFLICT,
+        )
     try:
-        update_coin_prices()
-        return Response({"message": "Coin prices updated successfully!"}, status=status.HTTP_200_OK)
-    except Exception as e:
-        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    
+        update_coin_prices.apply_async(task_id=job_id)
+    except OperationalError as e:
+        release_price_refresh(job_id)
+        return Response({"error": f"Could not queue the refresh: {e}"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response(
+        {"message": "Price refresh queued", **refresh_job_handle(request, job_id)},
+        status=status.HTTP_202_ACCEPTED,
+    )
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAdminUser])
+def refresh_job_status(request, job_id):
+    """State of a refresh job: Celery's state, whether it holds the lease, and its result once done."""
+    result = AsyncResult(job_id)
+    state = result.state  # one read; finished results are cached by AsyncResult
+    in_progress = any(lease.holder == job_id for lease in get_leases().held(refresh_leases()))
+    data = {"job_id": job_id, "state": state, "in_progress": in_progress}
+    if state == states.SUCCESS:
+        data["changed"] = len(result.result or [])
+    elif state == states.FAILURE:
+        data["error"] = str(result.result)
+    return Response(data)
+
 
 
 @api_view(["GET"])
 def get_coin(request, coin_id):
-    coin = fetch_coin_on_demand(coin_id)
+    """
+    A coin by CoinGecko id, with how old its price is: `staleness` in
+    seconds (None if never refreshed), and `stale` once it is past the
+    freshness window and a background refresh has been scheduled.
+    """
+    try:
+        coin = fetch_coin_on_demand(coin_id)
+    except RateLimited as e:
+        return rate_limited(e, "Coin lookup is busy, try again shortly")
     if coin:
         return Response({
             "name": coin.name,
             "symbol": coin.symbol,
-            "price": str(coin.price)
+            "price": str(coin.price),
+            "refreshed_at": coin.refreshed_at,
+            "staleness": staleness(coin),
+            "stale": is_stale(coin),
         })
     return Response({"error": "Coin not found"}, status=404)
 
 
+@api_view(["GET"])
+def coin_price_history(request, pk):
+    coin = get_object_or_404(Coin, pk=pk)
+    try:
+        hours = float(request.GET.get("hours", 24))
+        max_points = int(request.GET.get("max_points", 500))
+    except ValueError:
+        return Response({"error": "hours and max_points must be numbers"}, status=400)
+    if not math.isfinite(hours) or not 0 < hours <= PRICE_HISTORY_MAX_HOURS or max_points <= 0:
+        return Response(
+            {"error": f"hours must be between 0 and {PRICE_HISTORY_MAX_HOURS}, and max_points positive"},
+            status=400,
+        )
+
+    resolution, candles = price_series(coin, now() - timedelta(hours=hours), max_points=max_points)
+    return Response({
+        "coin": coin.symbol,
+        "resolution": resolution,
+        "candles": candles,
+    })
+
+
 @api_view(["GET"])
 def search_coin(request):
     query = request.GET.get("query", "").strip()
     if not query:
         return Response({"error": "Query parameter is required"}, status=400)
 
-    # 1. Check local DB
-    local_matches = Coin.objects.filter(
-        Q(name__icontains=query) | Q(symbol__icontains=query)
-    )
-    if local_matches.exists():
-        serializer = CoinSerializer(local_matches, many=True)
-        return Response(serializer.data)
-
-    # 2. Search CoinGecko
-    search_url = f"{COINGECKO_BASE}/search?query={query}"
-    resp = requests.get(search_url)
-    if resp.status_code != 200:
+    # 1. Check local DB; only exact, prefix or substring hits skip the provider,
+    # a fuzzy near-miss ("bitcoinz" for Bitcoin) may well be another coin upstream
+    local_ids = search_coins(query, limit=SEARCH_LOCAL_LIMIT, fuzzy=False)
+    if local_ids:
+        local_matches = Coin.objects.in_bulk(local_ids)
+        serializer = CoinSerializer([local_matches[i] for i in local_ids if i in local_matches], many=True)
+        if serializer.data:
+            return Response(serializer.data)
+
+    # 2. Search the price provider
+    provider = get_provider()
+    try:
+        coin_ids = provider.search(query)
+    except RateLimited as e:
+        return rate_limited(e, "Coin search is busy, try again shortly")
+    except ProviderError:
         return Response({"error": "Failed to fetch from CoinGecko"}, status=500)
 
-    data = resp.json()
-    coins = data.get("coins", [])
-    if not coins:
+    if not coin_ids:
         return Response({"error": "Coin not found"}, status=404)
 
-    results = []
-    for c in coins[:5]:  # limit to top 5 results
-        cg_id = c["id"]
-        detail_url = f"{COINGECKO_BASE}/coins/{cg_id}"
-        detail_resp = requests.get(detail_url)
-
-        if detail_resp.status_code != 200:
-            continue
-
-        detail = detail_resp.json()
-        price = detail.get("market_data", {}).get("current_price", {}).get("usd", 0)
-
-        coin, _ = Coin.objects.update_or_create(
-            coingecko_id=cg_id,
-            defaults={
-                "name": detail["name"],
-                "symbol": detail["symbol"].upper(),
-                "price": price,
-            },
-        )
-        results.append(CoinSerializer(coin).data)
+    coin_ids = coin_ids[:SEARCH_RESULT_LIMIT]
+    details = provider.coin_details(coin_ids, deadline=SEARCH_DEADLINE)
+    coins = upsert_coins([details[cg_id] for cg_id in coin_ids if cg_id in details])
 
+    results = [CoinSerializer(coins[cg_id]).data for cg_id in coin_ids if cg_id in coins]
     return Response(results)
 
 
 
 
 
-class PortfolioListCreateView(generics.ListCreateAPIView):
-    # queryset = Portfolio.objects.all()
+HISTORY_LIMIT_DEFAULT = 30
+HISTORY_LIMIT_MAX = 365
+
+
+class PortfolioQuerysetMixin:
+    """
+    Holdings visible to the requester, annotated with their valuation and,
+    with ?include_history=true, at most ?history_limit= latest snapshots each,
+    optionally downsampled with ?resolution= / ?max_points=.
+    """
+
+    def include_history(self):
+        return self.request.query_params.get("include_history", "").lower() in ("1", "true", "yes")
+
+    def history_limit(self):
+        try:
+            limit = int(self.request.query_params.get("history_limit", HISTORY_LIMIT_DEFAULT))
+        except ValueError:
+            raise ValidationError({"history_limit": "Must be an integer."})
+        return max(1, min(limit, HISTORY_LIMIT_MAX))
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = Portfolio.objects.select_related("coin", "user").with_valuation().order_by("id")
+        if not (user.is_staff or user.is_superuser):
+            queryset = queryset.filter(user=user)
+        if self.include_history():
+            queryset = queryset.with_recent_history(self.history_limit())
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.include_history():
+            context["include_history"] = True
+            context["history_limit"] = self.history_limit()
+            context["history_resolution"], context["history_max_points"] = downsampling_params(self.request)
+        return context
+
+
+class PortfolioListCreateView(PortfolioQuerysetMixin, generics.ListCreateAPIView):
     serializer_class = PortfolioSerializer
     
     permission_classes = [permissions.IsAuthenticated]
     
-    
-    def get_queryset(self):
-        user = self.request.user
-        if user.is_staff or user.is_superuser:
-            return Portfolio.objects.all()
-        
-        return Portfolio.objects.filter(user=self.request.user)
-    
     def perform_create(self, serializer):
         # serializer.save(user=self.request.user)
         portfolio = serializer.save(user=self.request.user)
         # take first snapshot
         PortfolioHistory.objects.create(
             portfolio=portfolio,
-            value_usd=portfolio.amount * portfolio.coin.price
+            value_usd=as_cents(value_one(portfolio.amount, portfolio.coin.price).units)[0]
         )
     
 
-class PortfolioDetailView(generics.RetrieveUpdateDestroyAPIView):
-    # queryset = Portfolio.objects.all()
+class PortfolioDetailView(PortfolioQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = PortfolioSerializer
     
     permission_classes = [permissions.IsAuthenticated, IsOwner]
-    
-    def get_queryset(self):
-        user = self.request.user
-        if user.is_staff or user.is_superuser:
-            return Portfolio.objects.all()
-        
-        return Portfolio.objects.filter(user=self.request.user)
         
     
     
@@ -215,26 +393,26 @@ class PortfolioDetailView(generics.RetrieveUpdateDestroyAPIView):
 @api_view(["GET"])
 @permission_classes([permissions.IsAuthenticated])
 def portfolio_summary(request):
-    Portfolios = Portfolio.objects.all()
-    total_value = 0
-    breakdown = []
-    
-    for p in Portfolios:
-        if p.coin and p.coin.price:
-            value = float(p.amount) * float(p.coin.price)
-            total_value += value
-            breakdown.append({
-                "coin": p.coin.name,
-                "symbol": p.coin.symbol.upper(),
-                "amount": float(p.amount),
-                "value_usd": value,
-            })
-            
-    breakdown.sort(key=lambda x: x["value_usd"], reverse=True)
+    holdings, valuation = value_queryset(
+        Portfolio.objects.filter(user=request.user).order_by("id"),
+        "coin__name", "coin__symbol",
+    )
+    # most valuable first, ties by id (stable sort of id-ordered rows)
+    order = np.argsort(-valuation.values, kind="stable")
+
+    breakdown = [
+        {
+            "coin": holdings.rows[i][0],
+            "symbol": holdings.rows[i][1].upper(),
+            "amount": float(holdings.amounts[i] / SCALE),
+            "value_usd": float(valuation.values[i]),
+        }
+        for i in order
+    ]
     
     return Response({
-        "total_value_usd": total_value,
-        "holdings_count": Portfolios.count(),
+        "total_value_usd": float(valuation.totals.sum()),
+        "holdings_count": len(breakdown),
         "breakdown": breakdown,
         
     })
@@ -243,39 +421,134 @@ def portfolio_summary(request):
 
 
 @api_view(["GET"])
+@permission_classes([permissions.IsAuthenticated])
+def portfolio_dashboard(request):
+    """Totals maintained by tracker.aggregates; ?group=<portfolio name> narrows to one group."""
+    group = request.GET.get("group", "")
+    aggregate = (
+        PortfolioAggregate.objects.select_related("top_holding__coin")
+        .filter(user=request.user, name=group)
+        .first()
+    )
+    if aggregate is None or aggregate.asset_count == 0:
+        return Response({
+            "group": group or None,
+            "total_value_usd": 0,
+            "number_of_assets": 0,
+            "top_holding": None,
+            "updated_at": aggregate.updated_at if aggregate else None,
+        })
+
+    top = aggregate.top_holding
+    return Response({
+        "group": group or None,
+        "total_value_usd": float(aggregate.total_value),
+        "number_of_assets": aggregate.asset_count,
+        "top_holding": {
+            "coin": top.coin.name,
+            "quantity": float(top.amount),
+            "value": float(aggregate.top_value),
+        } if top else None,
+        "updated_at": aggregate.updated_at,
+    })
+
+
+
+
+def downsampling_params(request):
+    """Parse ?resolution=day|week|month and ?max_points=<n> for history series."""
+    params = request.query_params
+    resolution = params.get("resolution") or None
+    if resolution is not None and resolution not in DOWNSAMPLE_RESOLUTIONS:
+        raise ValidationError({"resolution": f"Must be one of {', '.join(DOWNSAMPLE_RESOLUTIONS)}."})
+    try:
+        max_points = int(params["max_points"]) if params.get("max_points") else None
+    except ValueError:
+        raise ValidationError({"max_points": "Must be an integer."})
+    if max_points is not None and not (DOWNSAMPLE_MIN_POINTS <= max_points <= DOWNSAMPLE_MAX_POINTS):
+        raise ValidationError({"max_points": f"Must be between {DOWNSAMPLE_MIN_POINTS} and {DOWNSAMPLE_MAX_POINTS}."})
+    return resolution, max_points
+
+
+def performance_metrics_params(request):
+    """
+    Parse the analytics query parameters: ?metrics=true enables the
+    summary statistics, ?window=<n> adds rolling windows (implies metrics)
+    and ?risk_free=<annual rate> feeds Sharpe/Sortino.
+    """
+    params = request.query_params
+    wanted = params.get("metrics", "").lower() in ("1", "true", "yes") or "window" in params
+    try:
+        window = int(params["window"]) if "window" in params else None
+        risk_free = float(params.get("risk_free", 0))
+    except ValueError:
+        raise ValidationError("window must be an integer and risk_free a number.")
+    if window is not None and window < 2:
+        raise ValidationError({"window": "Must be at least 2."})
+    return wanted, {"window": window, "risk_free": risk_free}
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAuthenticated])
 def portfolio_performance(request, portfolio_id):
     
-    portfolio = Portfolio.objects.get(id=portfolio_id)
-    if not (request.user.is_staff or portfolio.user == request.user):
+    portfolio = get_object_or_404(Portfolio.objects.select_related("coin"), id=portfolio_id)
+    if not (request.user.is_staff or portfolio.user_id == request.user.id):
         return Response({"error": "Forbidden"}, status=403)
 
-    try:
-        history = PortfolioHistory.objects.filter(portfolio_id=portfolio_id).order_by("date")
-        if not history.exists():
-            return Response({"Error": "No History yet"})
+    wanted, options = performance_metrics_params(request)
+    resolution, max_points = downsampling_params(request)
+    if wanted:
+        dates, values = load_holding_series(portfolio_id)
+        history = downsampled_history(portfolio_id, resolution, max_points, series=(dates, values))
+        first = values[0] if len(values) else None
+    else:
+        # no metrics: the (cached) downsampled points and the first snapshot are all we need
+        history = downsampled_history(portfolio_id, resolution, max_points)
+        first = (
+            PortfolioHistory.objects.filter(portfolio_id=portfolio_id)
+            .order_by("date")
+            .values_list("value_usd", flat=True)
+            .first()
+        )
+    if first is None:
+        return Response({"Error": "No History yet"})
+
+    initial_value = float(first)
+    price = current_prices([portfolio.coin_id]).price(portfolio.coin_id)
+    current_value = float(value_one(portfolio.amount, price).values[0])
+
+    data = {
+        "coin": portfolio.coin.symbol,
+        "current_price": price,
+        "initial_value": initial_value,
+        "current_value": current_value,
+        "usd_growth": current_value - initial_value,
+        "pct_growth": (
+            ((current_value - initial_value) / initial_value) * 100
+            if initial_value > 0 else 0
+        ),
+        "history": history,
+    }
+    if wanted:
+        data["metrics"] = performance_metrics(dates, values, **options)
+    return Response(data)
 
-        first = history.first()
-        portfolio = first.portfolio  
-    
-        current_value = float(portfolio.amount) * float(portfolio.coin.price)
 
-        return Response({
-            "coin": portfolio.coin.symbol,
-            "current_price": portfolio.coin.price,
-            "initial_value": float(first.value_usd),
-            "current_value": current_value,
-            "usd_growth": current_value - float(first.value_usd),
-            "pct_growth": (
-                ((current_value - float(first.value_usd)) / float(first.value_usd)) * 100
-                if float(first.value_usd) > 0 else 0
-            ),
-            "history": [
-                {"date": h.date, "value_usd": float(h.value_usd)}
-                for h in history
-            ]
-        })
-    except PortfolioHistory.DoesNotExist:
-        return Response({"error": "Portfolio not found"}, status=404)
+@api_view(["GET"])
+@permission_classes([permissions.IsAuthenticated])
+def combined_performance(request):
+    """Analytics over the requester's summed daily value across all holdings."""
+    _, options = performance_metrics_params(request)
+    resolution, max_points = downsampling_params(request)
+    dates, values = load_user_series(request.user)
+    if not len(values):
+        return Response({"Error": "No History yet"})
+
+    return Response({
+        "history": as_points(*downsample(dates, values, resolution, max_points)),
+        "metrics": performance_metrics(dates, values, **options),
+    })
 
 
 
@@ -285,61 +558,199 @@ def portfolio_performance(request, portfolio_id):
 @api_view(["POST"])
 @permission_classes([permissions.IsAdminUser])
 def record_portfolio_snapshots(request):
-    portfolios = Portfolio.objects.all()
-    snapshots = []
-
-    for p in portfolios:
-        if p.coin and p.coin.price:
-            value = float(p.amount) * float(p.coin.price)
-            snapshot, created = PortfolioHistory.objects.get_or_create(
-                portfolio=p,
-                date=now().date(),
-                defaults={"value_usd": value}
-            )
-            if not created:
-                snapshot.value_usd = value
-                snapshot.save()
-            snapshots.append({
-                "portfolio": p.id,
-                "coin": p.coin.symbol,
-                "value_usd": value
-            })
-
-    return Response({"snapshots": snapshots})
+    return Response({"snapshots": snapshot_portfolios()})
 
 
 
 @permission_classes([permissions.IsAuthenticated])
 class PortfolioInsightView(APIView):
     def get(self, request):
-        portfolio = Portfolio.objects.filter(user=request.user).select_related("coin")
-        holdings = []
-        total_value = 0
-        
-        for p in portfolio:
-            value = float(p.amount) * float(p.coin.price)
-            holdings.append({
-                "coin": p.coin.name,
-                "quantity": float(p.amount),
-                "price": float(p.coin.price),
-                'value':value
-            })
-            
-            total_value += value
-            
-        for h in holdings:
-            h["percentage"] = (h["value"] / total_value * 100) if total_value > 0 else 0
-            
-        
-        top_holding = max(holdings, key=lambda x: x["value"], default=None)
+        holdings, valuation = value_queryset(
+            Portfolio.objects.filter(user=request.user).order_by("id"), "coin__name",
+        )
+        prices = as_floats(holdings.prices, SCALE)
+        amounts = as_floats(holdings.amounts, SCALE)
+        total_value = float(valuation.totals.sum())
+
+        holdings_data = [
+            {
+                "coin": holdings.rows[i][0],
+                "quantity": float(amounts[i]),
+                "price": float(prices[holdings.coin_index[i]]),
+                "value": float(valuation.values[i]),
+                "percentage": float(valuation.weights[i] * 100),
+            }
+            for i in range(len(holdings.ids))
+        ]
+        top_holding = holdings_data[int(np.argmax(valuation.values))] if holdings_data else None
         
         
         data = {
             "total_value_usd": total_value,
-            "number_of_assets": len(holdings),
+            "number_of_assets": len(holdings_data),
             "top_holding": top_holding,
-            "holdings": holdings
+            "holdings": holdings_data
             
         }
         
-        return Response(data)
\ No newline at end of file
+        return Response(data)
+
+
+
+
+def export_output(request):
+    output = request.query_params.get("output", "csv").lower()
+    if output not in EXPORT_FORMATS:
+        raise ValidationError({"output": f"Must be one of {', '.join(EXPORT_FORMATS)}."})
+    return output
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAuthenticated])
+def export_holdings(request):
+    """Stream the requester's holdings as ?output=csv (default) or ndjson."""
+    output = export_output(request)
+    rows = (
+        Portfolio.objects.filter(user=request.user)
+        .order_by("id")
+        .values_list("id", "name", "coin__symbol", "coin__name", "amount", "coin__price", "created_at")
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    header = ["id", "name", "symbol", "coin", "amount", "price", "value_usd", "created_at"]
+    return stream_export(
+        "holdings",
+        header,
+        ((pk, name, symbol, coin, amount, price, amount * price, created) for pk, name, symbol, coin, amount, price, created in rows),
+        output,
+    )
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAuthenticated])
+def export_history(request):
+    """
+    Stream the requester's PortfolioHistory as ?output=csv (default) or
+    ndjson, optionally narrowed with ?portfolio=<id>, ?start= and ?end= (YYYY-MM-DD).
+    """
+    output = export_output(request)
+    history = PortfolioHistory.objects.filter(portfolio__user=request.user)
+
+    params = request.query_params
+    if params.get("portfolio"):
+        try:
+            history = history.filter(portfolio_id=int(params["portfolio"]))
+        except ValueError:
+            raise ValidationError({"portfolio": "Must be a portfolio id."})
+    for param, lookup in (("start", "date__gte"), ("end", "date__lte")):
+        if params.get(param):
+            day = parse_date(params[param])
+            if day is None:
+                raise ValidationError({param: "Must be a YYYY-MM-DD date."})
+            history = history.filter(**{lookup: day})
+
+    rows = (
+        history.order_by("portfolio_id", "date")
+        .values_list("portfolio_id", "portfolio__coin__symbol", "date", "value_usd")
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    return stream_export("portfolio_history", ["portfolio", "symbol", "date", "value_usd"], rows, output)
+
+
+
+
+STREAM_KEEPALIVE = 15  # seconds of silence before a comment line keeps proxies from closing the stream
+STREAM_MAX_COINS = 500
+
+
+async def stream_user(request):
+    """
+    Session user, or the user of a JWT from the Authorization header or
+    ?token= (browsers' EventSource cannot send headers). None if anonymous.
+    """
+    user = await request.auser()
+    if user.is_authenticated:
+        return user
+    auth = JWTAuthentication()
+    try:
+        if request.GET.get("token"):
+            return await sync_to_async(auth.get_user)(auth.get_validated_token(request.GET["token"]))
+        result = await sync_to_async(auth.authenticate)(request)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    return result[0] if result else None
+
+
+def sse(event, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data, cls=DjangoJSONEncoder)}"]
+    return "\n".join(lines) + "\n\n"
+
+
+async def price_events(user_id, coin_ids):
+    subscription = broadcaster.subscribe(coin_ids, user_id)
+    try:
+        # subscribed before reading the snapshot, so no tick falls in between
+        prices = {
+            coin_id: str(price)
+            async for coin_id, price in Coin.objects.filter(id__in=coin_ids).values_list("id", "price")
+        }
+        yield sse("snapshot", {"prices": prices})
+        while True:
+            try:
+                seq, prices, alerts = await subscription.next(timeout=STREAM_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if prices:
+                yield sse("prices", {"prices": prices}, seq)
+            if alerts:
+                yield sse("alerts", {"alerts": alerts}, seq)
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+
+async def stream_prices(request):
+    """
+    Server-Sent Events stream of the prices of ?coins=<id>,<id>,... (default:
+    the requester's watchlist) and of the requester's triggered alerts: a
+    `snapshot` event first, then `prices` / `alerts` events after every
+    refresh. Needs the ASGI entry point (portfolio.asgi).
+    """
+    user = await stream_user(request)
+    if user is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+    shared_cache()  # updates come from other processes through it; refuse before the stream starts
+
+    if request.GET.get("coins"):
+        try:
+            coin_ids = {int(coin_id) for coin_id in request.GET["coins"].split(",") if coin_id.strip()}
+        except ValueError:
+            return JsonResponse({"coins": "Must be a comma-separated list of coin ids."}, status=400)
+    else:
+        coin_ids = {coin_id async for coin_id in Watchlist.objects.filter(user=user).values_list("coin_id", flat=True)}
+
+    response = StreamingHttpResponse(
+        price_events(user.id, sorted(coin_ids)[:STREAM_MAX_COINS]),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # nginx would otherwise buffer the stream
+    return response
+
+
+def metrics(request):
+    """
+    Prometheus scrape target: request, provider and Celery task metrics of
+    every process (see tracker.metrics), whichever web process answers.
+    Scrapers authenticate with settings.METRICS_TOKEN; without a token the
+    endpoint is only served with DEBUG on.
+    """
+    token = getattr(settings, "METRICS_TOKEN", None)
+    if token:
+        header = request.headers.get("Authorization", "")
+        if not constant_time_compare(header, f"Bearer {token}"):
+            return HttpResponse(status=401)
+    elif not settings.DEBUG:
+        return HttpResponse(status=403)
+    return HttpResponse(request_metrics.render(), content_type=request_metrics.CONTENT_TYPE)
+